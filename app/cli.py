@@ -0,0 +1,325 @@
+"""Headless batch grading.
+
+Usage:
+    python -m app.cli evaluate SCANS_DIR_OR_ZIP --out results.csv [--template t.json]
+        [--key key.xlsx --key-sheet A] [--sheet-version A] [--workers N] [--db]
+        [--shard i/N]
+    python -m app.cli merge 'results.shard*.csv' --out summary.xlsx [--input SCANS] [--db]
+    python -m app.cli rescore results.csv --key key.xlsx --out rescored.csv
+    python -m app.cli migrate-answers
+    python -m app.cli rebuild-summary
+    python -m app.cli init-db
+
+Results are written row by row (CSV, Excel, or columnar Parquet with pyarrow: one
+uint8 answer-code column per question) and, with --db, to
+the Evaluation table. The sha256 of every finished file is appended to a
+checkpoint file (default: <out>.checkpoint); re-running the same command skips
+those files, so an interrupted run resumes where it stopped.
+
+With --shard i/N only the files whose content hash maps to shard i are graded,
+into results.shard<i>of<N>.csv plus a manifest of the files the shard owns.
+Several machines sharing the scans directory can each run one shard; `merge`
+then combines the shard files, rejecting duplicates and reporting missing files.
+
+`rescore` re-scores stored answers against a (corrected) key without touching
+the images; each row is scored with the key sheet named by its sheet_version.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.batch import PipelineConfig, is_image_name, iter_zip_sources, run_batch
+from app.services.template import compile_template
+from app.services.export import DEFAULT_QUESTIONS, completed_hashes, open_result_writer, result_row
+from app.services.shards import (expand_inputs, merge_results, parse_shard, shard_of, shard_path,
+                                 write_manifest, write_summary_workbook)
+
+
+def iter_directory_sources(root: str) -> Iterator[Tuple[str, bytes]]:
+    """(relative path, bytes) for every image under `root`, in sorted order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if is_image_name(fn):
+                path = os.path.join(dirpath, fn)
+                with open(path, "rb") as fh:
+                    yield os.path.relpath(path, root), fh.read()
+
+
+def iter_input_sources(path: str) -> Iterator[Tuple[str, bytes]]:
+    if os.path.isdir(path):
+        return iter_directory_sources(path)
+    return iter_zip_sources(path)
+
+
+def _pending(sources: Iterator[Tuple[str, bytes]], done: Set[str], hashes: List[str],
+             stats: Dict[str, int], shard: Optional[Tuple[int, int]] = None,
+             owned: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, bytes]]:
+    # Hash in the parent so skipped files never reach a worker; hashes[i] belongs to
+    # the i-th yielded sheet, matching SheetResult.index
+    for name, data in sources:
+        digest = hashlib.sha256(data).hexdigest()
+        if shard is not None:
+            if shard_of(digest, shard[1]) != shard[0]:
+                continue
+            owned.setdefault(digest, name)
+        if digest in done:
+            stats["skipped"] += 1
+            continue
+        done.add(digest)  # identical files later in the run are graded once
+        hashes.append(digest)
+        yield name, data
+
+
+def _evaluation_record(row: Dict, answers: List[Optional[str]]) -> Dict:
+    """Result row -> bulk_create_evaluations input."""
+    def present(v) -> bool:
+        return v is not None and v == v  # None or NaN (merged rows) = not scored
+
+    return {"student_code": row["student_code"], "sheet_version": row["sheet_version"],
+            "per_subject": {s: float(row[s]) for s in settings.subjects if present(row.get(s))},
+            "total": float(row["total"]) if present(row.get("total")) else 0.0,
+            "details": {"answers": answers, "file": row["filename"], "sha256": row["sha256"]}}
+
+
+def _open_db():
+    from app.db.models import SessionLocal, init_db
+    init_db()
+    return SessionLocal()
+
+
+# Sheets buffered per database transaction with --db
+DB_CHUNK = 200
+
+
+def cmd_evaluate(args: argparse.Namespace) -> int:
+    from app.services.key import parse_key_excel
+
+    template = None
+    if args.template:
+        with open(args.template, "r", encoding="utf-8") as fh:
+            template = compile_template(json.load(fh))
+    key_map = parse_key_excel(args.key, args.key_sheet or args.sheet_version) if args.key else None
+    config = PipelineConfig(orient=not args.no_orient, rectify=not args.no_rectify, register=args.register)
+    shard = parse_shard(args.shard) if args.shard else None
+    out = shard_path(args.out, *shard) if shard else args.out
+
+    checkpoint = args.checkpoint or f"{out}.checkpoint"
+    done = completed_hashes([checkpoint, out])
+    stats = {"skipped": 0, "ok": 0, "errors": 0}
+    hashes: List[str] = []
+    owned: Dict[str, str] = {}
+
+    db = None
+    if args.db:
+        from app.db.crud import bulk_create_evaluations
+        db = _open_db()
+    t0 = time.perf_counter()
+    try:
+        width = template.num_questions if template is not None else DEFAULT_QUESTIONS
+        with open_result_writer(out, num_questions=width) as writer, open(checkpoint, "a", encoding="utf-8") as ckpt:
+            buffered: List[Tuple[Dict, Optional[Dict]]] = []
+
+            def flush() -> None:
+                # Database, then result file, then checkpoint. A crash before the
+                # checkpoint re-grades these sheets rather than losing them; the
+                # database skips sheets whose sha256 it already has, so the re-run
+                # doesn't store (or count in the rollup) any sheet twice.
+                if db is not None:
+                    bulk_create_evaluations(db, [rec for _, rec in buffered if rec is not None])
+                for row, _ in buffered:
+                    writer.write(row)
+                ckpt.write("".join(row["sha256"] + "\n" for row, _ in buffered))
+                ckpt.flush()
+                buffered.clear()
+
+            sources = _pending(iter_input_sources(args.input), done, hashes, stats, shard, owned)
+            for res in run_batch(sources, template, key_map, config, workers=args.workers):
+                row = result_row(res, args.sheet_version, hashes[res.index])
+                buffered.append((row, _evaluation_record(row, res.answers) if res.ok else None))
+                if len(buffered) >= (DB_CHUNK if db is not None else 1):
+                    flush()
+                stats["ok" if res.ok else "errors"] += 1
+                n = stats["ok"] + stats["errors"]
+                if args.progress and n % args.progress == 0:
+                    rate = n / (time.perf_counter() - t0)
+                    print(f"{n} sheets ({rate:.1f}/s), {stats['errors']} errors", file=sys.stderr)
+            flush()
+        if shard:
+            # Only written once the whole input set was walked: merge treats a
+            # shard without a manifest as unfinished
+            write_manifest(out, shard, args.input, owned)
+    finally:
+        if db is not None:
+            db.close()
+    dt = time.perf_counter() - t0
+    n = stats["ok"] + stats["errors"]
+    print(f"graded {n} sheets in {dt:.1f}s ({n / dt if dt > 0 else 0:.1f}/s); "
+          f"{stats['errors']} errors, {stats['skipped']} already done -> {writer.path}")
+    return 1 if stats["errors"] and args.strict else 0
+
+
+def cmd_merge(args: argparse.Namespace) -> int:
+    paths = expand_inputs(args.results)
+    missing_files = [p for p in paths if not os.path.exists(p)]
+    if missing_files:
+        print(f"result files not found: {', '.join(missing_files)}", file=sys.stderr)
+        return 2
+    expected = None
+    if args.input:
+        expected = {}
+        for name, data in iter_input_sources(args.input):
+            expected.setdefault(hashlib.sha256(data).hexdigest(), name)
+
+    report = merge_results(paths, expected)
+    print(f"merged {len(paths)} files: {report.summary()}", file=sys.stderr)
+    for _, r in report.duplicate_hashes.iterrows():
+        print(f"  duplicate {r['sha256'][:12]} {r['filename']} ({r['source_file']})", file=sys.stderr)
+    for _, r in report.duplicate_students.iterrows():
+        print(f"  duplicate student {r['student_code']}: {r['filename']} ({r['source_file']})", file=sys.stderr)
+    for shard in report.missing_shards:
+        print(f"  shard {shard} has no manifest (not run or not finished)", file=sys.stderr)
+    for m in report.missing:
+        print(f"  missing {m['name']}: {m['reason']}", file=sys.stderr)
+    if not (report.duplicate_hashes.empty and report.duplicate_students.empty):
+        print("duplicates found; nothing written", file=sys.stderr)
+        return 1
+
+    write_summary_workbook(report, args.out)
+    if args.db:
+        from app.db.crud import bulk_create_evaluations
+        db = _open_db()
+        try:
+            rows = report.results[report.results["error"] == ""].to_dict("records")
+            bulk_create_evaluations(db, (_evaluation_record(r, ["" if a == "-" else a for a in r["answers"]])
+                                         for r in rows))
+        finally:
+            db.close()
+    print(f"wrote {args.out}")
+    return 1 if args.strict and not report.ok else 0
+
+
+def cmd_rescore(args: argparse.Namespace) -> int:
+    from app.services.key import parse_key_excel
+    from app.services.scoring import compile_keys, encode_answer_strings, score_batch
+    from app.services.shards import read_results
+
+    df = read_results(args.results).drop(columns=["source_file"])
+    graded = (df["error"] == "").to_numpy()
+    sets = sorted(df.loc[graded, "sheet_version"].unique())
+    # Questions on the sheet = width of the stored answer strings (not a score bound)
+    width = int(df.loc[graded, "answers"].str.len().max() or 0) if graded.any() else 0
+    key = compile_keys({v: parse_key_excel(args.key, v) for v in sets}, num_questions=width or None)
+    t0 = time.perf_counter()
+    answers = encode_answer_strings(df.loc[graded, "answers"], key.num_questions)
+    per_subject, total = score_batch(answers, key, df.loc[graded, "sheet_version"].tolist())
+    dt = time.perf_counter() - t0
+    for j, subject in enumerate(key.subjects):
+        if subject in df:
+            df[subject] = df[subject].astype("Int64")
+            df.loc[graded, subject] = per_subject[:, j]
+    df["total"] = df["total"].astype("Int64")
+    df.loc[graded, "total"] = total
+    if args.out.lower().endswith((".parquet", ".pq")):
+        if os.path.exists(args.out):
+            os.remove(args.out)
+        with open_result_writer(args.out, num_questions=key.num_questions) as writer:
+            for row in df.to_dict("records"):
+                writer.write(row)
+    else:
+        df.to_csv(args.out, index=False)
+    print(f"rescored {int(graded.sum())} sheets ({len(sets)} sets) in {dt:.3f}s -> {args.out}")
+    return 0
+
+
+def cmd_migrate_answers(args: argparse.Namespace) -> int:
+    from app.db.crud import backfill_packed_answers
+    db = _open_db()
+    try:
+        n = backfill_packed_answers(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"packed answers of {n} evaluations")
+    return 0
+
+
+def cmd_rebuild_summary(args: argparse.Namespace) -> int:
+    from app.db.crud import rebuild_subject_rollup
+    db = _open_db()
+    try:
+        n = rebuild_subject_rollup(db)
+    finally:
+        db.close()
+    print(f"rebuilt subject summary from {n} evaluations")
+    return 0
+
+
+def cmd_init_db(args: argparse.Namespace) -> int:
+    from app.db.models import DATABASE_URL, init_db
+    init_db()
+    print(f"database schema up to date ({DATABASE_URL.split('@')[-1]})")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="python -m app.cli", description="OMR evaluation tools.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    ev = sub.add_parser("evaluate", help="grade a directory or ZIP of scans")
+    ev.add_argument("input", help="directory of images (searched recursively) or a .zip archive")
+    ev.add_argument("--out", required=True, help="results file (.csv, .xlsx, or .parquet with pyarrow)")
+    ev.add_argument("--template", help="template JSON (default: naive grid)")
+    ev.add_argument("--key", help="answer key workbook (.xlsx)")
+    ev.add_argument("--key-sheet", help="key sheet name (default: --sheet-version)")
+    ev.add_argument("--sheet-version", default=settings.sheet_versions[0], choices=settings.sheet_versions)
+    ev.add_argument("--workers", type=int, default=settings.batch_workers or None,
+                    help="worker processes (default: all cores; 1 = inline)")
+    ev.add_argument("--checkpoint", help="completed-hash file (default: <out>.checkpoint)")
+    ev.add_argument("--db", action="store_true", help="also store results in the Evaluation table")
+    ev.add_argument("--register", action="store_true", help="auto-register each sheet to the template")
+    ev.add_argument("--no-orient", action="store_true", help="skip orientation detection")
+    ev.add_argument("--no-rectify", action="store_true", help="skip perspective rectification")
+    ev.add_argument("--progress", type=int, default=100, help="log progress every N sheets (0 = off)")
+    ev.add_argument("--strict", action="store_true", help="exit with status 1 if any sheet failed")
+    ev.add_argument("--shard", help="grade only shard i of N (by content hash), e.g. 0/4; "
+                                    "output goes to <out stem>.shard<i>of<N><ext>")
+    ev.set_defaults(func=cmd_evaluate)
+
+    mg = sub.add_parser("merge", help="combine shard result files into one workbook")
+    mg.add_argument("results", nargs="+", help="shard result files or glob patterns (quoted)")
+    mg.add_argument("--out", required=True, help="summary workbook (.xlsx)")
+    mg.add_argument("--input", help="the scans directory or ZIP, to report files no shard graded")
+    mg.add_argument("--db", action="store_true", help="load the merged results into the Evaluation table")
+    mg.add_argument("--strict", action="store_true", help="exit with status 1 if any file is missing")
+    mg.set_defaults(func=cmd_merge)
+
+    rs = sub.add_parser("rescore", help="re-score a results file against a new key (no images needed)")
+    rs.add_argument("results", help="results file from evaluate (.csv or .parquet)")
+    rs.add_argument("--key", required=True, help="answer key workbook with one sheet per sheet version")
+    rs.add_argument("--out", required=True, help="rescored results file (.csv or .parquet)")
+    rs.set_defaults(func=cmd_rescore)
+
+    mi = sub.add_parser("migrate-answers", help="pack JSON answers of existing evaluations (re-runnable)")
+    mi.add_argument("--batch-size", type=int, default=1000)
+    mi.set_defaults(func=cmd_migrate_answers)
+
+    rb = sub.add_parser("rebuild-summary", help="recompute the subject summary rollup from all evaluations")
+    rb.set_defaults(func=cmd_rebuild_summary)
+
+    ini = sub.add_parser("init-db", help="create or upgrade the database schema")
+    ini.set_defaults(func=cmd_init_db)
+    return ap
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,11 @@
 from pydantic import BaseModel
 from typing import List
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
 
 class Settings(BaseModel):
     subjects: List[str] = [
@@ -12,5 +18,31 @@ class Settings(BaseModel):
     per_subject_max: int = 20
     total_max: int = 100
     sheet_versions: List[str] = ["A", "B", "C", "D"]
+    # Canonical size rectified sheets are warped to before evaluation (A4 at 150 dpi)
+    working_width: int = 1240
+    working_height: int = 1754
+    # /api/evaluate executor: worker threads and how many requests may wait for one
+    eval_workers: int = _env_int("OMR_EVAL_WORKERS", min(4, os.cpu_count() or 1))
+    eval_max_queue: int = _env_int("OMR_EVAL_MAX_QUEUE", 16)
+    # Process pool size for batch evaluation (0 = all cores, 1 = inline)
+    batch_workers: int = _env_int("OMR_BATCH_WORKERS", 0)
+    # /api/evaluate/batch requests allowed to run at once (each has its own process pool)
+    batch_max_concurrent: int = _env_int("OMR_BATCH_MAX_CONCURRENT", 1)
+    # Upper bound (and default) for the Streamlit app's worker count; one server has many users
+    ui_batch_workers: int = _env_int("OMR_UI_BATCH_WORKERS", min(2, os.cpu_count() or 1))
+    # Background jobs: where uploads are stored, and how long a worker's claim lasts
+    jobs_dir: str = os.getenv("OMR_JOBS_DIR", "./jobs_data")
+    job_lease_seconds: int = _env_int("OMR_JOB_LEASE_SECONDS", 300)
+    job_max_attempts: int = _env_int("OMR_JOB_MAX_ATTEMPTS", 3)
+    # Detected-answer cache (SQLite file; off unless a path is set) and its LRU entry limit
+    answer_cache_path: str = os.getenv("OMR_ANSWER_CACHE", "")
+    answer_cache_max_entries: int = _env_int("OMR_ANSWER_CACHE_MAX_ENTRIES", 200_000)
+    # Database engine (app/db/engine.py): SQLite lock wait; Postgres pool and per-statement limit
+    sqlite_busy_timeout_ms: int = _env_int("OMR_SQLITE_BUSY_TIMEOUT_MS", 30_000)
+    db_pool_size: int = _env_int("OMR_DB_POOL_SIZE", 5)
+    db_max_overflow: int = _env_int("OMR_DB_MAX_OVERFLOW", 10)
+    db_pool_timeout: int = _env_int("OMR_DB_POOL_TIMEOUT", 30)
+    db_pool_recycle: int = _env_int("OMR_DB_POOL_RECYCLE", 1800)
+    db_statement_timeout_ms: int = _env_int("OMR_DB_STATEMENT_TIMEOUT_MS", 60_000)
 
 settings = Settings()
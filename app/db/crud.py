@@ -1,6 +1,13 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+from datetime import date, datetime
+from itertools import islice
+import math
+import numpy as np
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from .models import SessionLocal, Student, Evaluation
+from .models import SessionLocal, Student, Evaluation, SubjectRollup, AnswerKey, TOTAL_SUBJECT
+from app.services.scoring import decode_answers, encode_answers, option_code
 
 
 def get_db():
@@ -21,33 +28,370 @@ def upsert_student(db: Session, student_code: str) -> Student:
     return obj
 
 
+# Per-question answers are stored packed: one uint8 option code per question
+# (0 = blank, 1 = 'a', ...; see app.services.scoring) in Evaluation.answers_packed
+# instead of a JSON list in details (~100 bytes instead of ~500 for 100 questions),
+# and bulk reads load straight into NumPy.
+
+def pack_answers(answers: Sequence[Optional[str]]) -> bytes:
+    return encode_answers(answers).tobytes()
+
+
+def unpack_answers(blob: bytes) -> List[str]:
+    return decode_answers(np.frombuffer(blob, dtype=np.uint8))
+
+
+def answers_matrix(blobs: Iterable[Optional[bytes]], num_questions: int) -> np.ndarray:
+    """Packed answers of many evaluations -> (N, num_questions) uint8 code matrix;
+    missing rows are all blank, short ones are padded."""
+    blobs = list(blobs)
+    out = np.zeros((len(blobs), num_questions), dtype=np.uint8)
+    for i, b in enumerate(blobs):
+        if b:
+            row = np.frombuffer(b, dtype=np.uint8)[:num_questions]
+            out[i, :row.size] = row
+    return out
+
+
+def _packable(answers: Any) -> bool:
+    # Only single option letters and blanks survive the round trip
+    return isinstance(answers, list) and all(not a or (isinstance(a, str) and option_code(a)) for a in answers)
+
+
+def _split_details(details: Optional[Dict[str, Any]]):
+    details = dict(details or {})
+    if _packable(details.get("answers")):
+        return details, pack_answers(details.pop("answers"))
+    return details, None
+
+
+def evaluation_answers(ev: Evaluation) -> Optional[List[str]]:
+    if ev.answers_packed is not None:
+        return unpack_answers(ev.answers_packed)
+    return (ev.details or {}).get("answers")
+
+
+def evaluation_to_dict(ev: Evaluation) -> Dict[str, Any]:
+    """API view of an evaluation; answers are unpacked back into details."""
+    details = dict(ev.details or {})
+    answers = evaluation_answers(ev)
+    if answers is not None:
+        details["answers"] = answers
+    return {"id": ev.id, "student_code": ev.student_code, "sheet_version": ev.sheet_version,
+            "per_subject": ev.per_subject, "total": ev.total, "details": details,
+            "created_at": ev.created_at}
+
+
 def create_evaluation(db: Session, student_code: str, sheet_version: str,
                       per_subject: Dict[str, float], total: float,
                       details: Optional[Dict[str, Any]] = None) -> Evaluation:
+    sha256 = (details or {}).get("sha256") or None
+    if sha256:
+        existing = db.query(Evaluation).filter(Evaluation.sha256 == sha256).first()
+        if existing is not None:  # same scan stored already
+            return existing
+    details, packed = _split_details(details)
     ev = Evaluation(
         student_code=student_code,
         sheet_version=sheet_version,
         per_subject=per_subject,
         total=total,
-        details=details or {},
+        details=details,
+        answers_packed=packed,
+        sha256=sha256,
+        created_at=datetime.utcnow(),
     )
     db.add(ev)
+    _apply_rollup(db, _rollup_deltas([{"sheet_version": sheet_version, "per_subject": per_subject,
+                                       "total": total, "created_at": ev.created_at}]))
     db.commit()
     db.refresh(ev)
     return ev
 
 
+# Bulk path for batch results: one multi-row INSERT per table and one commit per
+# chunk, instead of a query + commit + refresh per student and per evaluation.
+
+def _chunks(items: Iterable[Any], size: int):
+    it = iter(items)
+    while chunk := list(islice(it, max(1, size))):
+        yield chunk
+
+
+def _insert_students(db: Session, codes: Iterable[str]) -> None:
+    codes = sorted(set(codes))
+    if not codes:
+        return
+    dialect = db.get_bind().dialect.name
+    values = [{"student_code": c} for c in codes]
+    if dialect in ("sqlite", "postgresql"):
+        ins = (sqlite if dialect == "sqlite" else postgresql).insert(Student)
+        db.execute(ins.on_conflict_do_nothing(index_elements=["student_code"]), values)
+        return
+    # Other backends: skip the codes that already exist
+    have = set(db.scalars(select(Student.student_code).where(Student.student_code.in_(codes))))
+    missing = [v for v in values if v["student_code"] not in have]
+    if missing:
+        db.execute(insert(Student), missing)
+
+
+def bulk_upsert_students(db: Session, student_codes: Iterable[str], chunk_size: int = 1000) -> None:
+    """Insert the student codes that don't exist yet (ON CONFLICT DO NOTHING), one
+    transaction per chunk."""
+    for chunk in _chunks(student_codes, chunk_size):
+        _insert_students(db, chunk)
+        db.commit()
+
+
+def _row_sha256(r: Dict[str, Any]) -> Optional[str]:
+    return r.get("sha256") or (r.get("details") or {}).get("sha256") or None
+
+
+def bulk_create_evaluations(db: Session, rows: Iterable[Dict[str, Any]], chunk_size: int = 500) -> int:
+    """Store many evaluations. Each row has create_evaluation's fields (student_code,
+    sheet_version, per_subject, total, details); answers are packed the same way.
+    Rows whose sha256 (row or details) is already stored are skipped, and only the
+    rows actually inserted reach the rollup, so re-loading a chunk after a crash is
+    harmless. Students are upserted in the same transaction as their chunk.
+    Returns the number inserted."""
+    count = 0
+    dialect = db.get_bind().dialect.name
+    for chunk in _chunks(rows, chunk_size):
+        now = datetime.utcnow()
+        values = []
+        for r in chunk:
+            details, packed = _split_details(r.get("details"))
+            values.append({"student_code": r["student_code"], "sheet_version": r["sheet_version"],
+                           "per_subject": r.get("per_subject") or {}, "total": r.get("total"),
+                           "details": details, "answers_packed": packed, "sha256": _row_sha256(r),
+                           "created_at": now})
+        _insert_students(db, (v["student_code"] for v in values))
+        if dialect in ("sqlite", "postgresql"):
+            ins = (sqlite if dialect == "sqlite" else postgresql).insert(Evaluation)
+            inserted = db.execute(ins.on_conflict_do_nothing(index_elements=["sha256"])
+                                  .returning(Evaluation.sheet_version, Evaluation.per_subject,
+                                             Evaluation.total, Evaluation.created_at),
+                                  values).mappings().all()
+        else:
+            shas = [v["sha256"] for v in values if v["sha256"]]
+            have = set(db.scalars(select(Evaluation.sha256).where(Evaluation.sha256.in_(shas)))) if shas else set()
+            inserted = []
+            for v in values:
+                if v["sha256"] is None or v["sha256"] not in have:
+                    inserted.append(v)
+                    if v["sha256"]:
+                        have.add(v["sha256"])
+            if inserted:
+                db.execute(insert(Evaluation), inserted)
+        _apply_rollup(db, _rollup_deltas(inserted))
+        db.commit()
+        count += len(inserted)
+    return count
+
+
 def list_evaluations(db: Session, limit: int = 100) -> List[Evaluation]:
     return db.query(Evaluation).order_by(Evaluation.id.desc()).limit(limit).all()
 
 
-def summary_by_subject(db: Session) -> Dict[str, Any]:
-    rows = db.query(Evaluation).all()
-    agg: Dict[str, Dict[str, float]] = {}
+_LIST_COLUMNS = (Evaluation.id, Evaluation.student_code, Evaluation.sheet_version,
+                 Evaluation.per_subject, Evaluation.total, Evaluation.created_at)
+
+
+def _encode_cursor(row: Dict[str, Any], by_created: bool) -> str:
+    return f"{row['created_at'].isoformat()},{row['id']}" if by_created else str(row["id"])
+
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """'<id>' or '<created_at iso>,<id>' -> (created_at or None, id); ValueError if malformed."""
+    if "," in cursor:
+        ts, _, ev_id = cursor.rpartition(",")
+        return datetime.fromisoformat(ts), int(ev_id)
+    return None, int(cursor)
+
+
+def page_evaluations(db: Session, limit: int = 100, cursor: Optional[str] = None,
+                     sheet_version: Optional[str] = None, student_code: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     include_details: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of evaluations, newest first, as plain dicts of the selected columns.
+    Keyset pagination: pass the returned cursor back for the next page (None when
+    there are no more rows), so a page never re-reads the rows before it.
+    `since`/`until` filter created_at (inclusive/exclusive). Without them pages
+    walk id order on the (sheet_version, id) / (student_code, id) indexes; with
+    them they walk (created_at, id), so a window far in the past is a range scan
+    of that window rather than of every newer row. Combined with sheet_version or
+    student_code, those filters are applied to the rows of the date range."""
+    by_created = since is not None or until is not None
+    cols = _LIST_COLUMNS + ((Evaluation.details, Evaluation.answers_packed) if include_details else ())
+    if by_created:
+        q = select(*cols).order_by(Evaluation.created_at.desc(), Evaluation.id.desc())
+    else:
+        q = select(*cols).order_by(Evaluation.id.desc())
+    q = q.limit(limit + 1)
+    if cursor is not None:
+        created, before_id = _decode_cursor(cursor)
+        if by_created and created is not None:
+            q = q.where(tuple_(Evaluation.created_at, Evaluation.id) < (created, before_id))
+        else:
+            q = q.where(Evaluation.id < before_id)
+    if sheet_version is not None:
+        q = q.where(Evaluation.sheet_version == sheet_version)
+    if student_code is not None:
+        q = q.where(Evaluation.student_code == student_code)
+    if since is not None:
+        q = q.where(Evaluation.created_at >= since)
+    if until is not None:
+        q = q.where(Evaluation.created_at < until)
+    rows = [dict(r) for r in db.execute(q).mappings()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if include_details:
+        for r in rows:
+            packed = r.pop("answers_packed")
+            r["details"] = dict(r["details"] or {})
+            if packed is not None:
+                r["details"]["answers"] = unpack_answers(packed)
+    return rows, (_encode_cursor(rows[-1], by_created) if more else None)
+
+
+def backfill_packed_answers(db: Session, batch_size: int = 1000) -> int:
+    """Migrate rows written before answers_packed existed: pack details["answers"]
+    and drop it from the JSON. Walks the table by id in batches, committing each;
+    safe to re-run. Returns the number of rows converted."""
+    converted, last_id = 0, 0
+    while True:
+        rows = (db.query(Evaluation).filter(Evaluation.id > last_id, Evaluation.answers_packed.is_(None))
+                .order_by(Evaluation.id).limit(batch_size).all())
+        if not rows:
+            return converted
+        for ev in rows:
+            details, packed = _split_details(ev.details)
+            if packed is not None:
+                ev.details, ev.answers_packed = details, packed
+                converted += 1
+        last_id = rows[-1].id
+        db.commit()
+
+
+# Subject summaries are read from SubjectRollup, which holds running count, sum
+# and sum of squares per (sheet_version, day, subject) and is updated in the
+# same transaction as every insert above, so a summary costs a GROUP BY over a
+# few rows per day and set rather than a scan of every evaluation.
+
+RollupKey = Tuple[str, date, str]
+
+
+def _rollup_deltas(rows: Iterable[Dict[str, Any]]) -> Dict[RollupKey, List[float]]:
+    deltas: Dict[RollupKey, List[float]] = {}
+
+    def add(key: RollupKey, v: Any) -> None:
+        acc = deltas.setdefault(key, [0, 0.0, 0.0])
+        acc[0] += 1
+        acc[1] += float(v)
+        acc[2] += float(v) * float(v)
+
     for r in rows:
-        for s, v in (r.per_subject or {}).items():
-            agg.setdefault(s, {"sum": 0.0, "count": 0}).
-            agg[s]["sum"] += float(v)
-            agg[s]["count"] += 1
-    out = {k: (v["sum"]/max(1, v["count"])) for k, v in agg.items()}
-    return out
+        day = (r.get("created_at") or datetime.utcnow()).date()
+        for subject, v in (r.get("per_subject") or {}).items():
+            if v is not None:
+                add((r["sheet_version"], day, subject), v)
+        if r.get("total") is not None:
+            add((r["sheet_version"], day, TOTAL_SUBJECT), r["total"])
+    return deltas
+
+
+def _apply_rollup(db: Session, deltas: Dict[RollupKey, List[float]]) -> None:
+    if not deltas:
+        return
+    values = [{"sheet_version": v, "day": d, "subject": s, "n": n, "score_sum": total, "score_sq_sum": sq}
+              for (v, d, s), (n, total, sq) in deltas.items()]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        for chunk in _chunks(values, 500):  # stay under bound-parameter limits
+            ins = (sqlite if dialect == "sqlite" else postgresql).insert(SubjectRollup).values(chunk)
+            db.execute(ins.on_conflict_do_update(
+                index_elements=["sheet_version", "day", "subject"],
+                set_={"n": SubjectRollup.n + ins.excluded.n,
+                      "score_sum": SubjectRollup.score_sum + ins.excluded.score_sum,
+                      "score_sq_sum": SubjectRollup.score_sq_sum + ins.excluded.score_sq_sum}))
+        return
+    for v in values:
+        row = (db.query(SubjectRollup).filter_by(sheet_version=v["sheet_version"], day=v["day"],
+                                                 subject=v["subject"]).with_for_update().first())
+        if row is None:
+            db.add(SubjectRollup(**v))
+        else:
+            row.n += v["n"]
+            row.score_sum += v["score_sum"]
+            row.score_sq_sum += v["score_sq_sum"]
+
+
+def _stats(n: int, total: float, sq: float) -> Dict[str, Any]:
+    mean = total / n if n else None
+    return {"count": int(n), "mean": mean,
+            "std": math.sqrt(max(0.0, sq / n - mean * mean)) if n else None}
+
+
+def subject_summary(db: Session, sheet_version: Optional[str] = None,
+                    since: Optional[date] = None, until: Optional[date] = None) -> Dict[str, Any]:
+    """Count, mean and (population) std per subject and for the total score,
+    optionally restricted to one sheet version and a range of days (inclusive)."""
+    q = (select(SubjectRollup.subject, func.sum(SubjectRollup.n), func.sum(SubjectRollup.score_sum),
+                func.sum(SubjectRollup.score_sq_sum)).group_by(SubjectRollup.subject))
+    if sheet_version is not None:
+        q = q.where(SubjectRollup.sheet_version == sheet_version)
+    if since is not None:
+        q = q.where(SubjectRollup.day >= since)
+    if until is not None:
+        q = q.where(SubjectRollup.day <= until)
+    stats = {subject: _stats(n, total, sq) for subject, n, total, sq in db.execute(q)}
+    overall = stats.pop(TOTAL_SUBJECT, _stats(0, 0.0, 0.0))
+    return {"count": overall["count"], "total": overall, "subjects": stats}
+
+
+def summary_by_subject(db: Session) -> Dict[str, Any]:
+    """Mean score per subject over all evaluations."""
+    return {s: v["mean"] for s, v in subject_summary(db)["subjects"].items()}
+
+
+def rebuild_subject_rollup(db: Session, batch_size: int = 5000) -> int:
+    """Recompute SubjectRollup from the Evaluation table (for databases that had
+    evaluations before the rollup existed). One transaction; returns rows read."""
+    deltas: Dict[RollupKey, List[float]] = {}
+    seen, last_id = 0, 0
+    cols = (Evaluation.id, Evaluation.sheet_version, Evaluation.per_subject, Evaluation.total, Evaluation.created_at)
+    while True:
+        rows = db.execute(select(*cols).where(Evaluation.id > last_id).order_by(Evaluation.id)
+                          .limit(batch_size)).mappings().all()
+        if not rows:
+            break
+        for key, (n, total, sq) in _rollup_deltas(rows).items():
+            acc = deltas.setdefault(key, [0, 0.0, 0.0])
+            acc[0] += n
+            acc[1] += total
+            acc[2] += sq
+        seen += len(rows)
+        last_id = rows[-1]["id"]
+    db.execute(delete(SubjectRollup))
+    _apply_rollup(db, deltas)
+    db.commit()
+    return seen
+
+
+def set_answer_key(db: Session, sheet_version: str, key_map: Dict[int, str]) -> AnswerKey:
+    """Store (or replace) the answer key of a sheet version."""
+    body = {str(int(q)): str(a).strip().lower() for q, a in key_map.items()}
+    obj = db.get(AnswerKey, sheet_version)
+    if obj is None:
+        obj = AnswerKey(sheet_version=sheet_version)
+        db.add(obj)
+    obj.key = body
+    obj.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(obj)
+    return obj
+
+
+def get_answer_key(db: Session, sheet_version: str) -> Optional[Dict[int, str]]:
+    obj = db.get(AnswerKey, sheet_version)
+    return {int(q): a for q, a in obj.key.items()} if obj is not None else None
@@ -0,0 +1,49 @@
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+
+from app.core.config import settings
+
+# Engine factory tuned per backend.
+# - SQLite: WAL journal (readers don't block the writer), synchronous=NORMAL
+#   (durable at checkpoints, no fsync per commit) and a busy timeout so
+#   concurrent API threads, job workers and CLI writers wait for the lock
+#   instead of failing with "database is locked".
+# - Postgres: explicit pool sizing, pre-ping (drop connections the server or a
+#   proxy closed), recycling, and a server-side statement_timeout.
+
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cur.close()
+
+
+def make_engine(url: str, **overrides: Any) -> Engine:
+    """create_engine() with the per-backend settings above; keyword arguments
+    override them."""
+    backend = make_url(url).get_backend_name()
+    kwargs: Dict[str, Any] = {}
+    if backend == "sqlite":
+        # busy_timeout is also the driver's lock wait (seconds)
+        kwargs["connect_args"] = {"check_same_thread": False,
+                                  "timeout": settings.sqlite_busy_timeout_ms / 1000}
+    else:
+        kwargs.update(pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow,
+                      pool_timeout=settings.db_pool_timeout, pool_recycle=settings.db_pool_recycle,
+                      pool_pre_ping=True)
+        if backend == "postgresql":
+            kwargs["connect_args"] = {"options": f"-c statement_timeout={int(settings.db_statement_timeout_ms)}"}
+    kwargs.update(overrides)
+    engine = create_engine(url, **kwargs)
+    if backend == "sqlite" and not _in_memory(url):
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def _in_memory(url: str) -> bool:
+    database: Optional[str] = make_url(url).database
+    return not database or database == ":memory:" or database.startswith("file::memory:")
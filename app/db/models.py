@@ -1,14 +1,12 @@
 from typing import Optional, List, Dict, Any
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, JSON, DateTime
+from sqlalchemy import inspect, text, Column, Integer, String, Float, JSON, Date, DateTime, ForeignKey, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
+from .engine import make_engine
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./omr.db")
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-)
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -24,7 +22,100 @@ class Evaluation(Base):
     sheet_version = Column(String, index=True)
     per_subject = Column(JSON)
     total = Column(Float)
-    details = Column(JSON)  # optional: per-question answers
+    details = Column(JSON)  # optional: file, sha256, ...; answers only for legacy/unpackable rows
+    answers_packed = Column(LargeBinary, nullable=True)  # one option code per question, see crud.pack_answers
+    sha256 = Column(String, nullable=True)  # scanned file's hash; bulk loads skip rows already stored
     created_at = Column(DateTime, default=datetime.utcnow)
 
-Base.metadata.create_all(bind=engine)
+    # Keyset pagination (newest first) under each filter of crud.page_evaluations:
+    # id order per sheet_version / student_code, (created_at, id) order for date windows
+    __table_args__ = (
+        Index("ix_evaluations_version_id", "sheet_version", "id"),
+        Index("ix_evaluations_student_id", "student_code", "id"),
+        Index("ix_evaluations_created_id", "created_at", "id"),
+        Index("uq_evaluations_sha256", "sha256", unique=True),
+    )
+
+class SubjectRollup(Base):
+    """Running per-subject score totals, maintained by crud in the same transaction
+    as each evaluation insert; the subject TOTAL_SUBJECT holds the overall totals."""
+    __tablename__ = "subject_rollups"
+    id = Column(Integer, primary_key=True)
+    sheet_version = Column(String, nullable=False)
+    day = Column(Date, nullable=False)  # UTC date of Evaluation.created_at
+    subject = Column(String, nullable=False)
+    n = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_sq_sum = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (UniqueConstraint("sheet_version", "day", "subject", name="uq_subject_rollups_key"),)
+
+TOTAL_SUBJECT = "_total"
+
+class AnswerKey(Base):
+    """The current answer key of a sheet version ({"1": "a", ...}), used to
+    analyse stored answers (app.services.analytics)."""
+    __tablename__ = "answer_keys"
+    sheet_version = Column(String, primary_key=True)
+    key = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    """A queued batch evaluation; sheets are JobItems picked up by `python -m app.worker`."""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, index=True, default="queued")  # queued | running | done
+    sheet_version = Column(String)
+    template = Column(JSON)  # template dict, or null for the naive grid
+    key = Column(JSON)  # {"1": "a", ...}, or null
+    config = Column(JSON)  # PipelineConfig fields
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class JobItem(Base):
+    __tablename__ = "job_items"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True)
+    position = Column(Integer)
+    name = Column(String)
+    path = Column(String)  # stored upload under settings.jobs_dir
+    status = Column(String, default="pending")  # pending | leased | done | error
+    lease_owner = Column(String, nullable=True)
+    lease_expires = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    result = Column(JSON, nullable=True)  # SheetResult fields
+    error = Column(String, nullable=True)
+    seconds = Column(Float, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_job_items_status_lease", "status", "lease_expires"),)
+
+def _upgrade_schema(bind) -> None:
+    """create_all doesn't alter existing tables; add the columns (nullable, so
+    existing rows stay valid) and indexes introduced since a database was created."""
+    insp = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in have and col.nullable:
+                ddl = col.type.compile(dialect=bind.dialect)
+                with bind.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl}'))
+        indexes = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=bind)
+
+
+def init_db(bind=None) -> None:
+    """Create missing tables, columns and indexes. Idempotent; run at startup by
+    the API, workers and CLI (or explicitly: python -m app.cli init-db)."""
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    _upgrade_schema(bind)
@@ -1,8 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers.evaluate import router as evaluate_router
+from app.db.models import init_db
+from app.routers.evaluate import router as evaluate_router, evaluate_pool
+from app.routers.jobs import router as jobs_router
 from app.routers.results import router as results_router
 
-app = FastAPI(title="OMR Evaluation API", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    yield
+    evaluate_pool.shutdown(wait=False)
+
+app = FastAPI(title="OMR Evaluation API", version="0.1.0", lifespan=lifespan)
 
 @app.get("/health")
 def health():
@@ -10,3 +20,4 @@ def health():
 
 app.include_router(evaluate_router, prefix="/api")
 app.include_router(results_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
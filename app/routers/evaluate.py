@@ -1,16 +1,167 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import json
+import threading
+import zipfile
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from PIL import Image
-import numpy as np
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from app.core.config import settings
+from app.services.batch import PipelineConfig, is_image_name, iter_zip_sources, run_batch
+from app.services.imageio import decode_image, working_side
+from app.services.key import parse_key_excel
 from app.services.omr import evaluate_image
+from app.services.template import compile_template
+from app.services.workpool import Overloaded, WorkPool
 
 router = APIRouter(tags=["evaluate"]) 
 
+# Decode and evaluation run here, off the event loop; see app/services/workpool.py
+evaluate_pool = WorkPool(settings.eval_workers, settings.eval_max_queue, name="evaluate")
+
+# Each batch runs its own process pool of settings.batch_workers (default: all
+# cores), so concurrent batches are admitted up to batch_max_concurrent and
+# further ones get a 503 instead of multiplying the process count.
+batch_slots = threading.BoundedSemaphore(max(1, settings.batch_max_concurrent))
+BATCH_RETRY_AFTER = 30
+
+
+class SlotStream:
+    """Iterator over a batch's NDJSON lines that gives its batch_slots slot back
+    exactly once: when exhausted, closed, or garbage-collected without ever being
+    read (e.g. the client went away before the first chunk was sent)."""
+
+    def __init__(self, lines: Iterator[bytes], slots: threading.BoundedSemaphore):
+        self._lines = lines
+        self._slots = slots
+        self._lock = threading.Lock()
+        self._held = True
+
+    def release(self) -> None:
+        with self._lock:
+            held, self._held = self._held, False
+        if held:
+            self._slots.release()
+
+    def __iter__(self) -> "SlotStream":
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self._lines)
+        except BaseException:
+            self.release()
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self._lines, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.release()
+
+    def __del__(self) -> None:
+        self.release()
+
+
+def _evaluate_bytes(data: bytes, sheet_version: str):
+    return evaluate_image(decode_image(data, max_side=working_side()), sheet_version)
+
+
 @router.post("/evaluate")
 async def evaluate(sheet_version: str = Form(...), file: UploadFile = File(...)):
     try:
-        image = Image.open(file.file).convert("RGB")
-        np_img = np.array(image)
-        result = evaluate_image(np_img, sheet_version)
+        result = await evaluate_pool.run(_evaluate_bytes, await file.read(), sheet_version)
         return result
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid image or processing error: {e}")
+
+
+@router.get("/evaluate/metrics")
+def evaluate_metrics():
+    return evaluate_pool.stats()
+
+
+def upload_sources(files: List[UploadFile], archive: Optional[UploadFile]) -> Iterator[Tuple[str, bytes]]:
+    # Read lazily: the batch engine pulls a source only when a slot frees up
+    for f in files:
+        f.file.seek(0)
+        yield f.filename or "sheet", f.file.read()
+    if archive is not None:
+        archive.file.seek(0)
+        yield from iter_zip_sources(archive.file)
+
+
+def parse_batch_inputs(sheet_version: str, files: List[UploadFile], archive: Optional[UploadFile],
+                       template: Optional[UploadFile], key: Optional[UploadFile],
+                       key_sheet: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[int, str]]]:
+    """Validate a batch upload; returns (template dict, key map). Raises 400s."""
+    if sheet_version not in settings.sheet_versions:
+        raise HTTPException(status_code=400, detail=f"Unsupported sheet_version. Expected one of: {', '.join(settings.sheet_versions)}")
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Upload image files or a ZIP archive")
+    bad = [f.filename for f in files if not is_image_name(f.filename or "")]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Not an image file: {', '.join(bad)}")
+    if archive is not None:
+        try:
+            zipfile.ZipFile(archive.file).close()  # reads the central directory only
+        except zipfile.BadZipFile as e:
+            raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {e}")
+        archive.file.seek(0)
+    try:
+        tpl = json.loads(template.file.read()) if template is not None else None
+        if tpl is not None:
+            compile_template(tpl)
+        key_map = parse_key_excel(key.file.read(), key_sheet or sheet_version) if key is not None else None
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template or key: {e}")
+    return tpl, key_map
+
+
+@router.post("/evaluate/batch")
+def evaluate_batch(sheet_version: str = Form(...),
+                   files: List[UploadFile] = File(default=[]),
+                   archive: Optional[UploadFile] = File(default=None),
+                   template: Optional[UploadFile] = File(default=None),
+                   key: Optional[UploadFile] = File(default=None),
+                   key_sheet: Optional[str] = Form(default=None),
+                   auto_register: bool = Form(default=False),
+                   rectify: bool = Form(default=True)):
+    """Evaluate many sheets (files and/or one ZIP `archive`) with the per-question
+    pipeline and stream one NDJSON line per sheet as it completes, then a final
+    {"done": true, ...} line. `key` is an answer-key workbook; `key_sheet` defaults
+    to `sheet_version`.
+    """
+    tpl_dict, key_map = parse_batch_inputs(sheet_version, files, archive, template, key, key_sheet)
+    tpl = compile_template(tpl_dict) if tpl_dict is not None else None
+    config = PipelineConfig(register=auto_register, rectify=rectify)
+    slots = batch_slots
+    if not slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Another batch is running, retry later",
+                            headers={"Retry-After": str(BATCH_RETRY_AFTER)})
+
+    def lines() -> Iterator[bytes]:
+        count = errors = 0
+        try:
+            for res in run_batch(upload_sources(files, archive), tpl, key_map, config,
+                                 workers=settings.batch_workers or None):
+                count += 1
+                errors += not res.ok
+                yield (json.dumps({"sheet_version": sheet_version, **res.to_dict()}) + "\n").encode("utf-8")
+        except Exception as e:
+            # e.g. a corrupt archive discovered mid-stream; the status line is already sent
+            yield (json.dumps({"error": f"Batch aborted: {e}"}) + "\n").encode("utf-8")
+        yield (json.dumps({"done": True, "count": count, "errors": errors}) + "\n").encode("utf-8")
+
+    stream = SlotStream(lines(), slots)
+    try:
+        # The background task runs after the last chunk is sent; SlotStream covers
+        # the paths where it doesn't (send failure, disconnect before the first chunk)
+        return StreamingResponse(stream, media_type="application/x-ndjson",
+                                 background=BackgroundTask(stream.release))
+    except BaseException:
+        stream.release()
+        raise
@@ -0,0 +1,84 @@
+from typing import List, Optional
+import shutil
+import tempfile
+import zipfile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
+from app.db.crud import get_db
+from app.routers.evaluate import parse_batch_inputs, upload_sources
+from app.services.batch import PipelineConfig
+from app.db.models import Job
+from app.services.export import DEFAULT_QUESTIONS, export_results
+from app.services.jobs import create_job, iter_job_results, job_results, job_status
+from app.services.template import compile_template
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.post("/", status_code=202)
+def enqueue_job(sheet_version: str = Form(...),
+                files: List[UploadFile] = File(default=[]),
+                archive: Optional[UploadFile] = File(default=None),
+                template: Optional[UploadFile] = File(default=None),
+                key: Optional[UploadFile] = File(default=None),
+                key_sheet: Optional[str] = Form(default=None),
+                auto_register: bool = Form(default=False),
+                rectify: bool = Form(default=True),
+                db: Session = Depends(get_db)):
+    """Store the uploads and queue them for `python -m app.worker`; returns at once."""
+    tpl, key_map = parse_batch_inputs(sheet_version, files, archive, template, key, key_sheet)
+    config = PipelineConfig(register=auto_register, rectify=rectify)
+    try:
+        job = create_job(db, sheet_version, upload_sources(files, archive), tpl, key_map, config)
+    except zipfile.BadZipFile as e:  # a damaged member found while storing the uploads
+        raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {e}")
+    return {"id": job.id, "status": job.status, "total": job.total}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    status = job_status(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@router.get("/{job_id}/results")
+def get_job_results(job_id: int, after: int = -1, limit: int = 500, db: Session = Depends(get_db)):
+    """Finished sheets in upload order; page with `after` = last position seen."""
+    if job_status(db, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_results(db, job_id, after=after, limit=min(max(1, limit), 1000))
+
+
+EXPORT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+@router.get("/{job_id}/export")
+def export_job(job_id: int, format: str = Query("xlsx", pattern="^(csv|xlsx|parquet)$"),
+               answer_grids: bool = False, db: Session = Depends(get_db)):
+    """Finished sheets as a file, written row by row to a temp file and streamed
+    back; `answer_grids` adds one answer sheet per image (xlsx only)."""
+    status = job_status(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = db.get(Job, job_id)
+    width = compile_template(job.template).num_questions if job.template else DEFAULT_QUESTIONS
+    folder = tempfile.mkdtemp(prefix=f"omr-job{job_id}-")
+    try:
+        path = export_results(iter_job_results(db, job_id), f"{folder}/job-{job_id}.{format}",
+                              status["sheet_version"], answer_grids=answer_grids, num_questions=width)
+    except RuntimeError as e:  # e.g. Parquet without pyarrow
+        shutil.rmtree(folder, ignore_errors=True)
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    return FileResponse(path, media_type=EXPORT_TYPES[format], filename=f"job-{job_id}.{format}",
+                        background=BackgroundTask(shutil.rmtree, folder, ignore_errors=True))
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from typing import List, Dict, Any, Optional
+from datetime import date, datetime
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from app.db.crud import get_db, upsert_student, create_evaluation, list_evaluations
+from app.db.crud import (get_db, upsert_student, create_evaluation, page_evaluations,
+                         bulk_create_evaluations, subject_summary, get_answer_key, set_answer_key)
+from app.services.analytics import item_stats_cache
+from app.services.scoring import compile_key
 
 router = APIRouter(prefix="/results", tags=["results"]) 
 
@@ -20,7 +24,59 @@ def create_result(payload: EvalIn, db: Session = Depends(get_db)):
                            payload.per_subject, payload.total, payload.details)
     return {"id": ev.id}
 
+@router.post("/bulk")
+def create_results_bulk(payload: List[EvalIn], db: Session = Depends(get_db)):
+    n = bulk_create_evaluations(db, (p.model_dump() for p in payload))
+    return {"inserted": n}
+
+@router.get("/summary")
+def results_summary(sheet_version: Optional[str] = None, since: Optional[date] = None,
+                    until: Optional[date] = None, db: Session = Depends(get_db)):
+    """Per-subject and total count/mean/std from the maintained rollup."""
+    return subject_summary(db, sheet_version, since, until)
+
+@router.put("/keys/{sheet_version}")
+def put_answer_key(sheet_version: str, payload: Dict[int, str], db: Session = Depends(get_db)):
+    """Store the answer key ({"1": "a", ...}) item analysis uses for a sheet version."""
+    obj = set_answer_key(db, sheet_version, payload)
+    return {"sheet_version": obj.sheet_version, "questions": len(obj.key)}
+
+@router.get("/keys/{sheet_version}")
+def read_answer_key(sheet_version: str, db: Session = Depends(get_db)):
+    key_map = get_answer_key(db, sheet_version)
+    if key_map is None:
+        raise HTTPException(status_code=404, detail=f"No answer key for sheet version {sheet_version!r}")
+    return key_map
+
+@router.get("/item-analysis")
+def results_item_analysis(sheet_version: str, since: Optional[date] = None, until: Optional[date] = None,
+                          db: Session = Depends(get_db)):
+    """Per-question difficulty, discrimination and option counts, and KR-20 per
+    subject, from the stored answers of one sheet version and its stored key."""
+    key_map = get_answer_key(db, sheet_version)
+    if key_map is None:
+        raise HTTPException(status_code=404, detail=f"No answer key for sheet version {sheet_version!r}; "
+                                                    f"PUT /api/results/keys/{sheet_version} first")
+    result = item_stats_cache().analyse(db, sheet_version, compile_key(key_map), since, until)
+    return {"sheet_version": sheet_version, **result}
+
 @router.get("/")
-def list_results(db: Session = Depends(get_db)):
-    rows = list_evaluations(db)
+def list_results(response: Response,
+                 limit: int = Query(100, ge=1, le=1000),
+                 cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+                 sheet_version: Optional[str] = None,
+                 student_code: Optional[str] = None,
+                 since: Optional[datetime] = None,
+                 until: Optional[datetime] = None,
+                 include_details: bool = False,
+                 db: Session = Depends(get_db)):
+    """Evaluations, newest first. The next page's cursor is returned in the
+    X-Next-Cursor header (absent on the last page)."""
+    try:
+        rows, next_cursor = page_evaluations(db, limit, cursor, sheet_version, student_code, since, until,
+                                             include_details)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor!r}")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
     return rows
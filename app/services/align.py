@@ -1,90 +1,108 @@
-from typing import Dict, Any, List, Tuple
+from typing import Optional, Sequence, Tuple
 import random
 import numpy as np
-import cv2
+from app.services.context import SheetLike, sheet_context
+from app.services.roi import norm_to_pixel_boxes, box_sums
+from app.services.template import TemplateLike, compile_template
 
 
-def _to_gray(img: np.ndarray) -> np.ndarray:
-    if img.ndim == 3:
-        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    return img
-
-
-def _clahe(gray: np.ndarray) -> np.ndarray:
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    return clahe.apply(gray)
-
-
-def _vertical_edges(gray: np.ndarray) -> np.ndarray:
-    # Emphasize vertical structures using Sobel X
-    sobelx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
-    mag = np.abs(sobelx)
-    mag = mag / (mag.max() + 1e-6)
-    return (mag * 255.0).astype(np.uint8)
-
-
-def _roi_from_norm(norm_roi: List[float], w: int, h: int) -> Tuple[int, int, int, int]:
-    x0, y0, x1, y1 = norm_roi
-    x0i, y0i = int(max(0, min(w - 1, x0 * w))), int(max(0, min(h - 1, y0 * h)))
-    x1i, y1i = int(max(0, min(w, x1 * w))), int(max(0, min(h, y1 * h)))
-    return x0i, y0i, x1i, y1i
-
-
-def _sample_option_rois(template: Dict[str, Any], max_rois: int = 200) -> List[List[float]]:
-    qs = sorted(template.get("questions", []), key=lambda q: q.get("index", 0))
-    rois: List[List[float]] = []
-    for q in qs:
-        opts = q.get("options", {})
-        for _, roi in opts.items():
-            rois.append(list(roi))
+def sample_option_rois(template: TemplateLike, max_rois: int = 200) -> np.ndarray:
+    """Normalized option boxes (R, 4), deterministically subsampled to `max_rois`."""
+    tpl = compile_template(template)
+    rois = tpl.boxes
     if len(rois) > max_rois:
-        random.seed(42)
-        rois = random.sample(rois, max_rois)
+        picks = random.Random(42).sample(range(len(rois)), max_rois)
+        rois = rois[picks]
     return rois
 
 
-def estimate_offset(img: np.ndarray, template: Dict[str, Any],
-                    search_px_ratio: float = 0.02, steps: int = 21) -> Tuple[float, float]:
+def score_alignments(edges_integral: np.ndarray, rois: np.ndarray, params: np.ndarray,
+                     chunk: int = 512, ring: float = 0.0) -> np.ndarray:
+    """Mean edge response inside the ROIs for every candidate alignment at once.
+    edges_integral: summed-area table of the edge map (h+1, w+1)
+    rois: (R, 4) normalized boxes
+    params: (C, 4) candidates as [scale_x, scale_y, offset_x, offset_y], or (C, 6)
+      with extra [shear_x, shear_y] columns that shift each box by shear_x * its
+      centre y (and shear_y * its centre x)
+    ring: when > 0, score each box as the mean of its border band minus the mean of
+      its core (the box shrunk by `ring` x its size per side). This rewards ROIs whose
+      outline sits on the printed bubble rather than straddling two rows of a
+      periodic layout, which matters once the sheet is heavily downscaled.
+    Returns (C,) scores; candidates whose ROIs all fall outside the image score -1.
     """
-    Estimate a small horizontal/vertical offset (normalized 0..1) to better align
-    template ROIs to the image by maximizing vertical edge response inside ROIs.
-    Returns (offset_x, offset_y) in normalized coordinates.
+    h, w = edges_integral.shape[0] - 1, edges_integral.shape[1] - 1
+    params = np.asarray(params, dtype=np.float64)
+    params = params.reshape(-1, params.shape[-1] if params.ndim > 1 else 4)
+    centres = np.stack([(rois[:, 1] + rois[:, 3]) / 2.0, (rois[:, 0] + rois[:, 2]) / 2.0], axis=1)
+    scores = np.full(len(params), -1.0)
+    for start in range(0, len(params), chunk):
+        p = params[start:start + chunk]
+        scale = p[:, [0, 1, 0, 1]][:, None, :]
+        offset = p[:, [2, 3, 2, 3]][:, None, :]
+        if p.shape[1] == 6:
+            # per-box shift: dx = shear_x * cy, dy = shear_y * cx
+            shift = p[:, None, 4:6] * centres[None, :, :]
+            offset = offset + shift[:, :, [0, 1, 0, 1]]
+        # Clamp in normalized space first, exactly like evaluate_with_template does
+        adj = np.clip(rois[None, :, :] * scale + offset, 0.0, 1.0)
+        sums, areas = box_sums(edges_integral, norm_to_pixel_boxes(adj, w, h))
+        valid = areas > 0
+        means = np.where(valid, sums / np.maximum(areas, 1), 0.0)
+        if ring > 0:
+            size = (adj[..., 2:] - adj[..., :2]) * ring
+            core = adj + np.concatenate([size, -size], axis=-1)
+            c_sums, c_areas = box_sums(edges_integral, norm_to_pixel_boxes(core, w, h))
+            band = (sums - c_sums) / np.maximum(areas - c_areas, 1)
+            means = np.where(valid, band - c_sums / np.maximum(c_areas, 1), 0.0)
+        cnt = valid.sum(axis=1)
+        scores[start:start + chunk] = np.where(cnt > 0, means.sum(axis=1) / np.maximum(cnt, 1), -1.0)
+    return scores
+
+
+def _candidate_grid(xs: Sequence[float], ys: Sequence[float],
+                    scales_x: Sequence[float], scales_y: Sequence[float]) -> np.ndarray:
+    # Row order: scale_x, scale_y, dx, dy (dy fastest) so argmax ties keep the
+    # first candidate in the same order the original nested loops used.
+    sx, sy, dx, dy = np.meshgrid(scales_x, scales_y, xs, ys, indexing="ij")
+    return np.stack([sx.ravel(), sy.ravel(), dx.ravel(), dy.ravel()], axis=1)
+
+
+def estimate_alignment(img: SheetLike, template: TemplateLike,
+                       search_px_ratio: float = 0.02, steps: int = 21,
+                       steps_y: Optional[int] = None,
+                       scales_x: Sequence[float] = (1.0,),
+                       scales_y: Sequence[float] = (1.0,)) -> Tuple[float, float, float, float]:
     """
-    gray = _clahe(_to_gray(img))
-    edges = _vertical_edges(gray)
-    h, w = edges.shape
+    Search scale and offset jointly so template ROIs sit on the strongest edges.
+    Every (scale_x, scale_y, dx, dy) candidate is scored in one batched lookup
+    against summed-area tables of the Sobel-X map (vertical edges, which pin down
+    dx) and the Sobel-Y map (horizontal edges such as row rules, which pin down dy).
+    Returns (scale_x, scale_y, offset_x, offset_y), ready for evaluate_* kwargs.
+    """
+    ctx = sheet_context(img)
 
-    rois = _sample_option_rois(template, max_rois=200)
-    if not rois:
-        return 0.0, 0.0
+    rois = sample_option_rois(template, max_rois=200)
+    if not len(rois):
+        return 1.0, 1.0, 0.0, 0.0
 
-    # Search small offsets around zero
     max_off = search_px_ratio
     xs = np.linspace(-max_off, max_off, steps)
-    ys = np.linspace(-max_off, max_off, 1)  # keep vertical fixed for now (performance)
+    ys = np.linspace(-max_off, max_off, steps if steps_y is None else steps_y)
+    params = _candidate_grid(xs, ys, scales_x, scales_y)
+    scores = (score_alignments(ctx.edges_integral("x"), rois, params)
+              + score_alignments(ctx.edges_integral("y"), rois, params))
+    best = params[int(np.argmax(scores))]
+    return float(best[0]), float(best[1]), float(best[2]), float(best[3])
 
-    best_score = -1.0
-    best = (0.0, 0.0)
 
-    for dx in xs:
-        for dy in ys:
-            s = 0.0
-            cnt = 0
-            for r in rois:
-                x0, y0, x1, y1 = r
-                x0a = min(1.0, max(0.0, x0 + dx))
-                x1a = min(1.0, max(0.0, x1 + dx))
-                y0a = min(1.0, max(0.0, y0 + dy))
-                y1a = min(1.0, max(0.0, y1 + dy))
-                x0i, y0i, x1i, y1i = _roi_from_norm([x0a, y0a, x1a, y1a], w, h)
-                if x1i > x0i and y1i > y0i:
-                    patch = edges[y0i:y1i, x0i:x1i]
-                    if patch.size:
-                        s += float(np.mean(patch))
-                        cnt += 1
-            if cnt:
-                score = s / cnt
-                if score > best_score:
-                    best_score = score
-                    best = (float(dx), float(dy))
-    return best
\ No newline at end of file
+def estimate_offset(img: SheetLike, template: TemplateLike,
+                    search_px_ratio: float = 0.02, steps: int = 21,
+                    steps_y: Optional[int] = None) -> Tuple[float, float]:
+    """
+    Estimate a small horizontal/vertical offset (normalized 0..1) to better align
+    template ROIs to the image by maximizing edge response inside ROIs.
+    Searches a steps x steps_y grid (steps_y defaults to steps).
+    Returns (offset_x, offset_y) in normalized coordinates.
+    """
+    _, _, ox, oy = estimate_alignment(img, template, search_px_ratio, steps, steps_y)
+    return ox, oy
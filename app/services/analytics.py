@@ -0,0 +1,211 @@
+from typing import Any, Dict, List, Optional, Set
+from datetime import date, datetime
+import threading
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.db.models import Evaluation, TOTAL_SUBJECT
+from app.services.scoring import BLANK, CompiledKey, decode_answers, encode_answers
+
+# Item analysis of stored answers against a sheet version's answer key:
+# per-question difficulty (share correct), discrimination (corrected item-total
+# point-biserial correlation), option frequencies (distractors) and KR-20
+# reliability per subject and for the whole test.
+#
+# Every one of these is a function of a few sums over students (counts per
+# option, number correct, sum of correct * total score, sum and sum of squares of
+# subject and total scores), so answers are folded into ItemStats per
+# (sheet_version, day) and only evaluations newer than the last one seen are
+# read on the next request. Ids can commit out of order under concurrent writers
+# (a lower id may become visible after a higher one), so the last `window` ids
+# below the cursor are re-checked on every refresh and any not yet counted are
+# added. Rows whose answers are still JSON in details (before migrate-answers)
+# are read from there; rows without answers are counted as skipped. A key change
+# starts that sheet version over. Evaluations are append-only in this app; a
+# deleted row stays counted until the process restarts.
+
+# Option codes 0 (blank) .. 26 ('z'), see app.services.scoring
+_NUM_CODES = 27
+
+
+class ItemStats:
+    """Sufficient statistics of item analysis for one answer key."""
+
+    def __init__(self, num_questions: int, num_subjects: int):
+        self.n = 0
+        self.skipped = 0  # evaluations without stored answers
+        self.option_counts = np.zeros((num_questions, _NUM_CODES), dtype=np.int64)
+        self.correct = np.zeros(num_questions, dtype=np.int64)
+        self.correct_total = np.zeros(num_questions, dtype=np.float64)  # sum of total score where correct
+        self.subject_sum = np.zeros(num_subjects, dtype=np.float64)
+        self.subject_sq = np.zeros(num_subjects, dtype=np.float64)
+        self.total_sum = 0.0
+        self.total_sq = 0.0
+
+    def add(self, answers: np.ndarray, key: CompiledKey) -> None:
+        """Fold in an (N, Q) uint8 answer matrix scored against key's first set."""
+        if not len(answers):
+            return
+        q = key.num_questions
+        answers = np.minimum(answers[:, :q], _NUM_CODES - 1)
+        rows = key.codes[0]
+        correct = (answers == rows) & (rows != BLANK)
+        per_subject = correct.astype(np.float32) @ key.subject_onehot
+        total = per_subject.sum(axis=1, dtype=np.float64)
+        flat = (np.arange(answers.shape[1]) * _NUM_CODES + answers).ravel()
+        self.option_counts[:answers.shape[1]] += np.bincount(
+            flat, minlength=answers.shape[1] * _NUM_CODES).reshape(-1, _NUM_CODES)
+        self.n += len(answers)
+        self.correct += correct.sum(axis=0)
+        self.correct_total += total @ correct
+        self.subject_sum += per_subject.sum(axis=0, dtype=np.float64)
+        self.subject_sq += (per_subject.astype(np.float64) ** 2).sum(axis=0)
+        self.total_sum += float(total.sum())
+        self.total_sq += float(total @ total)
+
+    def __iadd__(self, other: "ItemStats") -> "ItemStats":
+        self.n += other.n
+        self.skipped += other.skipped
+        self.option_counts += other.option_counts
+        self.correct += other.correct
+        self.correct_total += other.correct_total
+        self.subject_sum += other.subject_sum
+        self.subject_sq += other.subject_sq
+        self.total_sum += other.total_sum
+        self.total_sq += other.total_sq
+        return self
+
+
+def _variance(n: int, total: float, sq: float) -> float:
+    return max(0.0, sq / n - (total / n) ** 2)
+
+
+def _kr20(p: np.ndarray, variance: float) -> Optional[float]:
+    k = len(p)
+    if k < 2 or variance <= 0:
+        return None
+    return float(k / (k - 1) * (1 - (p * (1 - p)).sum() / variance))
+
+
+def item_analysis(stats: ItemStats, key: CompiledKey) -> Dict[str, Any]:
+    """Statistics for the keyed questions of `key` from accumulated stats."""
+    n = stats.n
+    keyed = np.flatnonzero(key.codes[0] != BLANK)
+    out: Dict[str, Any] = {"count": n, "skipped": stats.skipped, "questions": [], "reliability": {}}
+    if not n:
+        return out
+    p = stats.correct / n
+    # Discrimination: correlation of the item with the total of the other items
+    # (rest = total - item), so an item doesn't inflate its own index
+    rest_mean = (stats.total_sum - stats.correct) / n
+    rest_var = (stats.total_sq - 2 * stats.correct_total + stats.correct) / n - rest_mean ** 2
+    cov = (stats.correct_total - stats.correct) / n - p * rest_mean
+    denom = np.sqrt(np.maximum(p * (1 - p), 0) * np.maximum(rest_var, 0))
+    labels = decode_answers(np.arange(_NUM_CODES, dtype=np.uint8))
+    used = np.flatnonzero(stats.option_counts.any(axis=0) | (np.arange(_NUM_CODES) <= 4))
+    for i in keyed:
+        options = {(labels[c] or "blank"): int(stats.option_counts[i, c]) for c in used}
+        out["questions"].append({
+            "question": int(i + 1),
+            "subject": key.subjects[key.subject_ids[i]],
+            "key": labels[key.codes[0, i]],
+            "difficulty": float(p[i]),
+            "discrimination": float(cov[i] / denom[i]) if denom[i] > 0 else None,
+            "options": options,
+        })
+    for s, subject in enumerate(key.subjects):
+        items = keyed[key.subject_ids[keyed] == s]
+        if len(items):
+            out["reliability"][subject] = _kr20(p[items], _variance(n, stats.subject_sum[s], stats.subject_sq[s]))
+    out["reliability"][TOTAL_SUBJECT] = _kr20(p[keyed], _variance(n, stats.total_sum, stats.total_sq))
+    return out
+
+
+class _VersionStats:
+    def __init__(self, key: CompiledKey):
+        self.key = key
+        self.last_id = 0
+        self.days: Dict[date, ItemStats] = {}
+        self.recent: Set[int] = set()  # counted ids within the re-check window below last_id
+
+
+def _row_answers(row: Any, num_questions: int) -> Optional[np.ndarray]:
+    if row.answers_packed is not None:
+        codes = np.zeros(num_questions, dtype=np.uint8)
+        packed = np.frombuffer(row.answers_packed, dtype=np.uint8)[:num_questions]
+        codes[:packed.size] = packed
+        return codes
+    answers = (row.details or {}).get("answers")
+    return encode_answers(answers, num_questions) if isinstance(answers, list) else None
+
+
+class ItemStatsCache:
+    """ItemStats per (sheet_version, day), kept up to date from the Evaluation table."""
+
+    def __init__(self, batch_size: int = 5000, window: int = 10_000):
+        self.batch_size = batch_size
+        self.window = window
+        self._versions: Dict[str, _VersionStats] = {}
+        self._lock = threading.Lock()
+
+    def _add_rows(self, entry: _VersionStats, rows: List[Any]) -> None:
+        key = entry.key
+        q = key.num_questions
+        by_day: Dict[date, List[np.ndarray]] = {}
+        for r in rows:
+            day = (r.created_at or datetime.utcnow()).date()
+            stats = entry.days.get(day)
+            if stats is None:
+                stats = entry.days[day] = ItemStats(q, len(key.subjects))
+            codes = _row_answers(r, q)
+            if codes is None:
+                stats.skipped += 1
+            else:
+                by_day.setdefault(day, []).append(codes)
+            entry.recent.add(r.id)
+        for day, codes in by_day.items():
+            entry.days[day].add(np.stack(codes), key)
+
+    def _refresh(self, db: Session, sheet_version: str, key: CompiledKey) -> _VersionStats:
+        entry = self._versions.get(sheet_version)
+        if entry is None or not np.array_equal(entry.key.codes, key.codes):
+            entry = self._versions[sheet_version] = _VersionStats(key)
+        cols = (Evaluation.id, Evaluation.created_at, Evaluation.answers_packed, Evaluation.details)
+        version = Evaluation.sheet_version == sheet_version
+        # Late commits below the cursor
+        low = max(0, entry.last_id - self.window)
+        late = [i for (i,) in db.execute(select(Evaluation.id).where(version, Evaluation.id > low,
+                                                                     Evaluation.id <= entry.last_id))
+                if i not in entry.recent]
+        for i in range(0, len(late), self.batch_size):
+            ids = late[i:i + self.batch_size]
+            self._add_rows(entry, db.execute(select(*cols).where(Evaluation.id.in_(ids))).all())
+        while True:
+            rows = db.execute(select(*cols).where(version, Evaluation.id > entry.last_id)
+                              .order_by(Evaluation.id).limit(self.batch_size)).all()
+            if not rows:
+                break
+            self._add_rows(entry, rows)
+            entry.last_id = rows[-1].id
+        low = entry.last_id - self.window
+        entry.recent = {i for i in entry.recent if i > low}
+        return entry
+
+    def analyse(self, db: Session, sheet_version: str, key: CompiledKey,
+                since: Optional[date] = None, until: Optional[date] = None) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._refresh(db, sheet_version, key)
+            stats = ItemStats(key.num_questions, len(key.subjects))
+            for day, day_stats in entry.days.items():
+                if (since is None or day >= since) and (until is None or day <= until):
+                    stats += day_stats
+        return item_analysis(stats, key)
+
+
+_cache = ItemStatsCache()
+
+
+def item_stats_cache() -> ItemStatsCache:
+    return _cache
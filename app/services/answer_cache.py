@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.core.config import settings
+
+# On-disk cache of detected answers. Detection (decode, orient, rectify, align,
+# read bubbles) is the expensive part of grading and depends only on the image
+# bytes, the template geometry and the pipeline options; the answer key does
+# not enter it. Re-grading the same scans after a key fix therefore only needs
+# compute_scores_from_answers. Entries live in a small SQLite file (WAL, so the
+# batch pool's worker processes can share it) and the least recently used ones
+# are evicted beyond settings.answer_cache_max_entries.
+
+# Bump when detection changes in a way that alters answers for the same inputs.
+CACHE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    answers TEXT NOT NULL,
+    alignment TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_answers_last_used ON answers (last_used);
+"""
+
+
+def cache_key(data: bytes, template_digest: Optional[str], options: Dict[str, Any]) -> str:
+    """Key for one sheet: image content hash + template digest ("grid" for the naive
+    grid, which follows from the image size) + detection options."""
+    parts = {"v": CACHE_VERSION, "image": hashlib.sha256(data).hexdigest(),
+             "template": template_digest or "grid", "options": options,
+             "working_size": [settings.working_width, settings.working_height]}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """SQLite-backed LRU of (answers, alignment) by cache_key(). Thread-safe; each
+    process opens its own connection."""
+
+    def __init__(self, path: str, max_entries: int = 200_000, trim_every: int = 256):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.trim_every = max(1, trim_every)
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[Tuple[List[str], Dict[str, float]]]:
+        with self._lock:
+            row = self._conn.execute("SELECT answers, alignment FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key: str, answers: List[str], alignment: Dict[str, float]) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO answers (key, answers, alignment, last_used) "
+                               "VALUES (?, ?, ?, ?)", (key, json.dumps(answers), json.dumps(alignment), time.time()))
+            self._puts += 1
+            if self._puts % self.trim_every == 0:
+                self._trim()
+
+    def trim(self) -> int:
+        """Evict least recently used entries beyond max_entries; returns how many."""
+        with self._lock:
+            return self._trim()
+
+    def _trim(self) -> int:
+        return self._conn.execute(
+            "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used "
+            "LIMIT max(0, (SELECT COUNT(*) FROM answers) - ?))", (self.max_entries,)).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_shared: Dict[int, Optional[AnswerCache]] = {}
+_shared_lock = threading.Lock()
+
+
+def answer_cache() -> Optional[AnswerCache]:
+    """This process's cache at settings.answer_cache_path (None when disabled)."""
+    pid = os.getpid()
+    with _shared_lock:
+        if pid not in _shared:
+            path = settings.answer_cache_path
+            _shared.clear()  # a forked child must not reuse the parent's connection
+            _shared[pid] = AnswerCache(path, settings.answer_cache_max_entries) if path else None
+        return _shared[pid]
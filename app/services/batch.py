@@ -0,0 +1,238 @@
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+import multiprocessing
+import os
+import time
+import zipfile
+
+import cv2
+
+from app.core.config import settings
+from app.services.answer_cache import AnswerCache, answer_cache, cache_key
+from app.services.context import SheetContext
+from app.services.detect import evaluate_by_questions
+from app.services.grid import estimate_grid_rois
+from app.services.imageio import decode_image, working_side
+from app.services.omr import compute_scores_from_answers
+from app.services.preprocess import detect_orientation, rectify_perspective
+from app.services.register import register_template
+from app.services.template import CompiledTemplate, TemplateLike, compile_template
+
+# Batch evaluation shared by Streamlit, the API and the CLI. Sheets are fanned
+# out over a process pool; the template, key and pipeline options are shipped to
+# each worker once (pool initializer) and only the sheet bytes or path travel
+# per task. At most `max_in_flight` sheets are submitted at a time, so a large
+# upload never sits in the pool's queue all at once, and results are yielded in
+# completion order. A failing sheet becomes a SheetResult with `error` set.
+
+SheetSource = Union[str, "os.PathLike[str]", bytes, Tuple[str, bytes]]
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Per-sheet pipeline switches; alignment values are used unless `register`."""
+    orient: bool = True
+    rectify: bool = True
+    register: bool = False
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+    offset_x: float = 0.0
+    offset_y: float = 0.0
+
+    def alignment(self) -> Dict[str, float]:
+        return {"scale_x": self.scale_x, "scale_y": self.scale_y,
+                "offset_x": self.offset_x, "offset_y": self.offset_y}
+
+
+@dataclass
+class SheetResult:
+    index: int
+    name: str
+    answers: List[str] = field(default_factory=list)
+    per_subject: Dict[str, int] = field(default_factory=dict)
+    total: Optional[int] = None
+    alignment: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+    seconds: float = 0.0
+    cached: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _source_name(index: int, source: SheetSource) -> str:
+    if isinstance(source, tuple):
+        return source[0]
+    if isinstance(source, (bytes, bytearray)):
+        return f"sheet-{index + 1}"
+    return os.path.basename(os.fspath(source))
+
+
+def _read_source(source: SheetSource) -> bytes:
+    if isinstance(source, tuple):
+        return source[1]
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    with open(source, "rb") as fh:
+        return fh.read()
+
+
+def is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return bool(base) and not base.startswith(".") and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_zip_sources(archive: Union[str, "os.PathLike[str]", IO[bytes]]) -> Iterator[Tuple[str, bytes]]:
+    """(name, bytes) for every image member of a ZIP archive, in archive order.
+    Members are read one at a time, so only the sheets in flight are in memory."""
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if not info.is_dir() and is_image_name(info.filename) and "__MACOSX/" not in info.filename:
+                yield info.filename, zf.read(info)
+
+
+def evaluate_sheet(data: bytes, template: Optional[CompiledTemplate] = None,
+                   key_map: Optional[Dict[int, str]] = None,
+                   config: PipelineConfig = PipelineConfig(),
+                   cache: Optional[AnswerCache] = None) -> Dict[str, Any]:
+    """Run the full single-sheet pipeline (decode, orient, rectify, align, detect,
+    score). Without a template the naive grid for the sheet's size is used.
+    With a `cache`, detected answers are looked up by image/template/options and
+    only scoring runs on a hit.
+    Returns the SheetResult fields other than index/name/error/seconds.
+    """
+    key = hit = None
+    if cache is not None:
+        key = cache_key(data, template.digest if template is not None else None, asdict(config))
+        hit = cache.get(key)
+    if hit is None:
+        answers, alignment = _detect_answers(data, template, config)
+        if cache is not None:
+            cache.put(key, answers, alignment)
+    else:
+        answers, alignment = hit
+
+    per_subject, total = {}, None
+    if key_map:
+        per_subject, total = compute_scores_from_answers(answers, key_map)
+    return {"answers": answers, "per_subject": per_subject, "total": total, "alignment": alignment,
+            "cached": hit is not None}
+
+
+def _detect_answers(data: bytes, template: Optional[CompiledTemplate],
+                    config: PipelineConfig) -> Tuple[List[str], Dict[str, float]]:
+    img = decode_image(data, max_side=working_side())
+    if config.orient:
+        img, _ = detect_orientation(img)
+    if config.rectify:
+        img = rectify_perspective(img, (settings.working_width, settings.working_height))
+    sheet = SheetContext(img)
+
+    if template is None:
+        h, w = sheet.shape
+        template = _grid_template(w, h)
+        alignment = PipelineConfig().alignment()
+    elif config.register:
+        alignment = register_template(sheet, template).params()
+    else:
+        alignment = config.alignment()
+    return evaluate_by_questions(sheet, template, **alignment), alignment
+
+
+_grid_cache: Dict[Tuple[int, int], CompiledTemplate] = {}
+
+
+def _grid_template(w: int, h: int) -> CompiledTemplate:
+    if (w, h) not in _grid_cache:
+        _grid_cache[(w, h)] = compile_template(estimate_grid_rois(w, h))
+    return _grid_cache[(w, h)]
+
+
+# Worker-process state, set once by the pool initializer
+_job: Dict[str, Any] = {}
+
+
+def _init_worker(template: Optional[CompiledTemplate], key_map: Optional[Dict[int, str]],
+                 config: PipelineConfig) -> None:
+    # One process per core already; keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+    _job.update(template=template, key_map=key_map, config=config)
+
+
+def _evaluate_source(index: int, name: str, source: SheetSource, template: Optional[CompiledTemplate],
+                     key_map: Optional[Dict[int, str]], config: PipelineConfig) -> SheetResult:
+    t0 = time.perf_counter()
+    try:
+        fields = evaluate_sheet(_read_source(source), template, key_map, config, answer_cache())
+        return SheetResult(index, name, seconds=time.perf_counter() - t0, **fields)
+    except Exception as e:
+        return SheetResult(index, name, error=str(e) or type(e).__name__, seconds=time.perf_counter() - t0)
+
+
+def _run_one(index: int, name: str, source: SheetSource) -> SheetResult:
+    return _evaluate_source(index, name, source, _job["template"], _job["key_map"], _job["config"])
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def run_batch(sources: Iterable[SheetSource], template: Optional[TemplateLike] = None,
+              key_map: Optional[Dict[int, str]] = None,
+              config: PipelineConfig = PipelineConfig(),
+              workers: Optional[int] = None,
+              max_in_flight: Optional[int] = None,
+              mp_context: Optional[str] = "spawn") -> Iterator[SheetResult]:
+    """
+    Evaluate sheets and yield a SheetResult for each as soon as it finishes.
+    - sources: file paths, raw bytes, or (name, bytes) pairs; consumed lazily
+    - workers: pool size (default: all cores); <= 1 runs inline in this process
+    - max_in_flight: cap on submitted-but-unfinished sheets (default 2 x workers)
+    - mp_context: multiprocessing start method ("spawn" avoids forking a process
+      that already has OpenCV/server threads running)
+    Results carry the source's position in `index`; order is completion order.
+    """
+    tpl = compile_template(template) if template is not None else None
+    workers = default_workers() if workers is None else workers
+    numbered = ((i, _source_name(i, s), s) for i, s in enumerate(sources))
+
+    if workers <= 1:
+        for i, name, source in numbered:
+            yield _evaluate_source(i, name, source, tpl, key_map, config)
+        return
+
+    limit = max(1, max_in_flight or 2 * workers)
+    ctx = multiprocessing.get_context(mp_context) if mp_context else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(tpl, key_map, config)) as pool:
+        pending: Dict[Future, Tuple[int, str]] = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < limit:
+                item = next(numbered, None)
+                if item is None:
+                    exhausted = True
+                    break
+                try:
+                    pending[pool.submit(_run_one, *item)] = item[:2]
+                except BrokenProcessPool as e:
+                    yield SheetResult(item[0], item[1], error=f"worker failed: {e!r}")
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                index, name = pending.pop(fut)
+                exc = fut.exception()
+                if exc is not None:
+                    # The worker itself died (e.g. out of memory); the sheet still gets a result
+                    yield SheetResult(index, name, error=f"worker failed: {exc!r}")
+                else:
+                    yield fut.result()
@@ -0,0 +1,135 @@
+from typing import Any, Callable, Dict, Hashable, Tuple, Union
+import threading
+import numpy as np
+import cv2
+
+from app.services.roi import integral_image
+
+# Per-sheet derived images. Alignment, registration and detection all start from
+# the same grayscale/CLAHE image and the same edge map; a SheetContext computes
+# each of those on first use and hands the memoized array to every later stage.
+# Derived arrays are shared between callers and must be treated as read-only.
+
+_local = threading.local()
+
+
+def get_clahe(clip_limit: float = 2.0, tile_grid: Tuple[int, int] = (8, 8)) -> "cv2.CLAHE":
+    """CLAHE object reused per thread (cv2.CLAHE instances are not thread-safe)."""
+    cache = getattr(_local, "clahe", None)
+    if cache is None:
+        cache = _local.clahe = {}
+    key = (float(clip_limit), tuple(tile_grid))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid)
+    return clahe
+
+
+def to_gray(img: np.ndarray) -> np.ndarray:
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+
+def vertical_edges(gray: np.ndarray) -> np.ndarray:
+    # Emphasize vertical structures using Sobel X
+    sobelx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    mag = np.abs(sobelx)
+    mag = mag / (mag.max() + 1e-6)
+    return (mag * 255.0).astype(np.uint8)
+
+
+def horizontal_edges(gray: np.ndarray) -> np.ndarray:
+    # Emphasize horizontal structures (row rules, bubble tops/bottoms) using Sobel Y
+    sobely = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    mag = np.abs(sobely)
+    mag = mag / (mag.max() + 1e-6)
+    return (mag * 255.0).astype(np.uint8)
+
+
+def edge_magnitude(gray: np.ndarray) -> np.ndarray:
+    # Gradient magnitude in both axes so vertical misregistration is as visible as horizontal
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    mag = np.abs(gx) + np.abs(gy)
+    mag = mag / (mag.max() + 1e-6)
+    return (mag * 255.0).astype(np.uint8)
+
+
+EDGE_KINDS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {"x": vertical_edges, "y": horizontal_edges,
+                                                            "xy": edge_magnitude}
+
+
+class SheetContext:
+    """Lazily computed, memoized views of one sheet image.
+    - gray: single-channel uint8
+    - clahe: contrast-equalized gray (what every detector reads)
+    - edges(kind): Sobel edge map of `clahe` ("x" vertical edges, "y" horizontal, "xy" magnitude)
+    - binary(block_size, c): 0/1 mask of dark pixels (adaptive mean threshold of `clahe`)
+    - *_integral: summed-area tables of the above
+    - downscaled(max_side): child context for a copy capped at `max_side`
+    """
+
+    def __init__(self, img: np.ndarray):
+        self.image = img
+        self._memo: Dict[Hashable, Any] = {}
+
+    def _get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.image.shape[0], self.image.shape[1]
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self._get("gray", lambda: to_gray(self.image))
+
+    @property
+    def clahe(self) -> np.ndarray:
+        return self._get("clahe", lambda: get_clahe().apply(self.gray))
+
+    @property
+    def clahe_integral(self) -> np.ndarray:
+        return self._get("clahe_integral", lambda: integral_image(self.clahe))
+
+    def edges(self, kind: str = "x") -> np.ndarray:
+        if kind not in EDGE_KINDS:
+            raise ValueError(f"Unsupported edge kind. Expected one of: {', '.join(EDGE_KINDS)}")
+        return self._get(("edges", kind), lambda: EDGE_KINDS[kind](self.clahe))
+
+    def edges_integral(self, kind: str = "x") -> np.ndarray:
+        return self._get(("edges_integral", kind), lambda: integral_image(self.edges(kind)))
+
+    def binary(self, block_size: int = 31, c: int = 5) -> np.ndarray:
+        return self._get(("binary", block_size, c), lambda: cv2.adaptiveThreshold(
+            self.clahe, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block_size, c))
+
+    def binary_integral(self, block_size: int = 31, c: int = 5) -> np.ndarray:
+        return self._get(("binary_integral", block_size, c),
+                         lambda: integral_image(self.binary(block_size, c)))
+
+    def downscaled(self, max_side: int) -> "SheetContext":
+        """Context for the grayscale sheet resized (INTER_AREA) to a long side of at
+        most `max_side`; returns self when the sheet is already that small."""
+        h, w = self.shape
+        f = max_side / float(max(h, w))
+        if f >= 1.0:
+            return self
+
+        def build() -> "SheetContext":
+            size = (max(1, int(round(w * f))), max(1, int(round(h * f))))
+            return SheetContext(cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA))
+        return self._get(("downscaled", int(max_side)), build)
+
+
+SheetLike = Union[SheetContext, np.ndarray]
+
+
+def sheet_context(sheet: SheetLike) -> SheetContext:
+    """Wrap an image in a SheetContext; existing contexts pass through."""
+    if isinstance(sheet, SheetContext):
+        return sheet
+    return SheetContext(sheet)
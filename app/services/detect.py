@@ -1,104 +1,88 @@
-from typing import Dict, Any, List, Tuple
+from typing import List, Union
 import numpy as np
-import cv2
+from app.services.context import SheetLike, sheet_context
+from app.services.roi import box_means
+from app.services.template import CompiledTemplate, TemplateLike, compile_template
 
 # Threshold utilities adapted from proven OMR approaches (re-implemented)
 # We operate on mean intensities inside each option ROI and pick selections
 # by finding large gaps in distributions (global + local thresholds).
 
 
-def _to_gray(img: np.ndarray) -> np.ndarray:
-    if img.ndim == 3:
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img
-    return gray
-
-
-def _clahe(gray: np.ndarray) -> np.ndarray:
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    return clahe.apply(gray)
-
-
-def _roi_from_norm(norm_roi: List[float], w: int, h: int) -> Tuple[int, int, int, int]:
-    x0, y0, x1, y1 = norm_roi
-    x0i, y0i = int(max(0, min(w - 1, x0 * w))), int(max(0, min(h - 1, y0 * h)))
-    x1i, y1i = int(max(0, min(w, x1 * w))), int(max(0, min(h, y1 * h)))
-    return x0i, y0i, x1i, y1i
-
-
-def _mean_intensity(gray: np.ndarray, roi_box: Tuple[int, int, int, int]) -> float:
-    x0, y0, x1, y1 = roi_box
-    patch = gray[y0:y1, x0:x1]
-    if patch.size == 0:
-        return 255.0
-    return float(np.mean(patch))
-
-
-def _largest_gap_threshold(vals: List[float], looseness: int = 1, min_jump: float = 8.0, default_thr: float = 160.0) -> float:
-    if not vals:
-        return default_thr
-    vs = sorted(vals)
+def _largest_gap_threshold(vals: np.ndarray, looseness: int = 1, min_jump: float = 8.0,
+                           default_thr: Union[float, np.ndarray] = 160.0) -> np.ndarray:
+    """Row-wise largest-gap threshold over a (rows x n) matrix; NaN entries are ignored.
+    For each row the sorted values are scanned for the widest jump spanning
+    `looseness` neighbours; the threshold sits in the middle of that jump.
+    Rows without a jump above `min_jump` fall back to `default_thr`.
+    """
+    vals = np.atleast_2d(np.asarray(vals, dtype=np.float64))
+    rows = vals.shape[0]
+    thr = np.broadcast_to(np.asarray(default_thr, dtype=np.float64), (rows,)).copy()
     ls = max(1, (looseness + 1) // 2)
-    l = len(vs) - ls
-    max_jump = min_jump
-    thr = default_thr
-    for i in range(ls, l):
-        jump = vs[i + ls] - vs[i - ls]
-        if jump > max_jump:
-            max_jump = jump
-            thr = vs[i - ls] + jump / 2.0
-    return float(thr)
-
-
-def _choose_option_by_threshold(intensities: Dict[str, float], local_thr: float, margin: float = 6.0) -> str:
-    # Lower intensity => darker => marked. Select those below local_thr.
-    below = {k: v for k, v in intensities.items() if v <= local_thr}
-    if not below:
-        return ""  # blank/uncertain
-    # Pick the lowest intensity (darkest)
-    best_opt, best_val = min(below.items(), key=lambda kv: kv[1])
-    # Disambiguate with margin from second-best (if any)
-    others = [v for k, v in below.items() if k != best_opt]
-    if others:
-        second = min(others)
-        if (second - best_val) < margin:
-            return ""  # ambiguous
-    return best_opt
+    span = 2 * ls
+    if vals.shape[1] <= span:
+        return thr
+    vs = np.sort(vals, axis=1)  # NaN sorts last
+    counts = np.count_nonzero(~np.isnan(vals), axis=1)
+    # jumps[:, j] is vs[j + 2ls] - vs[j], i.e. the jump centred on i = j + ls
+    jumps = vs[:, span:] - vs[:, :-span]
+    in_range = np.arange(jumps.shape[1])[None, :] < (counts - span)[:, None]
+    jumps = np.where(in_range, jumps, -np.inf)
+    r = np.arange(rows)
+    best = np.argmax(jumps, axis=1)  # first maximum, like a strict ">" scan
+    best_jump = jumps[r, best]
+    hit = best_jump > min_jump
+    thr[hit] = vs[r, best][hit] + best_jump[hit] / 2.0
+    return thr
+
+
+def _choose_option_by_threshold(intensities: np.ndarray, local_thr: np.ndarray, margin: float = 6.0) -> np.ndarray:
+    """Pick one option column per row, or -1 for blank/ambiguous rows.
+    Lower intensity => darker => marked. Options at or below the row threshold
+    are candidates; the darkest wins unless the runner-up is within `margin`.
+    """
+    rows, n_opts = intensities.shape
+    if n_opts == 0:
+        return np.full(rows, -1, dtype=np.int64)
+    below = intensities <= local_thr[:, None]  # NaN padding never qualifies
+    masked = np.where(below, intensities, np.inf)
+    r = np.arange(rows)
+    best = np.argmin(masked, axis=1)  # ties resolve to the first option
+    best_val = masked[r, best]
+    masked[r, best] = np.inf
+    second = masked.min(axis=1)
+    with np.errstate(invalid="ignore"):
+        chosen = np.isfinite(best_val) & ~((second - best_val) < margin)
+    return np.where(chosen, best, -1)
+
+
+def option_intensities(sheet: SheetLike, template: CompiledTemplate,
+                       scale_x: float = 1.0, scale_y: float = 1.0,
+                       offset_x: float = 0.0, offset_y: float = 0.0) -> np.ndarray:
+    """Mean CLAHE intensity of every option ROI as one (questions x options) array,
+    read from the sheet's summed-area table; padded slots are NaN.
+    """
+    ctx = sheet_context(sheet)
+    h, w = ctx.shape
+    px = template.pixel_boxes(w, h, scale_x, scale_y, offset_x, offset_y)
+    means = box_means(ctx.clahe_integral, px, empty=255.0)
+    return template.to_grid(means)
 
 
-def evaluate_by_questions(img: np.ndarray, questions: List[Dict[str, Any]],
+def evaluate_by_questions(img: SheetLike, questions: TemplateLike,
                           scale_x: float = 1.0, scale_y: float = 1.0,
                           offset_x: float = 0.0, offset_y: float = 0.0) -> List[str]:
     """
-    Evaluate answers given a list of question dicts with 'index' and 'options' -> normalized ROIs.
+    Evaluate answers given a list of question dicts with 'index' and 'options' -> normalized ROIs
+    (or a CompiledTemplate built from them).
     Returns list of selected options or empty string for blank/ambiguous.
     """
-    gray = _clahe(_to_gray(img))
-    h, w = gray.shape
-
-    # Collect all intensities across all options for global calibration
-    all_vals: List[float] = []
-    per_question_vals: List[Tuple[int, Dict[str, float]]] = []
-
-    def _adj(norm_roi: List[float]) -> List[float]:
-        x0, y0, x1, y1 = norm_roi
-        return [x0 * scale_x + offset_x, y0 * scale_y + offset_y, x1 * scale_x + offset_x, y1 * scale_y + offset_y]
-
-    for q in sorted(questions, key=lambda qq: qq.get("index", 0)):
-        opts = q.get("options", {})
-        intensities: Dict[str, float] = {}
-        for opt, norm_roi in opts.items():
-            box = _roi_from_norm(_adj(norm_roi), w, h)
-            intensities[opt] = _mean_intensity(gray, box)
-            all_vals.append(intensities[opt])
-        per_question_vals.append((q.get("index", 0), intensities))
-
-    global_thr = _largest_gap_threshold(all_vals, looseness=3, min_jump=6.0, default_thr=160.0)
-
-    answers: List[str] = []
-    for _, intensities in per_question_vals:
-        local_thr = _largest_gap_threshold(list(intensities.values()), looseness=1, min_jump=4.0, default_thr=global_thr)
-        ans = _choose_option_by_threshold(intensities, local_thr, margin=6.0)
-        answers.append(ans)
-    return answers
\ No newline at end of file
+    template = compile_template(questions)
+    intensities = option_intensities(img, template, scale_x, scale_y, offset_x, offset_y)
+
+    # Global calibration across all options, then a local threshold per question
+    global_thr = _largest_gap_threshold(intensities[template.valid][None, :], looseness=3, min_jump=6.0, default_thr=160.0)[0]
+    local_thr = _largest_gap_threshold(intensities, looseness=1, min_jump=4.0, default_thr=global_thr)
+    picks = _choose_option_by_threshold(intensities, local_thr, margin=6.0)
+    return template.labels_for(picks)
@@ -0,0 +1,309 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Union
+import csv
+import logging
+import os
+import re
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.batch import SheetResult
+from app.services.omr import format_answers_as_columns
+from app.services.scoring import decode_answers, encode_answer_strings
+
+# Incremental result writers for long runs. Rows are written (and flushed) as
+# sheets finish instead of being collected into one DataFrame at the end, so a
+# killed run keeps everything it already graded and memory stays flat.
+# Excel output uses openpyxl's write-only mode, which streams every sheet to a
+# temporary file instead of holding the workbook in memory.
+# Parquet output is columnar for analytics: one uint8 column per question
+# (q001, q002, ...; option codes from app.services.scoring) instead of an answer
+# string, so a season of answers loads back as an (N x Q) matrix with a
+# memory-mapped column scan. It needs pyarrow, which is optional: pip install pyarrow
+
+logger = logging.getLogger(__name__)
+
+# Questions on the naive grid (app.services.grid), the default Parquet width
+DEFAULT_QUESTIONS = 100
+
+
+def result_columns() -> List[str]:
+    return ["sha256", "filename", "student_code", "sheet_version",
+            *settings.subjects, "total", "answers", "error", "seconds"]
+
+
+def student_code_for(name: str) -> str:
+    """Default student code: the file name without directory or extension."""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def result_row(res: SheetResult, sheet_version: str, sha256: str = "") -> Dict[str, Any]:
+    row: Dict[str, Any] = {
+        "sha256": sha256,
+        "filename": res.name,
+        "student_code": student_code_for(res.name),
+        "sheet_version": sheet_version,
+        "total": res.total,
+        # One character per question, "-" for blank/ambiguous
+        "answers": "".join(a or "-" for a in res.answers),
+        "error": res.error or "",
+        "seconds": round(res.seconds, 4),
+    }
+    for s in settings.subjects:
+        row[s] = res.per_subject.get(s)
+    return row
+
+
+class CsvResultWriter:
+    """Append rows to a CSV file, writing the header only for a new/empty file."""
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        self.path = path
+        self.columns = list(columns)
+        fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fh = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._fh, fieldnames=self.columns, extrasaction="ignore")
+        if fresh:
+            self._writer.writeheader()
+            self._fh.flush()
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._writer.writerow(row)
+        self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __enter__(self) -> "CsvResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:  # optional dependency
+        raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _next_free_path(path: str) -> str:
+    """`path`, or `stem.partN.ext` for the first N that doesn't exist yet."""
+    if not os.path.exists(path):
+        return path
+    stem, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(f"{stem}.part{n}{ext}"):
+        n += 1
+    return f"{stem}.part{n}{ext}"
+
+
+def question_columns(num_questions: int) -> List[str]:
+    width = max(3, len(str(num_questions)))
+    return [f"q{i:0{width}d}" for i in range(1, num_questions + 1)]
+
+
+class ParquetResultWriter:
+    """Write rows to Parquet in row groups of `row_group_size`, with the answer
+    string of each row spread over `num_questions` uint8 code columns (missing
+    answers are blank; extra ones are dropped with a warning). The width is recorded in the
+    schema metadata. Parquet files can't be appended to, so a resumed run writes
+    `<stem>.partN.parquet` next to the existing file instead of overwriting it."""
+
+    def __init__(self, path: str, columns: Sequence[str], row_group_size: int = 1000,
+                 num_questions: int = DEFAULT_QUESTIONS):
+        self._pa = _require_pyarrow()
+        self.columns = [c for c in columns if c != "answers"]
+        self.num_questions = num_questions
+        self.path = _next_free_path(path)
+        self.row_group_size = max(1, row_group_size)
+        self._rows: List[Dict[str, Any]] = []
+        self._answers: List[str] = []
+        self._writer = None
+        self._schema = self._make_schema()
+
+    def _flush(self) -> None:
+        if not self._rows:
+            return
+        pa = self._pa
+        meta = pa.Table.from_pylist(self._rows, schema=pa.schema(list(self._schema)[:len(self.columns)]))
+        codes = encode_answer_strings(self._answers, self.num_questions)
+        arrays = [*meta.columns, *(pa.array(codes[:, j]) for j in range(self.num_questions))]
+        table = pa.Table.from_arrays(arrays, schema=self._schema)
+        if self._writer is None:
+            self._writer = pa.parquet.ParquetWriter(self.path, self._schema)
+        self._writer.write_table(table)
+        self._rows, self._answers = [], []
+
+    def _make_schema(self):
+        pa = self._pa
+        types = {"total": pa.float64(), "seconds": pa.float64(), **{s: pa.float64() for s in settings.subjects}}
+        fields = [(c, types.get(c, pa.string())) for c in self.columns]
+        fields += [(q, pa.uint8()) for q in question_columns(self.num_questions)]
+        return pa.schema(fields, metadata={"omr.num_questions": str(self.num_questions),
+                                           "omr.answer_codes": "0=blank,1=a,2=b,..."})
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._rows.append({c: row.get(c) for c in self.columns})
+        answers = row.get("answers") or ""
+        if len(answers) > self.num_questions:
+            logger.warning("%s: %d answers but the Parquet schema has %d question columns; "
+                           "answers after q%d are not stored (sha256 %s)", row.get("filename"),
+                           len(answers), self.num_questions, self.num_questions, row.get("sha256") or "-")
+        self._answers.append(answers)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "ParquetResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class XlsxResultWriter:
+    """Write a Summary sheet (one row per sheet, without the answers string) and,
+    with `answer_grids`, one 'Answers_<name>' sheet per graded file laid out by
+    subject like the key workbook. Each answer sheet is closed as soon as it is
+    written. Workbooks can't be appended to, so an existing file is kept and a
+    `<stem>.partN.xlsx` is written next to it."""
+
+    def __init__(self, path: str, columns: Sequence[str], answer_grids: bool = False):
+        from openpyxl import Workbook
+        self.path = _next_free_path(path)
+        self.columns = [c for c in columns if c not in ("answers", "sha256", "seconds")]
+        self.answer_grids = answer_grids
+        self._wb = Workbook(write_only=True)
+        self._summary = self._wb.create_sheet("Summary")
+        self._summary.append(self.columns)
+        self._titles: Set[str] = {"Summary"}
+
+    def _title(self, name: str) -> str:
+        base = "Answers_" + re.sub(r"[^A-Za-z0-9 ._-]", "", os.path.basename(name))[:22]
+        title, n = base, 1
+        while title.lower() in self._titles:
+            n += 1
+            title = f"{base[:27]}~{n}"
+        self._titles.add(title.lower())
+        return title
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._summary.append([row.get(c) for c in self.columns])
+        if self.answer_grids and not row.get("error") and row.get("answers"):
+            cols = format_answers_as_columns(["" if a == "-" else a for a in row["answers"]])
+            ws = self._wb.create_sheet(self._title(row.get("filename") or "sheet"))
+            ws.append(list(cols))
+            for values in zip(*cols.values()):
+                ws.append(list(values))
+            ws.close()
+
+    def close(self) -> None:
+        if self._wb is not None:
+            self._wb.save(self.path)
+            self._wb = None
+
+    def __enter__(self) -> "XlsxResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_result_writer(path: str, columns: Optional[Sequence[str]] = None, row_group_size: int = 1000,
+                       answer_grids: bool = False, num_questions: int = DEFAULT_QUESTIONS):
+    """CSV, Parquet or Excel writer chosen by the file extension (.csv / .parquet / .xlsx)."""
+    columns = list(columns or result_columns())
+    lower = path.lower()
+    if lower.endswith((".parquet", ".pq")):
+        return ParquetResultWriter(path, columns, row_group_size=row_group_size, num_questions=num_questions)
+    if lower.endswith(".xlsx"):
+        return XlsxResultWriter(path, columns, answer_grids=answer_grids)
+    return CsvResultWriter(path, columns)
+
+
+def export_results(results: Iterable[SheetResult], path: str, sheet_version: str,
+                   answer_grids: bool = False, hashes: Optional[Sequence[str]] = None,
+                   num_questions: int = DEFAULT_QUESTIONS) -> str:
+    """Write a stream of results (e.g. straight from run_batch) to `path` one row at
+    a time; returns the path actually written. `hashes[i]` is the sha256 of the
+    sheet with index i, if known."""
+    with open_result_writer(path, answer_grids=answer_grids, num_questions=num_questions) as writer:
+        for res in results:
+            sha = hashes[res.index] if hashes is not None else ""
+            writer.write(result_row(res, sheet_version, sha))
+    return writer.path
+
+
+def completed_hashes(paths: Iterable[str]) -> Set[str]:
+    """sha256 values already present in checkpoint files (one hash per line), CSV
+    outputs (their sha256 column) or Parquet outputs (read with pyarrow when it is
+    installed). Excel outputs are skipped: the checkpoint covers them. Missing
+    files are skipped."""
+    done: Set[str] = set()
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        lower = path.lower()
+        if lower.endswith((".parquet", ".pq")):
+            done.update(_parquet_hashes(path))
+        elif lower.endswith(".xlsx"):
+            continue
+        else:
+            with open(path, newline="", encoding="utf-8") as fh:
+                if lower.endswith(".csv"):
+                    done.update(row["sha256"] for row in csv.DictReader(fh) if row.get("sha256"))
+                else:
+                    done.update(line.strip() for line in fh if line.strip())
+    return done
+
+
+def _parquet_hashes(path: str) -> Set[str]:
+    try:
+        pq = _require_pyarrow().parquet
+    except RuntimeError:
+        return set()
+    if "sha256" not in pq.read_schema(path).names:
+        return set()
+    return {h for h in pq.read_table(path, columns=["sha256"]).column("sha256").to_pylist() if h}
+
+
+def load_answer_table(paths: Union[str, Sequence[str]], columns: Sequence[str] = ("sheet_version",)):
+    """Read columnar Parquet results into (answers, meta): an (N, Q) uint8 code
+    matrix ready for app.services.scoring.score_batch, and a dict of the requested
+    metadata columns as NumPy arrays. Files are memory-mapped and only the
+    question columns plus `columns` are read; several files (e.g. the .partN
+    files of a resumed run or per-shard outputs) are stacked in order."""
+    pa = _require_pyarrow()
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    blocks: List[np.ndarray] = []
+    meta: Dict[str, List[np.ndarray]] = {c: [] for c in columns}
+    width = None
+    for path in paths:
+        schema = pa.parquet.read_schema(path, memory_map=True)
+        qcols = [n for n in schema.names if n[:1] == "q" and n[1:].isdigit()]
+        if width is not None and len(qcols) != width:
+            raise ValueError(f"{path}: {len(qcols)} question columns, expected {width}")
+        width = len(qcols)
+        table = pa.parquet.read_table(path, columns=[*qcols, *columns], memory_map=True)
+        block = np.empty((table.num_rows, width), dtype=np.uint8)
+        for j, q in enumerate(qcols):
+            block[:, j] = table.column(q).to_numpy()
+        blocks.append(block)
+        for c in columns:
+            meta[c].append(table.column(c).to_numpy(zero_copy_only=False))
+    answers = np.concatenate(blocks) if blocks else np.zeros((0, width or 0), dtype=np.uint8)
+    return answers, {c: (np.concatenate(v) if v else np.array([])) for c, v in meta.items()}
+
+
+def answer_strings(codes: np.ndarray) -> List[str]:
+    """(N, Q) codes -> answer strings in the CSV layout ('-' for blank)."""
+    return ["".join(a or "-" for a in decode_answers(row)) for row in codes]
@@ -0,0 +1,67 @@
+from typing import Optional, Tuple
+from io import BytesIO
+import numpy as np
+import cv2
+from PIL import Image
+
+from app.core.config import settings
+
+# Shared decode for every entry point (API routes, Streamlit, batch). Uploads are
+# decoded straight from their bytes to a single-channel uint8 array; JPEGs use
+# libjpeg's reduced-size DCT decoding (1/2, 1/4, 1/8) whenever the result still
+# covers the working size, so a 12 MP phone photo never exists in memory at full
+# resolution, let alone as RGB plus a NumPy copy of it.
+
+_REDUCED_GRAY = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+_REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                  4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def working_side() -> int:
+    """Long side of the canonical working size (settings.working_width/height)."""
+    return max(settings.working_width, settings.working_height)
+
+
+def probe_image(data: bytes) -> Tuple[Optional[str], int, int]:
+    """(format, width, height) from the image header without decoding pixels."""
+    try:
+        with Image.open(BytesIO(data)) as im:
+            return im.format, int(im.size[0]), int(im.size[1])
+    except Exception:
+        return None, 0, 0
+
+
+def reduction_factor(width: int, height: int, max_side: Optional[int]) -> int:
+    """Largest JPEG DCT scale-down (1, 2, 4 or 8) keeping the long side >= max_side."""
+    if not max_side:
+        return 1
+    long_side = max(width, height)
+    for factor in (8, 4, 2):
+        if long_side // factor >= max_side:
+            return factor
+    return 1
+
+
+def decode_image(data: bytes, max_side: Optional[int] = None, gray: bool = True) -> np.ndarray:
+    """
+    Decode encoded image bytes into a uint8 array.
+    - max_side: JPEGs are decoded at 1/2, 1/4 or 1/8 scale while their long side
+      stays >= max_side (None decodes at full resolution); other formats decode
+      at full size
+    - gray: return (H, W) grayscale, otherwise (H, W, 3) RGB
+    EXIF orientation is ignored, as with PIL; detect_orientation handles rotation.
+    Raises ValueError when the bytes are not a decodable image.
+    """
+    fmt, w, h = probe_image(data)
+    factor = reduction_factor(w, h, max_side) if fmt == "JPEG" else 1
+    flags = (_REDUCED_GRAY if gray else _REDUCED_COLOR)[factor] | cv2.IMREAD_IGNORE_ORIENTATION
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if img is not None:
+        return img if gray else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    # Formats OpenCV was built without (or can't parse) go through PIL
+    if fmt is None:
+        raise ValueError("Unrecognized image data")
+    with Image.open(BytesIO(data)) as im:
+        return np.asarray(im.convert("L" if gray else "RGB"))
@@ -0,0 +1,271 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dataclasses import asdict
+from datetime import datetime, timedelta
+import logging
+import os
+import re
+import shutil
+import socket
+import time
+import uuid
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.models import Job, JobItem, SessionLocal
+from app.services.batch import PipelineConfig, SheetResult, run_batch
+from app.services.template import CompiledTemplate, compile_template
+
+# Database-backed job queue for long evaluation runs. POST /api/jobs stores the
+# uploads under settings.jobs_dir and inserts one JobItem per sheet; worker
+# processes (`python -m app.worker`) claim small chunks of pending items with a
+# time-limited lease, evaluate them through the batch engine and write each
+# result back as it completes. Items whose worker died are re-claimed once their
+# lease expires, so a run survives browser disconnects and API/worker restarts.
+# Uploads are deleted once the job is done; results live in the database.
+
+logger = logging.getLogger(__name__)
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(name))[:80] or "sheet"
+
+
+def job_dir(job_id: int) -> str:
+    return os.path.join(settings.jobs_dir, str(job_id))
+
+
+def _remove_uploads(job_id: int) -> None:
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def create_job(db: Session, sheet_version: str, sources: Iterable[Tuple[str, bytes]],
+               template: Optional[Dict[str, Any]] = None,
+               key_map: Optional[Dict[int, str]] = None,
+               config: PipelineConfig = PipelineConfig()) -> Job:
+    """Persist uploads to disk and enqueue one item per sheet. Returns the Job."""
+    job = Job(sheet_version=sheet_version, template=template, config=asdict(config),
+              key={str(q): a for q, a in key_map.items()} if key_map else None)
+    db.add(job)
+    db.flush()
+    folder = job_dir(job.id)
+    os.makedirs(folder, exist_ok=True)
+    count = 0
+    try:
+        for position, (name, data) in enumerate(sources):
+            path = os.path.join(folder, f"{position:06d}_{_safe_name(name)}")
+            with open(path, "wb") as fh:
+                fh.write(data)
+            db.add(JobItem(job_id=job.id, position=position, name=name, path=path))
+            count += 1
+    except BaseException:
+        db.rollback()
+        _remove_uploads(job.id)
+        raise
+    job.total = count
+    job.status = "queued" if count else "done"
+    db.commit()
+    db.refresh(job)
+    if not count:
+        _remove_uploads(job.id)
+    return job
+
+
+def claim_items(db: Session, owner: str, limit: int,
+                lease_seconds: Optional[int] = None) -> List[JobItem]:
+    """Lease up to `limit` pending (or lease-expired) items to `owner`.
+    The conditional UPDATE only takes rows nobody else holds, so concurrent
+    workers never evaluate the same sheet twice within a lease."""
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=lease_seconds or settings.job_lease_seconds)
+    _fail_exhausted(db, now)
+    claimable = or_(JobItem.status == "pending",
+                    and_(JobItem.status == "leased", JobItem.lease_expires < now))
+    ids = [i for (i,) in db.query(JobItem.id).filter(claimable)
+           .order_by(JobItem.job_id, JobItem.position).limit(limit).all()]
+    if not ids:
+        return []
+    db.execute(update(JobItem).where(JobItem.id.in_(ids), claimable)
+               .values(status="leased", lease_owner=owner, lease_expires=expires,
+                       attempts=JobItem.attempts + 1))
+    job_ids = {j for (j,) in db.query(JobItem.job_id).filter(JobItem.id.in_(ids)).distinct()}
+    db.execute(update(Job).where(Job.id.in_(job_ids), Job.status == "queued")
+               .values(status="running", started_at=now))
+    db.commit()
+    return (db.query(JobItem).filter(JobItem.id.in_(ids), JobItem.status == "leased",
+                                     JobItem.lease_owner == owner)
+            .order_by(JobItem.job_id, JobItem.position).all())
+
+
+def _fail_exhausted(db: Session, now: datetime) -> None:
+    """Give up on sheets whose lease expired settings.job_max_attempts times (e.g.
+    one that crashes its worker) so the job can still finish."""
+    stuck = (db.query(JobItem).filter(JobItem.status == "leased", JobItem.lease_expires < now,
+                                      JobItem.attempts >= settings.job_max_attempts).all())
+    for item in stuck:
+        res = SheetResult(item.position, item.name, error=f"abandoned after {item.attempts} attempts")
+        complete_item(db, item, item.lease_owner, res)
+
+
+def complete_item(db: Session, item: JobItem, owner: str, res: SheetResult) -> bool:
+    """Store a finished sheet and advance the job's counters in one transaction.
+    Returns False when the lease was lost (another worker re-claimed the item)."""
+    now = datetime.utcnow()
+    payload = {k: v for k, v in res.to_dict().items() if k not in ("index", "name", "error", "seconds")}
+    done = db.execute(update(JobItem)
+                      .where(JobItem.id == item.id, JobItem.status == "leased", JobItem.lease_owner == owner)
+                      .values(status="done" if res.ok else "error", result=payload if res.ok else None,
+                              error=res.error, seconds=res.seconds, finished_at=now,
+                              lease_owner=None, lease_expires=None)).rowcount
+    if not done:
+        db.rollback()
+        return False
+    db.execute(update(Job).where(Job.id == item.job_id)
+               .values(processed=Job.processed + 1, failed=Job.failed + (0 if res.ok else 1)))
+    finished = db.execute(update(Job).where(Job.id == item.job_id, Job.processed >= Job.total,
+                                            Job.status != "done")
+                          .values(status="done", finished_at=now)).rowcount
+    db.commit()
+    if finished:
+        _remove_uploads(item.job_id)
+    return True
+
+
+def purge_finished_uploads(db: Session, grace_seconds: int = 86_400) -> int:
+    """Delete upload folders under settings.jobs_dir of jobs that are done. A folder
+    without a Job row may belong to a job whose create_job hasn't committed yet, so
+    it is only removed once untouched for `grace_seconds` (left by a failed
+    enqueue or an older version). Returns the number removed."""
+    if not os.path.isdir(settings.jobs_dir):
+        return 0
+    ids = [int(n) for n in os.listdir(settings.jobs_dir) if n.isdigit()]
+    if not ids:
+        return 0
+    status = dict(db.query(Job.id, Job.status).filter(Job.id.in_(ids)).all())
+    cutoff = time.time() - grace_seconds
+    stale = []
+    for job_id in ids:
+        if job_id in status:
+            if status[job_id] == "done":
+                stale.append(job_id)
+        elif os.path.getmtime(job_dir(job_id)) < cutoff:
+            stale.append(job_id)
+    for job_id in stale:
+        _remove_uploads(job_id)
+    return len(stale)
+
+
+def job_status(db: Session, job_id: int) -> Optional[Dict[str, Any]]:
+    """Status, progress and throughput (sheets/s since the first claim) of a job."""
+    job = db.get(Job, job_id)
+    if job is None:
+        return None
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    rate = job.processed / elapsed if elapsed > 0 else None
+    remaining = job.total - job.processed
+    counts = dict(_status_counts(db, job_id))
+    return {
+        "id": job.id,
+        "status": job.status,
+        "sheet_version": job.sheet_version,
+        "total": job.total,
+        "processed": job.processed,
+        "failed": job.failed,
+        "items": counts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "elapsed_seconds": round(elapsed, 3),
+        "sheets_per_second": round(rate, 3) if rate else None,
+        "eta_seconds": 0.0 if not remaining else (round(remaining / rate, 1) if rate else None),
+    }
+
+
+def _status_counts(db: Session, job_id: int) -> List[Tuple[str, int]]:
+    return (db.query(JobItem.status, func.count(JobItem.id)).filter(JobItem.job_id == job_id)
+            .group_by(JobItem.status).all())
+
+
+def job_results(db: Session, job_id: int, after: int = -1, limit: int = 500) -> List[Dict[str, Any]]:
+    """Finished items of a job ordered by upload position, starting after `after`."""
+    rows = (db.query(JobItem).filter(JobItem.job_id == job_id, JobItem.position > after,
+                                     JobItem.status.in_(("done", "error")))
+            .order_by(JobItem.position).limit(limit).all())
+    return [{"position": r.position, "name": r.name, "status": r.status, "error": r.error,
+             "seconds": r.seconds, **(r.result or {})} for r in rows]
+
+
+def iter_job_results(db: Session, job_id: int, chunk: int = 1000) -> Iterable[SheetResult]:
+    """Finished items of a job as SheetResults in upload order, read `chunk` rows
+    at a time (for exports of arbitrarily large jobs)."""
+    after = -1
+    while True:
+        rows = (db.query(JobItem).filter(JobItem.job_id == job_id, JobItem.position > after,
+                                         JobItem.status.in_(("done", "error")))
+                .order_by(JobItem.position).limit(chunk).all())
+        if not rows:
+            return
+        for r in rows:
+            fields = {k: v for k, v in (r.result or {}).items() if k in ("answers", "per_subject", "total", "alignment")}
+            yield SheetResult(r.position, r.name, error=r.error, seconds=r.seconds or 0.0, **fields)
+        after = rows[-1].position
+        db.expunge_all()  # keep the session from accumulating every row
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _job_inputs(db: Session, job_id: int, cache: Dict[int, Tuple[Optional[CompiledTemplate], Optional[Dict[int, str]], PipelineConfig]]):
+    if job_id not in cache:
+        job = db.get(Job, job_id)
+        tpl = compile_template(job.template) if job.template else None
+        key_map = {int(q): a for q, a in job.key.items()} if job.key else None
+        cache[job_id] = (tpl, key_map, PipelineConfig(**(job.config or {})))
+    return cache[job_id]
+
+
+def work_once(owner: str, chunk: int = 8, lease_seconds: Optional[int] = None,
+              cache: Optional[Dict] = None) -> int:
+    """Claim one chunk of items, evaluate them in this process and store each
+    result as it completes. Returns the number of items claimed (0 = queue empty).
+    Parallelism comes from running several workers (see app/worker.py), each
+    claiming its own chunks."""
+    cache = {} if cache is None else cache
+    db = SessionLocal()
+    try:
+        items = claim_items(db, owner, chunk, lease_seconds)
+        by_job: Dict[int, List[JobItem]] = {}
+        for item in items:
+            by_job.setdefault(item.job_id, []).append(item)
+        for job_id, job_items in by_job.items():
+            tpl, key_map, config = _job_inputs(db, job_id, cache)
+            for res in run_batch([it.path for it in job_items], tpl, key_map, config, workers=1):
+                complete_item(db, job_items[res.index], owner, res)
+        return len(items)
+    finally:
+        db.close()
+
+
+def run_worker(owner: Optional[str] = None, chunk: int = 8, poll_seconds: float = 2.0,
+               once: bool = False) -> int:
+    """Process queued items until interrupted (or until the queue is empty with
+    `once`), logging throughput per chunk. Returns the number of items processed."""
+    owner = owner or default_owner()
+    cache: Dict = {}
+    processed = 0
+    t0 = time.perf_counter()
+    while True:
+        start = time.perf_counter()
+        n = work_once(owner, chunk, cache=cache)
+        if n:
+            processed += n
+            dt = time.perf_counter() - start
+            logger.info("[%s] %d sheets in %.2fs (%.1f/s); %d total (%.1f/s)", owner, n, dt, n / dt,
+                        processed, processed / (time.perf_counter() - t0))
+            continue
+        if once:
+            return processed
+        time.sleep(poll_seconds)
@@ -1,28 +1,16 @@
-from typing import Dict, Any, List
-import json
+from typing import List
 import numpy as np
 import cv2
+from app.services.context import SheetContext, SheetLike, sheet_context
+from app.services.roi import box_sums
+from app.services.template import CompiledTemplate, TemplateLike, compile_template
 
-
-def _clahe_gray(img: np.ndarray) -> np.ndarray:
-    if img.ndim == 3:
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    else:
-        gray = img
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    return clahe.apply(gray)
-
-
-def _roi_from_norm(norm_roi: List[float], w: int, h: int) -> slice:
-    x0, y0, x1, y1 = norm_roi
-    x0i, y0i = int(max(0, min(w - 1, x0 * w))), int(max(0, min(h - 1, y0 * h)))
-    x1i, y1i = int(max(0, min(w, x1 * w))), int(max(0, min(h, y1 * h)))
-    return slice(y0i, y1i), slice(x0i, x1i)
+FILL_MODES = ("patch", "global")
 
 
-def _fill_ratio(gray: np.ndarray, roi: slice) -> float:
-    ysl, xsl = roi
-    patch = gray[ysl, xsl]
+def _fill_ratio(gray: np.ndarray, box: np.ndarray) -> float:
+    x0, y0, x1, y1 = box
+    patch = gray[y0:y1, x0:x1]
     if patch.size == 0:
         return 0.0
     # Adaptive threshold then compute dark pixel ratio
@@ -32,71 +20,77 @@ def _fill_ratio(gray: np.ndarray, roi: slice) -> float:
     return float(dark.mean())
 
 
-def _apply_adjust(norm_roi: List[float], sx: float, sy: float, ox: float, oy: float) -> List[float]:
-    x0, y0, x1, y1 = norm_roi
-    x0 = min(1.0, max(0.0, x0 * sx + ox))
-    x1 = min(1.0, max(0.0, x1 * sx + ox))
-    y0 = min(1.0, max(0.0, y0 * sy + oy))
-    y1 = min(1.0, max(0.0, y1 * sy + oy))
-    return [x0, y0, x1, y1]
+def _fill_ratios_global(ctx: SheetContext, px: np.ndarray, block_size: int = 31, c: int = 5) -> np.ndarray:
+    """Fill ratio of every box from one binarization of the sheet.
+    A mean (box) window keeps the single pass cheap, and dark-pixel counts come
+    from the mask's integral image, both memoized on the context.
+    """
+    if not len(px):
+        return np.zeros(0, dtype=np.float64)
+    sums, areas = box_sums(ctx.binary_integral(block_size, c), px)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(areas > 0, sums / areas, 0.0)
+
 
+def _choose_by_fill(tpl: CompiledTemplate, fills: np.ndarray,
+                    fill_threshold: float, min_margin: float) -> List[str]:
+    scores = tpl.to_grid(fills, fill=-np.inf)
+    if scores.shape[1] == 0:
+        return [""] * tpl.num_questions
+    r = np.arange(scores.shape[0])
+    best = np.argmax(scores, axis=1)  # first maximum in option order
+    s_best = scores[r, best]
+    others = scores.copy()
+    others[r, best] = -np.inf
+    s_second = np.maximum(others.max(axis=1), 0.0)
+    chosen = (s_best >= fill_threshold) & ((s_best - s_second) >= min_margin)
+    return tpl.labels_for(np.where(chosen, best, -1))
 
-def evaluate_with_template(img: np.ndarray, template: Dict[str, Any],
+
+def evaluate_with_template(img: SheetLike, template: TemplateLike,
                            fill_threshold: float = 0.45,
                            min_margin: float = 0.12,
                            scale_x: float = 1.0,
                            scale_y: float = 1.0,
                            offset_x: float = 0.0,
-                           offset_y: float = 0.0) -> List[str]:
+                           offset_y: float = 0.0,
+                           fill_mode: str = "patch") -> List[str]:
     """
     Evaluate answers using a JSON template with normalized ROIs.
     - fill_threshold: minimum dark ratio to consider a bubble filled
     - min_margin: winner's fill minus next best must exceed this margin, else mark blank
     - scale_x/scale_y & offset_x/offset_y: fine adjustments to align ROIs to the image
+    - fill_mode: "patch" thresholds each option patch on its own; "global" binarizes
+      the sheet once and reads all fill ratios from its integral image
     Returns list of answers for questions sorted by index.
     """
-    gray = _clahe_gray(img)
-    h, w = gray.shape
+    if fill_mode not in FILL_MODES:
+        raise ValueError(f"Unsupported fill_mode. Expected one of: {', '.join(FILL_MODES)}")
+    tpl = compile_template(template)
+    ctx = sheet_context(img)
+    h, w = ctx.shape
 
-    questions = sorted(template.get("questions", []), key=lambda q: q.get("index", 0))
-    answers: List[str] = []
-    for q in questions:
-        opts = q.get("options", {})
-        scores = {}
-        for opt, norm_roi in opts.items():
-            adj = _apply_adjust(norm_roi, scale_x, scale_y, offset_x, offset_y)
-            roi = _roi_from_norm(adj, w, h)
-            scores[opt] = _fill_ratio(gray, roi)
-        if not scores:
-            answers.append("")
-            continue
-        best = max(scores, key=scores.get)
-        s_best = scores[best]
-        s_second = max([v for k, v in scores.items() if k != best] or [0.0])
-        if s_best >= fill_threshold and (s_best - s_second) >= min_margin:
-            answers.append(best)
-        else:
-            answers.append("")  # ambiguous or blank
-    return answers
+    px = tpl.pixel_boxes(w, h, scale_x, scale_y, offset_x, offset_y)
+    if fill_mode == "global":
+        fills = _fill_ratios_global(ctx, px)
+    else:
+        gray = ctx.clahe
+        fills = np.array([_fill_ratio(gray, box) for box in px], dtype=np.float64)
+    return _choose_by_fill(tpl, fills, fill_threshold, min_margin)
 
 
-def draw_overlay(img: np.ndarray, template: Dict[str, Any], answers: List[str],
+def draw_overlay(img: np.ndarray, template: TemplateLike, answers: List[str],
                  scale_x: float = 1.0, scale_y: float = 1.0,
                  offset_x: float = 0.0, offset_y: float = 0.0) -> np.ndarray:
     """Draw rectangles for each option; green for selected, red for others."""
+    tpl = compile_template(template)
     vis = img.copy()
     if vis.ndim == 2:
         vis = cv2.cvtColor(vis, cv2.COLOR_GRAY2RGB)
     h, w = vis.shape[:2]
-    questions = sorted(template.get("questions", []), key=lambda q: q.get("index", 0))
-    for idx, q in enumerate(questions, start=1):
-        opts = q.get("options", {})
-        selected = answers[idx - 1] if idx - 1 < len(answers) else ""
-        for opt, norm_roi in opts.items():
-            adj = _apply_adjust(norm_roi, scale_x, scale_y, offset_x, offset_y)
-            ysl, xsl = _roi_from_norm(adj, w, h)
-            x0, y0 = xsl.start, ysl.start
-            x1, y1 = xsl.stop, ysl.stop
-            color = (0, 200, 0) if opt == selected else (200, 50, 50)
-            cv2.rectangle(vis, (x0, y0), (x1, y1), color, 1)
+    px = tpl.pixel_boxes(w, h, scale_x, scale_y, offset_x, offset_y)
+    for (x0, y0, x1, y1), row, opt in zip(px.tolist(), tpl.question_index.tolist(), tpl.option_labels.tolist()):
+        selected = answers[row] if row < len(answers) else ""
+        color = (0, 200, 0) if opt == selected else (200, 50, 50)
+        cv2.rectangle(vis, (x0, y0), (x1, y1), color, 1)
     return vis
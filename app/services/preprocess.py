@@ -1,24 +1,36 @@
 import cv2
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple
 
 
-def detect_orientation(img: np.ndarray) -> Tuple[np.ndarray, int]:
+def _gray_proxy(img: np.ndarray, max_side: int) -> np.ndarray:
+    """Grayscale copy of `img` downscaled so its long side is at most `max_side`."""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    h, w = gray.shape[:2]
+    f = max_side / float(max(h, w))
+    if f >= 1.0:
+        return gray
+    return cv2.resize(gray, (max(1, int(round(w * f))), max(1, int(round(h * f)))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def detect_orientation(img: np.ndarray, max_side: int = 512) -> Tuple[np.ndarray, int]:
     """Detect coarse orientation in multiples of 90 degrees using edge density.
     Returns rotated_image, rotation_degrees.
+
+    Scored once on a small grayscale proxy (long side `max_side`): the x-gradient
+    of a quarter-turned edge map is the y-gradient of the unrotated one, so no
+    rotated copies are needed. Like the per-rotation scoring it replaces, the
+    heuristic cannot tell 0 from 180 (or 90 from 270) and returns 0 or 90.
+    The input is returned as-is (no copy) when no rotation is needed.
     """
-    candidates = [0, 90, 180, 270]
-    scores = []
-    for deg in candidates:
-        rot = rotate_image(img, deg)
-        gray = cv2.cvtColor(rot, cv2.COLOR_RGB2GRAY) if rot.ndim == 3 else rot
-        edges = cv2.Canny(gray, 60, 180)
-        # Prefer orientation where horizontal lines are stronger (typical OMR layout)
-        sobelx = cv2.Sobel(edges, cv2.CV_32F, 1, 0, ksize=3)
-        score = float(np.mean(np.abs(sobelx)))
-        scores.append((score, deg))
-    best_deg = max(scores, key=lambda x: x[0])[1]
-    return rotate_image(img, best_deg), best_deg
+    edges = cv2.Canny(_gray_proxy(img, max_side), 60, 180)
+    # Prefer orientation where horizontal lines are stronger (typical OMR layout)
+    score_0 = float(np.mean(np.abs(cv2.Sobel(edges, cv2.CV_32F, 1, 0, ksize=3))))
+    score_90 = float(np.mean(np.abs(cv2.Sobel(edges, cv2.CV_32F, 0, 1, ksize=3))))
+    if score_90 > score_0:
+        return rotate_image(img, 90), 90
+    return img, 0
 
 
 def rotate_image(img: np.ndarray, degrees: int) -> np.ndarray:
@@ -39,34 +51,80 @@ def rotate_image(img: np.ndarray, degrees: int) -> np.ndarray:
     return cv2.rotate(img, code)
 
 
-def rectify_perspective(img: np.ndarray) -> np.ndarray:
+def _order_corners(pts: np.ndarray) -> np.ndarray:
+    """Order four points as (tl, tr, br, bl)."""
+    s = pts.sum(axis=1)
+    diff = np.diff(pts, axis=1).reshape(-1)
+    return np.array([pts[np.argmin(s)], pts[np.argmin(diff)], pts[np.argmax(s)], pts[np.argmax(diff)]],
+                    dtype=np.float32)
+
+
+def _refine_corners(gray: np.ndarray, corners: np.ndarray, win: int) -> np.ndarray:
+    """Sub-pixel refinement of each corner on a full-resolution crop around it."""
+    h, w = gray.shape[:2]
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    refined = corners.copy()
+    pad = 2 * win + 2
+    for i, (x, y) in enumerate(corners):
+        x0, y0 = max(0, int(x) - pad), max(0, int(y) - pad)
+        x1, y1 = min(w, int(x) + pad + 1), min(h, int(y) + pad + 1)
+        if x1 - x0 < 2 * win + 5 or y1 - y0 < 2 * win + 5:
+            continue  # too close to the border for a full search window
+        pt = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+        cv2.cornerSubPix(np.ascontiguousarray(gray[y0:y1, x0:x1]), pt, (win, win), (-1, -1), criteria)
+        rx, ry = pt[0, 0] + (x0, y0)
+        # Keep the estimate if the refinement wandered off to another feature
+        if abs(rx - x) <= win and abs(ry - y) <= win:
+            refined[i] = (rx, ry)
+    return refined
+
+
+def rectify_perspective(img: np.ndarray, out_size: Optional[Tuple[int, int]] = None,
+                        max_side: int = 1000) -> np.ndarray:
     """Attempt a simple perspective rectification by detecting the largest contour
     and warping to a rectangle. Returns the warped image or the original on failure.
+
+    The contour search runs on a grayscale proxy with its long side capped at
+    `max_side`; the four corners are then refined with cornerSubPix on the full
+    image. With `out_size=(width, height)` (e.g. settings.working_width/height)
+    the sheet is warped straight to that size, and resized to it when no sheet
+    outline is found, so later stages always see the same resolution. Without it
+    the output keeps the measured sheet size.
     """
     original = img
     gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    th = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 31, 5)
+    proxy = _gray_proxy(gray, max_side)
+    f = proxy.shape[1] / float(gray.shape[1])
+
+    def fallback() -> np.ndarray:
+        if out_size is None:
+            return original
+        return cv2.resize(original, tuple(out_size), interpolation=cv2.INTER_AREA)
+
+    blur = cv2.GaussianBlur(proxy, (5, 5), 0)
+    # Same 31 px threshold neighbourhood as measured on the full-resolution image
+    block = max(3, int(round(31 * f)) | 1)
+    th = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, 5)
     th = 255 - th
     contours, _ = cv2.findContours(th, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours:
-        return original
+        return fallback()
     cnt = max(contours, key=cv2.contourArea)
     peri = cv2.arcLength(cnt, True)
     approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
     if len(approx) != 4:
-        return original
-    pts = approx.reshape(4, 2).astype(np.float32)
-    # Order points (tl, tr, br, bl)
-    s = pts.sum(axis=1)
-    diff = np.diff(pts, axis=1).reshape(-1)
-    tl = pts[np.argmin(s)]
-    br = pts[np.argmax(s)]
-    tr = pts[np.argmin(diff)]
-    bl = pts[np.argmax(diff)]
-    w = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
-    h = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+        return fallback()
+    corners = _order_corners(approx.reshape(4, 2).astype(np.float32) / f)
+    if f < 1.0:
+        # A proxy pixel spans 1/f full-resolution pixels; search about six of them
+        corners = _refine_corners(gray, corners, win=int(min(31, max(5, round(6.0 / f)))))
+    tl, tr, br, bl = corners
+    if out_size is None:
+        w = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+        h = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    else:
+        w, h = int(out_size[0]), int(out_size[1])
     dst = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32)
-    M = cv2.getPerspectiveTransform(np.array([tl, tr, br, bl], dtype=np.float32), dst)
+    M = cv2.getPerspectiveTransform(corners, dst)
     warped = cv2.warpPerspective(original, M, (w, h), flags=cv2.INTER_LINEAR)
     return warped
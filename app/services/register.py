@@ -0,0 +1,189 @@
+from typing import Dict, Sequence, Tuple
+from dataclasses import dataclass
+import numpy as np
+import cv2
+
+from app.services.align import sample_option_rois, score_alignments
+from app.services.context import SheetLike, edge_magnitude, sheet_context
+from app.services.roi import integral_image
+from app.services.template import TemplateLike, compile_template
+
+# Coarse-to-fine registration of a sheet against a template. The scan is capped
+# to a working size and reduced to per-axis ink projection profiles (mean
+# darkness per column and per row). The extent of the template's answer field is
+# matched against those profiles with a wide scale/offset search at 1/8 of the
+# working size; finer pyramid levels only refine around the previous estimate
+# using the individual ROI rows/columns, so the per-sheet cost does not grow with
+# the camera's resolution. Matching whole-axis profiles rather than ROI means
+# keeps periodic bubble rows from aliasing at the coarse levels.
+
+
+@dataclass
+class Registration:
+    """Template -> image mapping in normalized coordinates.
+    x = scale_x * u + shear_x * v + offset_x
+    y = shear_y * u + scale_y * v + offset_y
+    """
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+    offset_x: float = 0.0
+    offset_y: float = 0.0
+    shear_x: float = 0.0
+    shear_y: float = 0.0
+    score: float = -1.0
+
+    @property
+    def is_affine(self) -> bool:
+        return self.shear_x != 0.0 or self.shear_y != 0.0
+
+    def params(self) -> Dict[str, float]:
+        """scale/offset kwargs for evaluate_by_questions / evaluate_with_template."""
+        return {"scale_x": self.scale_x, "scale_y": self.scale_y,
+                "offset_x": self.offset_x, "offset_y": self.offset_y}
+
+    def matrix(self) -> np.ndarray:
+        """2x3 normalized affine matrix (template -> image)."""
+        return np.array([[self.scale_x, self.shear_x, self.offset_x],
+                         [self.shear_y, self.scale_y, self.offset_y]], dtype=np.float64)
+
+    def warp(self, img: np.ndarray) -> np.ndarray:
+        """Resample `img` into template space, so the sheet can then be evaluated
+        with the default (identity) scale/offset. Needed when shear was estimated."""
+        h, w = img.shape[:2]
+        m = np.array([[self.scale_x, self.shear_x * w / h, self.offset_x * w],
+                      [self.shear_y * h / w, self.scale_y, self.offset_y * h]], dtype=np.float64)
+        return cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
+
+
+def _profiles(gray: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(x_profile, y_profile): ink (darkness) per column/row, scaled to 0..1."""
+    ink = 255.0 - gray.astype(np.float32)
+    px, py = ink.mean(axis=0), ink.mean(axis=1)
+    return px / (px.max() + 1e-6), py / (py.max() + 1e-6)
+
+
+def _cum_at(cum: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    """Linearly interpolated cumulative profile at fractional pixel positions in [0, n]."""
+    i = np.minimum(np.floor(pos).astype(np.int64), len(cum) - 2)
+    return cum[i] + (cum[i + 1] - cum[i]) * (pos - i)
+
+
+def _span_scores(profile: np.ndarray, spans: np.ndarray,
+                 scales: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Mean profile inside the mapped ROI spans minus the mean in the gaps between
+    them (within the field), for each (scale, offset) candidate. Printed bubbles
+    sit inside their ROIs wherever the border margin is, so a misregistered
+    template puts bubble edges into the gaps.
+    spans: (K, 2) distinct normalized [start, end) intervals along the axis
+    """
+    n = len(profile)
+    cum = np.concatenate([[0.0], np.cumsum(profile, dtype=np.float64)])
+    pos = np.clip((spans[None, :, :] * scales[:, None, None] + offsets[:, None, None]) * n, 0.0, n)
+    in_sum = (_cum_at(cum, pos[..., 1]) - _cum_at(cum, pos[..., 0])).sum(axis=1)
+    in_len = (pos[..., 1] - pos[..., 0]).sum(axis=1)
+    lo, hi = pos[..., 0].min(axis=1), pos[..., 1].max(axis=1)
+    field = _cum_at(cum, hi) - _cum_at(cum, lo)
+    gap_len = np.maximum((hi - lo) - in_len, 1.0)
+    return in_sum / np.maximum(in_len, 1.0) - (field - in_sum) / gap_len
+
+
+def _field_scores(profile: np.ndarray, lo: float, hi: float,
+                  scales: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Mean profile inside the mapped ROI field [lo, hi) minus the mean outside it.
+    At the coarsest level individual bubble rows blur together, but the extent of
+    the whole answer field is still sharp, and it pins down scale and offset."""
+    n = len(profile)
+    cum = np.concatenate([[0.0], np.cumsum(profile, dtype=np.float64)])
+    a = np.clip((lo * scales + offsets) * n, 0.0, n)
+    b = np.clip((hi * scales + offsets) * n, 0.0, n)
+    inside = _cum_at(cum, b) - _cum_at(cum, a)
+    length = b - a
+    outside = (cum[-1] - inside) / np.maximum(n - length, 1.0)
+    return np.where(length > 0, inside / np.maximum(length, 1.0) - outside, -np.inf)
+
+
+def _fit_axis(profiles: Sequence[np.ndarray], spans: np.ndarray,
+              scale_range: float, offset_range: float) -> Tuple[float, float]:
+    """Coarse-to-fine (scale, offset) search of one axis over a profile pyramid."""
+    scale, offset = 1.0, 0.0
+    s_span, o_span = scale_range, offset_range
+    prev_step = 1.0
+    for k, profile in enumerate(profiles):
+        step = 1.0 / len(profile)  # one pixel at this level, in normalized units
+        if k == 0:
+            n_s = int(min(81, 2 * np.ceil(s_span / step) + 1))
+            n_o = int(min(161, 2 * np.ceil(o_span / (step / 2)) + 1))
+        else:
+            # +-4 pixels of the previous level, sampled once per pixel of this one
+            s_span = o_span = 4.0 * prev_step
+            n_s = n_o = 2 * int(np.ceil(s_span / step)) + 1
+        ss, oo = np.meshgrid(scale + np.linspace(-s_span, s_span, n_s),
+                             offset + np.linspace(-o_span, o_span, n_o), indexing="ij")
+        if k == 0:
+            scores = _field_scores(profile, spans.min(), spans.max(), ss.ravel(), oo.ravel())
+        else:
+            # Keep the field term so a whole-row slip (49 of 50 rows still matching) loses
+            scores = (_span_scores(profile, spans, ss.ravel(), oo.ravel())
+                      + _field_scores(profile, spans.min(), spans.max(), ss.ravel(), oo.ravel()))
+        best = int(np.argmax(scores))
+        scale, offset = float(ss.ravel()[best]), float(oo.ravel()[best])
+        prev_step = step
+    return scale, offset
+
+
+def _refine_affine(edges_integral: np.ndarray, rois: np.ndarray, best: np.ndarray,
+                   span: np.ndarray, steps: Sequence[int]) -> Tuple[np.ndarray, float]:
+    axes = [c + np.linspace(-s, s, n) if n > 1 else np.array([c]) for c, s, n in zip(best, span, steps)]
+    grid = np.stack([a.ravel() for a in np.meshgrid(*axes, indexing="ij")], axis=1)
+    scores = score_alignments(edges_integral, rois, grid, ring=0.25)
+    k = int(np.argmax(scores))
+    return grid[k], float(scores[k])
+
+
+def register_template(img: SheetLike, template: TemplateLike,
+                      levels: Sequence[int] = (8, 4, 2),
+                      max_side: int = 2400,
+                      scale_range: float = 0.1,
+                      offset_range: float = 0.05,
+                      affine: bool = False,
+                      shear_range: float = 0.02,
+                      max_rois: int = 200) -> Registration:
+    """
+    Estimate scale and offset (optionally shear as well) of `img` against `template`.
+    - levels: pyramid factors relative to the working image, coarsest first
+    - max_side: the scan is downscaled to this long side before building the pyramid
+    - scale_range/offset_range: half-width of the coarse search around identity
+    - affine: also estimate shear at the finest level; apply it with Registration.warp
+    """
+    tpl = compile_template(template)
+    if not tpl.num_options:
+        return Registration()
+
+    base = sheet_context(img).downscaled(max_side).clahe
+    bh, bw = base.shape
+    pyramid = [base if level <= 1 else cv2.resize(base, (max(2, bw // level), max(2, bh // level)),
+                                                  interpolation=cv2.INTER_AREA)
+               for level in levels]
+    profiles = [_profiles(level_img) for level_img in pyramid]
+
+    # Distinct ROI extents per axis: option columns along x, question rows along y
+    x_spans = np.unique(tpl.boxes[:, [0, 2]], axis=0)
+    y_spans = np.unique(tpl.boxes[:, [1, 3]], axis=0)
+    scale_x, offset_x = _fit_axis([p[0] for p in profiles], x_spans, scale_range, offset_range)
+    scale_y, offset_y = _fit_axis([p[1] for p in profiles], y_spans, scale_range, offset_range)
+    best = np.array([scale_x, scale_y, offset_x, offset_y, 0.0, 0.0])
+
+    rois = sample_option_rois(tpl, max_rois=max_rois)
+    edges_integral = integral_image(edge_magnitude(pyramid[-1]))
+    step = 1.0 / max(pyramid[-1].shape)
+    if affine:
+        # Shear first with scale/offset fixed, then a small joint polish of all six terms
+        best, _ = _refine_affine(edges_integral, rois, best,
+                                 np.array([0, 0, 0, 0, shear_range, shear_range]), [1, 1, 1, 1, 9, 9])
+        best, score = _refine_affine(edges_integral, rois, best,
+                                     np.array([step, step, step, step, shear_range / 4.0, shear_range / 4.0]), [3] * 6)
+    else:
+        score = float(score_alignments(edges_integral, rois, best[None, :], ring=0.25)[0])
+
+    return Registration(*(float(v) for v in best), score=score)
@@ -0,0 +1,136 @@
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.omr import subject_for_question
+
+# Vectorized scoring. Answers and keys are stored as uint8 option codes
+# (0 = blank/invalid, 1 = 'a', 2 = 'b', ...), so a whole cohort is one
+# (students x questions) matrix and scoring is a comparison against the key row
+# of each student's set followed by a matrix product with the question->subject
+# one-hot. This is what re-scores stored answers after a key fix; the per-sheet
+# compute_scores_from_answers in app.services.omr gives the same numbers.
+
+BLANK = 0
+
+# byte value -> option code; letters are case-insensitive, everything else is blank
+_CODE_TABLE = np.zeros(256, dtype=np.uint8)
+for _i, _c in enumerate("abcdefghijklmnopqrstuvwxyz", start=1):
+    _CODE_TABLE[ord(_c)] = _CODE_TABLE[ord(_c.upper())] = _i
+_LABELS = np.array([""] + list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def option_code(label: Optional[str]) -> int:
+    """'a' -> 1, 'B' -> 2, ''/None/anything else -> 0."""
+    return int(_CODE_TABLE[ord(label[0])]) if label and len(label) == 1 and ord(label) < 256 else BLANK
+
+
+def encode_answers(answers: Sequence[Optional[str]], num_questions: Optional[int] = None) -> np.ndarray:
+    """One sheet's answer list (as returned by evaluate_by_questions) -> (Q,) uint8."""
+    n = len(answers) if num_questions is None else num_questions
+    out = np.zeros(n, dtype=np.uint8)
+    for i, a in enumerate(answers[:n]):
+        out[i] = option_code(a)
+    return out
+
+
+def encode_answer_strings(rows: Iterable[str], num_questions: int) -> np.ndarray:
+    """Answer strings as stored in result files (one character per question, '-'
+    for blank) -> (N, Q) uint8. Short rows are padded with blanks."""
+    text = "".join(s[:num_questions].ljust(num_questions, "-") for s in rows)
+    buf = np.frombuffer(text.encode("latin-1", "replace"), dtype=np.uint8)
+    return _CODE_TABLE[buf].reshape(-1, num_questions)
+
+
+def decode_answers(codes: np.ndarray) -> List[str]:
+    """(Q,) codes -> option labels ('' for blank)."""
+    return _LABELS[np.minimum(codes, len(_LABELS) - 1)].tolist()
+
+
+class CompiledKey:
+    """Answer keys for one or more sheet sets as a (sets, questions) uint8 matrix.
+    - codes: (S, Q) option code of the correct answer, 0 where a question isn't keyed
+    - sets: set names in row order (e.g. settings.sheet_versions)
+    - subjects: subject names; subject_ids (Q,) indexes into it per question
+    """
+
+    def __init__(self, keys: Mapping[str, Mapping[int, str]], num_questions: Optional[int] = None,
+                 subjects: Optional[Sequence[str]] = None):
+        self.sets: List[str] = list(keys)
+        q_max = max((q for k in keys.values() for q in k), default=0)
+        n = max(q_max, num_questions or 0)
+        self.codes = np.zeros((len(self.sets), n), dtype=np.uint8)
+        for row, key_map in enumerate(keys.values()):
+            for q, ans in key_map.items():
+                if 1 <= q <= n:
+                    self.codes[row, q - 1] = option_code(str(ans))
+
+        self.subjects: List[str] = list(subjects or settings.subjects)
+        names = [subject_for_question(q) for q in range(1, n + 1)]
+        for s in names:
+            if s not in self.subjects:
+                self.subjects.append(s)
+        self.subject_ids = np.array([self.subjects.index(s) for s in names], dtype=np.int64)
+        onehot = np.zeros((n, len(self.subjects)), dtype=np.float32)
+        onehot[np.arange(n), self.subject_ids] = 1.0
+        self._onehot = onehot
+        for arr in (self.codes, self.subject_ids, self._onehot):
+            arr.setflags(write=False)
+
+    @property
+    def num_questions(self) -> int:
+        return int(self.codes.shape[1])
+
+    @property
+    def subject_onehot(self) -> np.ndarray:
+        """(Q, len(subjects)) read-only float32 question->subject indicator; a
+        (N, Q) correctness matrix times this gives per-subject scores."""
+        return self._onehot
+
+    def set_indices(self, labels: Sequence[str]) -> np.ndarray:
+        """Set names per student -> row indices into `codes` (KeyError for unknown sets)."""
+        lookup = {s: i for i, s in enumerate(self.sets)}
+        return np.array([lookup[s] for s in labels], dtype=np.int64)
+
+
+def compile_key(key_map: Mapping[int, str], num_questions: Optional[int] = None) -> CompiledKey:
+    return CompiledKey({"": key_map}, num_questions)
+
+
+def compile_keys(keys: Mapping[str, Mapping[int, str]], num_questions: Optional[int] = None) -> CompiledKey:
+    """{set name: key_map} for several sets, e.g. {"A": ..., "B": ...}."""
+    return CompiledKey(keys, num_questions)
+
+
+def score_batch(answers: np.ndarray, key: CompiledKey,
+                sets: Union[None, np.ndarray, Sequence[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score a (N, Q) uint8 answer matrix.
+    - sets: per-student set row (int array) or set names; None = first set for all
+    Returns (per_subject (N, len(key.subjects)) int32, total (N,) int32). Answers
+    wider than the key are ignored; narrower ones count as blank.
+    """
+    answers = np.asarray(answers, dtype=np.uint8)
+    n, q = answers.shape[0], key.num_questions
+    if answers.shape[1] != q:
+        fixed = np.zeros((n, q), dtype=np.uint8)
+        w = min(q, answers.shape[1])
+        fixed[:, :w] = answers[:, :w]
+        answers = fixed
+    if sets is None:
+        rows = key.codes[:1]
+    else:
+        idx = np.asarray(sets)
+        if idx.dtype.kind not in "iu":
+            idx = key.set_indices(list(idx))
+        rows = key.codes[idx]
+    correct = (answers == rows) & (rows != BLANK)
+    # float32 BLAS product is much faster than an integer matmul; counts stay exact
+    per_subject = (correct.astype(np.float32) @ key.subject_onehot).astype(np.int32)
+    return per_subject, per_subject.sum(axis=1, dtype=np.int32)
+
+
+def subject_scores(per_subject_row: np.ndarray, key: CompiledKey) -> Dict[str, int]:
+    """One row of score_batch's per_subject as {subject: score}."""
+    return {s: int(v) for s, v in zip(key.subjects, per_subject_row)}
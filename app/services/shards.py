@@ -0,0 +1,182 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from dataclasses import dataclass, field
+import glob
+import json
+import os
+import re
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services.export import answer_strings
+
+# Multi-machine grading over a shared filesystem. Every machine walks the same
+# input set and keeps only the files whose content hash falls in its shard, so
+# the slices are disjoint and stable no matter how the files are named, listed
+# or re-uploaded. Each shard writes its own result file plus a manifest of the
+# files it owns; `merge` combines the result files and checks them against the
+# manifests (and optionally the input set) for duplicates and gaps.
+
+_SHARD_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'i/N' -> (i, N) with 0 <= i < N."""
+    m = _SHARD_RE.match(spec or "")
+    if not m:
+        raise ValueError(f"Invalid shard {spec!r}; expected i/N, e.g. 0/4")
+    i, n = int(m.group(1)), int(m.group(2))
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"Invalid shard {spec!r}; need 0 <= i < N")
+    return i, n
+
+
+def shard_of(sha256: str, count: int) -> int:
+    """Shard index of a file from its hex sha256 (first 64 bits, mod count)."""
+    return int(sha256[:16], 16) % count
+
+
+def shard_path(path: str, index: int, count: int) -> str:
+    """results.csv -> results.shard0of4.csv"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard{index}of{count}{ext}"
+
+
+def manifest_path(result_path: str) -> str:
+    return f"{result_path}.manifest.json"
+
+
+def write_manifest(result_path: str, shard: Tuple[int, int], input_path: str,
+                   files: Dict[str, str]) -> str:
+    """Record the files (sha256 -> name) a shard owns. Written via a temp file and
+    os.replace so readers on the shared filesystem never see a partial manifest."""
+    path = manifest_path(result_path)
+    body = {"shard": shard[0], "shards": shard[1], "input": os.path.abspath(input_path),
+            "result": os.path.basename(result_path), "files": files}
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(body, fh, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+
+
+def read_manifest(result_path: str) -> Optional[Dict[str, Any]]:
+    path = manifest_path(result_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def read_results(path: str) -> pd.DataFrame:
+    """Load a CSV or Parquet result file written by app.services.export."""
+    if path.lower().endswith((".parquet", ".pq")):
+        df = pd.read_parquet(path)
+        # Columnar layout: q001.. code columns back into the CSV answer string
+        qcols = [c for c in df.columns if re.fullmatch(r"q\d+", c)]
+        if qcols:
+            df["answers"] = answer_strings(df[qcols].to_numpy(dtype="uint8"))
+            df = df.drop(columns=qcols)
+    else:
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        for c in (*settings.subjects, "total", "seconds"):
+            if c in df:
+                df[c] = pd.to_numeric(df[c], errors="coerce")
+    if "error" in df:
+        df["error"] = df["error"].fillna("")
+    df["source_file"] = os.path.basename(path)
+    return df
+
+
+def expand_inputs(patterns: Sequence[str]) -> List[str]:
+    """Result files from paths/globs; .manifest.json and .checkpoint files are ignored."""
+    paths: List[str] = []
+    for p in patterns:
+        matches = sorted(glob.glob(p)) or [p]
+        paths.extend(m for m in matches if not m.endswith((".manifest.json", ".checkpoint")))
+    return list(dict.fromkeys(paths))
+
+
+@dataclass
+class MergeReport:
+    results: pd.DataFrame
+    duplicate_hashes: pd.DataFrame = field(default_factory=pd.DataFrame)
+    duplicate_students: pd.DataFrame = field(default_factory=pd.DataFrame)
+    missing: List[Dict[str, str]] = field(default_factory=list)  # {"sha256", "name", "reason"}
+    missing_shards: List[int] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return (self.duplicate_hashes.empty and self.duplicate_students.empty
+                and not self.missing and not self.missing_shards)
+
+    def summary(self) -> str:
+        lines = [f"{len(self.results)} result rows"]
+        if not self.duplicate_hashes.empty:
+            lines.append(f"{self.duplicate_hashes['sha256'].nunique()} files graded more than once")
+        if not self.duplicate_students.empty:
+            lines.append(f"{self.duplicate_students['student_code'].nunique()} student codes on more than one scan")
+        if self.missing_shards:
+            lines.append(f"shards without a manifest: {', '.join(map(str, self.missing_shards))}")
+        if self.missing:
+            lines.append(f"{len(self.missing)} files without a result")
+        return "; ".join(lines)
+
+
+def merge_results(paths: Iterable[str], expected: Optional[Dict[str, str]] = None) -> MergeReport:
+    """Combine shard result files and check them.
+    - duplicates: the same sha256, or the same student code, in more than one row
+    - missing: files listed in a shard manifest (or in `expected`, sha256 -> name,
+      e.g. from hashing the input set) that have no result row
+    - missing_shards: shard indices 0..N-1 for which no manifest was found
+    """
+    paths = list(paths)
+    frames = [read_results(p) for p in paths]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["sha256", "student_code"])
+    report = MergeReport(results=df)
+    report.duplicate_hashes = df[df.duplicated("sha256", keep=False)].sort_values("sha256")
+    graded = df[df["error"] == ""] if "error" in df else df
+    report.duplicate_students = graded[graded.duplicated("student_code", keep=False)].sort_values("student_code")
+
+    wanted: Dict[str, Tuple[str, str]] = {}
+    counts, seen = set(), set()
+    for p in paths:
+        manifest = read_manifest(p)
+        if manifest is None:
+            continue
+        counts.add(int(manifest["shards"]))
+        seen.add(int(manifest["shard"]))
+        for sha, name in manifest["files"].items():
+            wanted[sha] = (name, f"shard {manifest['shard']}/{manifest['shards']}")
+    for sha, name in (expected or {}).items():
+        wanted.setdefault(sha, (name, "input"))
+    # A shard writes its manifest once it has walked the whole input set, so a
+    # missing one means that shard never finished (or never started)
+    for n in counts:
+        report.missing_shards.extend(i for i in range(n) if i not in seen)
+    have = set(df["sha256"])
+    report.missing = [{"sha256": sha, "name": name, "reason": f"no result ({src})"}
+                      for sha, (name, src) in sorted(wanted.items(), key=lambda kv: kv[1][0])
+                      if sha not in have]
+    report.missing_shards = sorted(set(report.missing_shards))
+    return report
+
+
+def write_summary_workbook(report: MergeReport, path: str) -> None:
+    """Results sheet (one row per graded file), plus Errors and Missing sheets when
+    there is anything to list."""
+    df = report.results
+    ok = df[df["error"] == ""] if "error" in df else df
+    cols = [c for c in ("filename", "student_code", "sheet_version", *settings.subjects, "total", "sha256")
+            if c in df]
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        ok.sort_values("filename")[cols].to_excel(writer, index=False, sheet_name="Results")
+        failed = df[df["error"] != ""] if "error" in df else df.iloc[0:0]
+        if not failed.empty:
+            failed.sort_values("filename")[["filename", "error", "sha256", "source_file"]].to_excel(
+                writer, index=False, sheet_name="Errors")
+        missing = list(report.missing) + [{"sha256": "", "name": "", "reason": f"shard {i} has no manifest"}
+                                          for i in report.missing_shards]
+        if missing:
+            pd.DataFrame(missing, columns=["name", "sha256", "reason"]).to_excel(
+                writer, index=False, sheet_name="Missing")
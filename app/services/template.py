@@ -0,0 +1,154 @@
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import numpy as np
+
+from app.core.config import settings
+from app.services.omr import subject_for_question
+from app.services.roi import norm_to_pixel_boxes
+
+# A template JSON (see templates/example_template.json) compiled once into flat
+# NumPy arrays. Services used to re-sort the question dicts and rebuild every
+# ROI per image; with a compiled template that geometry is built once and the
+# pixel-space boxes for a given image size/alignment are memoized.
+
+PixelKey = Tuple[int, int, float, float, float, float]
+
+
+class CompiledTemplate:
+    """Immutable, array-backed view of an OMR template.
+
+    Options are flattened in question order (questions sorted by 'index', options
+    in their JSON order). For N options over Q questions:
+    - boxes: (N, 4) float64 normalized [x0, y0, x1, y1]
+    - option_labels: (N,) option keys ('a', 'b', ...)
+    - question_index: (N,) row of each option in the question grid (0..Q-1)
+    - question_numbers: (Q,) the template's 'index' per question
+    - subject_ids: (Q,) index into `subjects` per question
+    - valid: (Q, O) left-aligned mask placing options on a questions x options grid
+    - digest: sha256 hex of the geometry and labels, i.e. what detection depends on
+      (the name and subject mapping are not included)
+    """
+
+    def __init__(self, questions: Sequence[Dict[str, Any]], subjects: Optional[Sequence[str]] = None,
+                 name: str = "", cache_size: int = 32):
+        qs = sorted(questions, key=lambda q: q.get("index", 0))
+        self.name = name
+        self.subjects: List[str] = list(subjects or settings.subjects)
+
+        n_opts = max((len(q.get("options", {})) for q in qs), default=0)
+        labels: List[str] = []
+        boxes: List[List[float]] = []
+        rows: List[int] = []
+        subject_ids: List[int] = []
+        self.labels_grid: List[List[str]] = []
+        for i, q in enumerate(qs):
+            opts = q.get("options", {})
+            self.labels_grid.append(list(opts.keys()))
+            for opt, norm_roi in opts.items():
+                labels.append(opt)
+                boxes.append([float(v) for v in norm_roi])
+                rows.append(i)
+            subject = q.get("subject") or subject_for_question(int(q.get("index", 0)))
+            if subject not in self.subjects:
+                self.subjects.append(subject)
+            subject_ids.append(self.subjects.index(subject))
+
+        self.boxes = np.ascontiguousarray(np.array(boxes, dtype=np.float64).reshape(-1, 4))
+        self.option_labels = np.array(labels, dtype=str)
+        self.question_index = np.array(rows, dtype=np.int64)
+        self.question_numbers = np.array([int(q.get("index", 0)) for q in qs], dtype=np.int64)
+        self.subject_ids = np.array(subject_ids, dtype=np.int64)
+        self.valid = np.arange(n_opts)[None, :] < np.array([len(l) for l in self.labels_grid], dtype=np.int64).reshape(-1, 1)
+        for arr in (self.boxes, self.option_labels, self.question_index,
+                    self.question_numbers, self.subject_ids, self.valid):
+            arr.setflags(write=False)
+
+        h = hashlib.sha256()
+        for arr in (self.boxes, self.question_index, self.question_numbers):
+            h.update(arr.tobytes())
+        h.update("\x1f".join(self.option_labels.tolist()).encode("utf-8"))
+        self.digest = h.hexdigest()
+
+        self._cache_size = cache_size
+        self._pixel_cache: "OrderedDict[PixelKey, np.ndarray]" = OrderedDict()
+        # pixel_boxes is called from the /api/evaluate pool's threads
+        self._pixel_lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, template: Dict[str, Any], **kwargs) -> "CompiledTemplate":
+        return cls(template.get("questions", []), subjects=template.get("subjects"),
+                   name=template.get("name", ""), **kwargs)
+
+    @classmethod
+    def from_json(cls, text: Union[str, bytes], **kwargs) -> "CompiledTemplate":
+        return cls.from_dict(json.loads(text), **kwargs)
+
+    @property
+    def num_questions(self) -> int:
+        return int(self.question_numbers.shape[0])
+
+    @property
+    def num_options(self) -> int:
+        return int(self.boxes.shape[0])
+
+    def __len__(self) -> int:
+        return self.num_questions
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The pixel cache is per-process scratch; don't ship it to workers.
+        state = self.__dict__.copy()
+        state["_pixel_cache"] = OrderedDict()
+        del state["_pixel_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._pixel_lock = threading.Lock()
+        for arr in (self.boxes, self.option_labels, self.question_index,
+                    self.question_numbers, self.subject_ids, self.valid):
+            arr.setflags(write=False)
+
+    def pixel_boxes(self, w: int, h: int, scale_x: float = 1.0, scale_y: float = 1.0,
+                    offset_x: float = 0.0, offset_y: float = 0.0) -> np.ndarray:
+        """(N, 4) int64 pixel boxes after scale/offset adjustment and clamping.
+        Results are kept in a small LRU keyed by image size and alignment.
+        """
+        key: PixelKey = (int(w), int(h), float(scale_x), float(scale_y), float(offset_x), float(offset_y))
+        with self._pixel_lock:
+            hit = self._pixel_cache.get(key)
+            if hit is not None:
+                self._pixel_cache.move_to_end(key)
+                return hit
+        adj = self.boxes * np.array([scale_x, scale_y, scale_x, scale_y]) + np.array([offset_x, offset_y, offset_x, offset_y])
+        px = norm_to_pixel_boxes(adj, w, h)
+        px.setflags(write=False)
+        with self._pixel_lock:
+            self._pixel_cache[key] = px
+            if len(self._pixel_cache) > self._cache_size:
+                self._pixel_cache.popitem(last=False)
+        return px
+
+    def to_grid(self, values: np.ndarray, fill: Any = np.nan) -> np.ndarray:
+        """Scatter per-option values (N,) onto the (Q, O) question grid."""
+        grid = np.full(self.valid.shape, fill, dtype=np.result_type(values, np.asarray(fill)))
+        grid[self.valid] = values
+        return grid
+
+    def labels_for(self, picks: np.ndarray) -> List[str]:
+        """Map per-question option columns (-1 = none) to option labels."""
+        return [self.labels_grid[i][j] if j >= 0 else "" for i, j in enumerate(picks)]
+
+
+TemplateLike = Union[CompiledTemplate, Dict[str, Any], Sequence[Dict[str, Any]]]
+
+
+def compile_template(template: TemplateLike) -> CompiledTemplate:
+    """Return `template` compiled; already-compiled templates pass through."""
+    if isinstance(template, CompiledTemplate):
+        return template
+    if isinstance(template, dict):
+        return CompiledTemplate.from_dict(template)
+    return CompiledTemplate(list(template))
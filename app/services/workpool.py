@@ -0,0 +1,124 @@
+from typing import Any, Callable, Deque, Dict, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import math
+import threading
+import time
+
+# CPU-bound request work (decode + evaluate) must not run on the event loop, or
+# one large upload stalls every other request on the worker. A WorkPool runs it
+# on a fixed set of threads (OpenCV and NumPy release the GIL for the heavy
+# parts) and refuses new work once `workers + max_queue` jobs are pending, so a
+# burst gets fast 503s with a Retry-After hint instead of an unbounded queue.
+
+
+class Overloaded(Exception):
+    """Raised when the pool is full; `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class WorkPool:
+    """Bounded thread pool with admission control and queue/latency counters."""
+
+    def __init__(self, workers: int, max_queue: int, name: str = "work", window: int = 256):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.name = name
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0  # admitted and not finished (queued + running)
+        self._running = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._failed = 0
+        self._waits: Deque[float] = deque(maxlen=window)
+        self._runs: Deque[float] = deque(maxlen=window)
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def _timed(self, fn: Callable[..., Any], enqueued: float, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._waits.append(started - enqueued)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._runs.append(time.perf_counter() - started)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Created on first use (and again after shutdown) so an app restart in the
+        # same process, e.g. repeated TestClient lifespans, gets a fresh pool
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self._pool
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work over the pool's rate."""
+        with self._lock:
+            avg_run = sum(self._runs) / len(self._runs) if self._runs else 1.0
+            backlog = max(1, self._pending - self.workers + 1)
+        return max(1, int(math.ceil(avg_run * backlog / self.workers)))
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run `fn(*args, **kwargs)` on the pool and await its result.
+        Raises Overloaded immediately when `capacity` jobs are already pending."""
+        with self._lock:
+            full = self._pending >= self.capacity
+            if full:
+                self._rejected += 1
+            else:
+                self._pending += 1
+                self._admitted += 1
+        if full:
+            raise Overloaded(self.retry_after())
+        loop = asyncio.get_running_loop()
+        try:
+            fut = self._executor().submit(self._timed, fn, time.perf_counter(), args, kwargs)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return await asyncio.wrap_future(fut, loop=loop)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            waits = sorted(self._waits)
+            runs = list(self._runs)
+            pending, running = self._pending, self._running
+            admitted, rejected, failed = self._admitted, self._rejected, self._failed
+
+        def pct(vals, q):
+            return round(vals[min(len(vals) - 1, int(q * len(vals)))] * 1000.0, 2) if vals else None
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": running,
+            "queued": pending - running,
+            "admitted": admitted,
+            "rejected": rejected,
+            "failed": failed,
+            "wait_ms_p50": pct(waits, 0.5),
+            "wait_ms_p99": pct(waits, 0.99),
+            "run_ms_avg": round(sum(runs) / len(runs) * 1000.0, 2) if runs else None,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
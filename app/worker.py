@@ -0,0 +1,67 @@
+"""Background evaluation worker for the job queue (see app/services/jobs.py).
+
+Usage:
+    python -m app.worker [--processes N] [--chunk 8] [--poll 2.0] [--once]
+
+Each process claims its own chunks of queued sheets, so several workers (on
+one machine or many sharing DATABASE_URL) can drain the same queue.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+
+import cv2
+
+from app.core.config import settings
+from app.db.models import SessionLocal, init_db
+from app.services.jobs import purge_finished_uploads, run_worker
+
+
+def _setup_logging() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+
+def _process_main(chunk: int, poll: float, once: bool) -> None:
+    # One worker process per core; keep OpenCV from oversubscribing with its own threads
+    cv2.setNumThreads(1)
+    _setup_logging()
+    run_worker(chunk=chunk, poll_seconds=poll, once=once)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Evaluate queued OMR jobs.")
+    ap.add_argument("--processes", type=int, default=settings.batch_workers or os.cpu_count() or 1,
+                    help="worker processes (default: OMR_BATCH_WORKERS or all cores)")
+    ap.add_argument("--chunk", type=int, default=8, help="sheets claimed per lease")
+    ap.add_argument("--poll", type=float, default=2.0, help="seconds between polls of an empty queue")
+    ap.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = ap.parse_args()
+    _setup_logging()
+    init_db()
+    db = SessionLocal()
+    try:
+        removed = purge_finished_uploads(db)
+    finally:
+        db.close()
+    if removed:
+        logging.getLogger(__name__).info("removed uploads of %d finished jobs", removed)
+
+    if args.processes <= 1:
+        run_worker(chunk=args.chunk, poll_seconds=args.poll, once=args.once)
+        return
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_process_main, args=(args.chunk, args.poll, args.once))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
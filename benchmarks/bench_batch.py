@@ -0,0 +1,42 @@
+"""Throughput of the batch engine inline versus on a process pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch [--sheets 48] [--workers N]
+"""
+import argparse
+import time
+
+import cv2
+
+from app.services.batch import PipelineConfig, default_workers, run_batch
+from benchmarks.synth import render_sheet, sheet_questions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sheets", type=int, default=48)
+    ap.add_argument("--workers", type=int, default=default_workers())
+    args = ap.parse_args()
+
+    sources, truth = [], {}
+    for i in range(args.sheets):
+        img, answers = render_sheet(seed=i)
+        _, buf = cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        sources.append((f"sheet{i}.jpg", buf.tobytes()))
+        truth[f"sheet{i}.jpg"] = answers
+
+    tpl = sheet_questions()
+    # Synthetic sheets are rendered upright and unwarped
+    config = PipelineConfig(orient=False, rectify=False)
+    for workers in sorted({1, args.workers}):
+        t0 = time.perf_counter()
+        results = list(run_batch(sources, tpl, config=config, workers=workers))
+        dt = time.perf_counter() - t0
+        correct = sum(sum(a == b for a, b in zip(r.answers, truth[r.name])) for r in results)
+        errors = sum(not r.ok for r in results)
+        print(f"workers={workers:>2}: {len(results) / dt:7.1f} sheets/s  "
+              f"accuracy {correct / (100 * len(results)):.3f}  errors {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare PIL RGB decoding with the shared reduced-size grayscale decode.
+
+Run from the repository root:
+    python -m benchmarks.bench_decode [--sheets 10] [--width 3024 --height 4032]
+
+Peak memory is the largest traced Python allocation (NumPy buffers included)
+while decoding one sheet.
+"""
+import argparse
+import time
+import tracemalloc
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.services.imageio import decode_image, working_side
+from benchmarks.synth import render_sheet
+
+
+def pil_decode(data: bytes) -> np.ndarray:
+    """The previous entry-point decode."""
+    return np.array(Image.open(BytesIO(data)).convert("RGB"))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sheets", type=int, default=10)
+    ap.add_argument("--width", type=int, default=3024)
+    ap.add_argument("--height", type=int, default=4032)
+    args = ap.parse_args()
+
+    blobs = []
+    for i in range(args.sheets):
+        img, _ = render_sheet(args.width, args.height, seed=i)
+        _, buf = cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        blobs.append(buf.tobytes())
+
+    for name, fn in (("pil rgb", pil_decode), ("shared", lambda b: decode_image(b, max_side=working_side()))):
+        fn(blobs[0])  # warm-up
+        t0 = time.perf_counter()
+        for data in blobs:
+            out = fn(data)
+        dt = (time.perf_counter() - t0) / len(blobs)
+        tracemalloc.start()
+        fn(blobs[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:>8}: {dt * 1000:8.2f} ms/sheet  peak {peak / 2 ** 20:7.1f} MiB  output {out.shape}")
+
+
+if __name__ == "__main__":
+    main()
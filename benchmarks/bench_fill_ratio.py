@@ -0,0 +1,36 @@
+"""Compare per-patch and whole-image fill-ratio modes of evaluate_with_template.
+
+Run from the repository root:
+    python -m benchmarks.bench_fill_ratio [--sheets 20] [--width 1240 --height 1754]
+"""
+import argparse
+import time
+
+from app.services.omr_template import evaluate_with_template
+from app.services.template import compile_template
+from benchmarks.synth import render_sheet, sheet_questions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sheets", type=int, default=20)
+    ap.add_argument("--width", type=int, default=1240)
+    ap.add_argument("--height", type=int, default=1754)
+    args = ap.parse_args()
+
+    tpl = compile_template(sheet_questions())
+    sheets = [render_sheet(args.width, args.height, seed=i) for i in range(args.sheets)]
+    for mode in ("patch", "global"):
+        evaluate_with_template(sheets[0][0], tpl, fill_mode=mode)  # warm-up
+        correct = total = 0
+        t0 = time.perf_counter()
+        for img, truth in sheets:
+            got = evaluate_with_template(img, tpl, fill_mode=mode)
+            correct += sum(g == t for g, t in zip(got, truth))
+            total += len(truth)
+        dt = (time.perf_counter() - t0) / len(sheets)
+        print(f"{mode:>6}: {dt * 1000:8.2f} ms/sheet  accuracy {correct / total:.3f}")
+
+
+if __name__ == "__main__":
+    main()
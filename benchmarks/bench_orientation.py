@@ -0,0 +1,64 @@
+"""Compare full-resolution and proxy-based orientation detection.
+
+Run from the repository root:
+    python -m benchmarks.bench_orientation [--sheets 8] [--width 2480 --height 3508]
+
+Each synthetic sheet is rotated by 0/90/180/270 degrees. A detection counts as
+correct when it restores the sheet's axis (the edge heuristic cannot separate
+0 from 180), and agreement compares the two paths' axis decisions.
+"""
+import argparse
+import time
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from app.services.preprocess import detect_orientation, rotate_image
+from benchmarks.synth import render_sheet
+
+
+def legacy_detect_orientation(img: np.ndarray) -> Tuple[np.ndarray, int]:
+    """The previous implementation: score four full-resolution rotated copies."""
+    scores = []
+    for deg in [0, 90, 180, 270]:
+        rot = rotate_image(img, deg)
+        gray = cv2.cvtColor(rot, cv2.COLOR_RGB2GRAY) if rot.ndim == 3 else rot
+        edges = cv2.Canny(gray, 60, 180)
+        sobelx = cv2.Sobel(edges, cv2.CV_32F, 1, 0, ksize=3)
+        scores.append((float(np.mean(np.abs(sobelx))), deg))
+    best_deg = max(scores, key=lambda x: x[0])[1]
+    return rotate_image(img, best_deg), best_deg
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sheets", type=int, default=8)
+    ap.add_argument("--width", type=int, default=2480)
+    ap.add_argument("--height", type=int, default=3508)
+    args = ap.parse_args()
+
+    cases = []
+    for i in range(args.sheets):
+        img, _ = render_sheet(args.width, args.height, seed=i)
+        for deg in (0, 90, 180, 270):
+            cases.append((rotate_image(img, deg), deg))
+
+    axes = {}
+    for name, fn in (("legacy", legacy_detect_orientation), ("proxy", detect_orientation)):
+        correct = 0
+        decided = []
+        t0 = time.perf_counter()
+        for img, deg in cases:
+            _, got = fn(img)
+            decided.append((got // 90) % 2)
+            correct += (got // 90) % 2 == (deg // 90) % 2
+        dt = (time.perf_counter() - t0) / len(cases)
+        axes[name] = decided
+        print(f"{name:>6}: {dt * 1000:8.2f} ms/sheet  accuracy {correct / len(cases):.3f}")
+    agree = np.mean(np.array(axes["legacy"]) == np.array(axes["proxy"]))
+    print(f"agreement: {agree:.3f} over {len(cases)} sheets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Per-sheet compute_scores_from_answers vs the vectorized batch scorer.
+
+Run from the repository root:
+    python -m benchmarks.bench_scoring [--students 100000] [--sets 4]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.omr import compute_scores_from_answers
+from app.services.scoring import compile_keys, decode_answers, encode_answer_strings, score_batch
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--students", type=int, default=100_000)
+    ap.add_argument("--sets", type=int, default=len(settings.sheet_versions))
+    ap.add_argument("--loop-sample", type=int, default=10_000, help="students scored with the per-sheet loop")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    names = settings.sheet_versions[:args.sets]
+    keys = {v: {q: "abcd"[rng.integers(4)] for q in range(1, 101)} for v in names}
+    answers = rng.integers(0, 5, size=(args.students, 100)).astype(np.uint8)
+    sets = rng.integers(0, len(names), size=args.students)
+    strings = ["".join(a or "-" for a in decode_answers(row)) for row in answers]
+
+    n = min(args.loop_sample, args.students)
+    lists = [decode_answers(row) for row in answers[:n]]
+    t0 = time.perf_counter()
+    for i in range(n):
+        compute_scores_from_answers(lists[i], keys[names[sets[i]]])
+    loop = (time.perf_counter() - t0) / n * args.students
+
+    t0 = time.perf_counter()
+    key = compile_keys(keys)
+    codes = encode_answer_strings(strings, key.num_questions)
+    encode = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    score_batch(codes, key, sets)
+    batch = time.perf_counter() - t0
+    print(f"{args.students} students, {len(names)} sets")
+    print(f"  per-sheet loop : {loop:8.3f} s (extrapolated from {n})")
+    print(f"  encode strings : {encode:8.3f} s")
+    print(f"  score_batch    : {batch:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Synthetic OMR sheets with known answers for the benchmark scripts."""
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import cv2
+
+from app.services.omr import subject_for_question
+
+OPTIONS = ["a", "b", "c", "d"]
+
+
+def sheet_questions(num_questions: int = 100) -> List[Dict[str, Any]]:
+    """Two columns of non-overlapping rows, four options each (normalized ROIs)."""
+    per_col = (num_questions + 1) // 2
+    questions = []
+    for q in range(1, num_questions + 1):
+        col, row = divmod(q - 1, per_col)
+        y0 = 0.06 + row * (0.88 / per_col)
+        options = {}
+        for i, opt in enumerate(OPTIONS):
+            x0 = 0.08 + col * 0.46 + i * 0.1
+            options[opt] = [round(x0, 4), round(y0, 4), round(x0 + 0.08, 4), round(y0 + 0.012, 4)]
+        questions.append({"index": q, "subject": subject_for_question(q), "options": options})
+    return questions
+
+
+def render_sheet(w: int = 1240, h: int = 1754, seed: int = 0,
+                 blank_rate: float = 0.1) -> Tuple[np.ndarray, List[str]]:
+    """Render an RGB sheet with outlined option boxes from `sheet_questions` and
+    one filled box per answered question. Returns (image, answers).
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((h, w, 3), 238, dtype=np.uint8)
+    noise = rng.normal(0, 6, (h, w, 1))
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    answers: List[str] = []
+    for q in sheet_questions():
+        pick = "" if rng.random() < blank_rate else OPTIONS[int(rng.integers(0, 4))]
+        answers.append(pick)
+        for opt, (x0, y0, x1, y1) in q["options"].items():
+            p0 = (int(x0 * w) + 2, int(y0 * h) + 2)
+            p1 = (int(x1 * w) - 2, int(y1 * h) - 2)
+            cv2.rectangle(img, p0, p1, (70, 70, 70), 1)
+            if opt == pick:
+                cv2.rectangle(img, p0, p1, (40, 40, 40), -1)
+    return img, answers
@@ -1,20 +1,19 @@
 import streamlit as st
-from PIL import Image
-import numpy as np
 from io import BytesIO
 import pandas as pd
 import os
 import json
+import shutil
+import tempfile
 
 # This assumes you have an 'app' directory with the necessary modules.
 # If you don't, you'll need to create dummy functions for these imports.
 from app.core.config import settings
-from app.services.omr import compute_scores_from_answers, format_answers_as_columns
+from app.services.export import open_result_writer, result_row
 from app.services.key import parse_key_excel
-from app.services.preprocess import detect_orientation, rectify_perspective
-from app.services.detect import evaluate_by_questions
-from app.services.grid import estimate_grid_rois
+from app.services.batch import PipelineConfig, default_workers, run_batch
 from app.services.omr_template import draw_overlay
+from app.services.template import compile_template
 
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
@@ -241,6 +240,8 @@ with col1:
         scale_y = st.slider("Scale Y", 0.9, 1.1, 1.0, 0.005, key="scale_y")
         offset_x = st.slider("Offset X", -0.05, 0.05, 0.0, 0.001, key="offset_x")
         offset_y = st.slider("Offset Y", -0.05, 0.05, 0.0, 0.001, key="offset_y")
+        auto_register = st.checkbox("Auto-register each sheet", value=False,
+                                    help="Estimate scale/offset per sheet instead of using the sliders.")
         show_overlay = st.checkbox("Show debug overlay", value=False)
 
     st.subheader("2. Upload OMR Sheets")
@@ -256,6 +257,10 @@ with col1:
         value=False,
         help="Recommended for 200+ images. Skips per-image sheets for faster export.",
     )
+    max_workers = max(1, min(settings.ui_batch_workers, default_workers()))
+    workers = st.number_input("Parallel workers", min_value=1, max_value=max_workers,
+                              value=max_workers, step=1,
+                              help="Sheets are evaluated in this many processes (capped by OMR_UI_BATCH_WORKERS).")
     save_to_db = st.checkbox("Save results to database", value=False)
     student_id_hint = st.text_input("Student ID pattern", value="filename_without_extension")
 
@@ -292,51 +297,45 @@ with col2:
             uploaded_files = uploaded_files[:500]
 
         results = []
-        detailed_sheets = []
         progress_bar = st.progress(0, text="Starting Evaluation...")
 
-        for i, uf in enumerate(uploaded_files, 1):
-            try:
-                progress_bar.progress(i / len(uploaded_files), text=f"Processing: {uf.name}")
-                
-                image = Image.open(uf).convert("RGB")
-                np_img = np.array(image)
-
-                np_img, _ = detect_orientation(np_img)
-                np_img = rectify_perspective(np_img)
-
-                if tpl_file is not None:
-                    tpl = json.loads(tpl_file.getvalue().decode("utf-8"))
-                    questions = sorted(tpl.get("questions", []), key=lambda q: q.get("index", 0))
-                    answers = evaluate_by_questions(
-                        np_img,
-                        questions,
-                        scale_x=scale_x, scale_y=scale_y,
-                        offset_x=offset_x, offset_y=offset_y,
-                    )
-                else:
-                    h, w = np_img.shape[:2]
-                    questions = estimate_grid_rois(w, h)
-                    answers = evaluate_by_questions(np_img, questions)
-                
-                per_subj_scores, total_score = {}, None
-                if key_map:
-                    per_subj_scores, total_score = compute_scores_from_answers(answers, key_map)
-
-                row = {"filename": uf.name, "Set": key_sheet or sheet_version}
-                for s in settings.subjects:
-                    if per_subj_scores.get(s) is not None:
-                        row[s] = per_subj_scores[s]
-                if total_score is not None:
-                    row["total"] = total_score
-                results.append(row)
-
-                if not large_batch:
-                    cols = format_answers_as_columns(answers)
-                    detailed_sheets.append((uf.name, pd.DataFrame(cols)))
-
-            except Exception as e:
-                results.append({"filename": uf.name, "error": str(e)})
+        compiled_tpl = None
+        if tpl_file is not None:
+            compiled_tpl = compile_template(json.loads(tpl_file.getvalue().decode("utf-8")))
+        config = PipelineConfig(register=auto_register, scale_x=scale_x, scale_y=scale_y,
+                                offset_x=offset_x, offset_y=offset_y)
+        sources = ((uf.name, uf.getvalue()) for uf in uploaded_files)
+
+        # Exports are written row by row to temp files as sheets finish
+        old_export_dir = st.session_state.pop("export_dir", None)
+        if old_export_dir:
+            shutil.rmtree(old_export_dir, ignore_errors=True)
+        export_dir = st.session_state["export_dir"] = tempfile.mkdtemp(prefix="omr-export-")
+        xlsx_path = os.path.join(export_dir, "omr_results.xlsx")
+        csv_path = os.path.join(export_dir, "omr_summary.csv")
+        set_label = key_sheet or sheet_version
+
+        sheet_results = []
+        with open_result_writer(xlsx_path, answer_grids=not large_batch) as xlsx_out, \
+                open_result_writer(csv_path) as csv_out:
+            for done, res in enumerate(run_batch(sources, compiled_tpl, key_map, config, workers=workers), 1):
+                progress_bar.progress(done / len(uploaded_files), text=f"Processed: {res.name}")
+                sheet_results.append(res)
+                export_row = result_row(res, set_label)
+                xlsx_out.write(export_row)
+                csv_out.write(export_row)
+
+        for res in sorted(sheet_results, key=lambda r: r.index):
+            if not res.ok:
+                results.append({"filename": res.name, "error": res.error})
+                continue
+            row = {"filename": res.name, "Set": key_sheet or sheet_version}
+            for s in settings.subjects:
+                if res.per_subject.get(s) is not None:
+                    row[s] = res.per_subject[s]
+            if res.total is not None:
+                row["total"] = res.total
+            results.append(row)
 
         st.success("Evaluation complete!")
         
@@ -365,30 +364,19 @@ with col2:
                     c2.bar_chart(by_subject)
 
             with tab_dl:
-                subject_cols = list(settings.subjects)
-                ordered_cols = [c for c in ["filename", "Set", *subject_cols, "total"] if c in df.columns]
-                df_for_export = df[ordered_cols] if ordered_cols else df
-
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                    df_for_export.to_excel(writer, index=False, sheet_name="Summary")
-                    if not large_batch:
-                        for name, dfi in detailed_sheets:
-                            safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '.', '_')]).rstrip()[:28]
-                            dfi.to_excel(writer, index=False, sheet_name=f"Answers_{safe_name}")
-                st.download_button(
-                    label="Download Excel Results",
-                    data=buffer.getvalue(),
-                    file_name="omr_results.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
-                
-                csv = df_for_export.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="Download CSV Summary", 
-                    data=csv, 
-                    file_name="omr_summary.csv", 
-                    mime="text/csv",
-                    use_container_width=True
-                )
\ No newline at end of file
+                with open(xlsx_path, "rb") as fh:
+                    st.download_button(
+                        label="Download Excel Results",
+                        data=fh,
+                        file_name="omr_results.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True
+                    )
+                with open(csv_path, "rb") as fh:
+                    st.download_button(
+                        label="Download CSV Summary",
+                        data=fh,
+                        file_name="omr_summary.csv",
+                        mime="text/csv",
+                        use_container_width=True
+                    )
\ No newline at end of file
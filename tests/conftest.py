@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+# Keep the API tests' SQLite database, job uploads and answer cache out of the working tree;
+# must run before anything imports app.db.models.
+_tmp = tempfile.mkdtemp(prefix="omr-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'omr.db')}")
+os.environ.setdefault("OMR_JOBS_DIR", os.path.join(_tmp, "jobs"))
+os.environ.setdefault("OMR_ANSWER_CACHE", os.path.join(_tmp, "answer_cache.sqlite"))
+
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _database():
+    from app.db.models import init_db
+    init_db()
@@ -0,0 +1,29 @@
+import numpy as np
+import cv2
+
+
+def synthetic_sheet(questions, w=620, h=877, seed=0, channels=3):
+    """Render a noisy light page with 0-2 dark marks per question at the template ROIs."""
+    rng = np.random.default_rng(seed)
+    shape = (h, w, channels) if channels > 1 else (h, w)
+    img = np.full(shape, 235, dtype=np.uint8)
+    img = (img.astype(np.int16) + rng.integers(-12, 12, img.shape)).clip(0, 255).astype(np.uint8)
+    for q in questions:
+        opts = list(q["options"].items())
+        for k in rng.choice(len(opts), size=min(len(opts), int(rng.integers(0, 3))), replace=False):
+            x0, y0, x1, y1 = opts[k][1]
+            cv2.rectangle(img, (int(x0 * w), int(y0 * h)), (int(x1 * w), int(y1 * h)),
+                          (int(rng.integers(20, 120)),) * channels, -1)
+    return img
+
+
+def bubble_sheet(questions, w=620, h=877, scale_x=1.0, scale_y=1.0, offset_x=0.0, offset_y=0.0):
+    """Grayscale page with an empty bubble inscribed in every option box, drawn at an adjusted geometry."""
+    img = np.full((h, w), 235, dtype=np.uint8)
+    for q in questions:
+        for x0, y0, x1, y1 in q["options"].values():
+            cx = ((x0 + x1) / 2 * scale_x + offset_x) * w
+            cy = ((y0 + y1) / 2 * scale_y + offset_y) * h
+            axes = (int((x1 - x0) * scale_x * w / 2) - 2, int((y1 - y0) * scale_y * h / 2) - 2)
+            cv2.ellipse(img, (int(cx), int(cy)), axes, 0, 0, 360, 60, 2)
+    return img
@@ -0,0 +1,45 @@
+import numpy as np
+
+from app.services.align import estimate_offset, estimate_alignment
+from sheets import bubble_sheet
+
+
+def _questions():
+    qs = []
+    # Pitch well above the search window so the periodic layout can't alias
+    for q in range(1, 21):
+        y0 = 0.06 + (q - 1) * 0.045
+        qs.append({"index": q, "options": {o: [0.12 + i * 0.18, y0, 0.16 + i * 0.18, y0 + 0.028]
+                                            for i, o in enumerate("abcd")}})
+    return qs
+
+
+def test_offset_search_covers_both_axes():
+    qs = _questions()
+    img = bubble_sheet(qs, offset_x=0.012, offset_y=-0.008)
+    ox, oy = estimate_offset(img, {"questions": qs}, search_px_ratio=0.02, steps=21)
+    assert abs(ox - 0.012) <= 0.0025 and abs(oy + 0.008) <= 0.0025
+
+
+def test_scale_search():
+    qs = _questions()
+    img = bubble_sheet(qs, scale_x=1.03, scale_y=0.98, offset_x=0.004)
+    sx, sy, ox, oy = estimate_alignment(img, qs, search_px_ratio=0.01, steps=11,
+                                        scales_x=np.linspace(0.97, 1.03, 7),
+                                        scales_y=np.linspace(0.97, 1.03, 7))
+    assert abs(sx - 1.03) < 1e-9 and abs(sy - 0.98) < 1e-9 and abs(ox - 0.004) <= 0.002 and abs(oy) <= 0.002
+
+
+def test_vertical_shift_is_found_on_horizontal_rules():
+    import cv2
+
+    # Answer lines: rules wider than their boxes, so Sobel-X sees nothing inside them
+    w, h = 620, 877
+    rows = [0.1 + i * 0.08 for i in range(10)]
+    qs = [{"index": i + 1, "options": {"a": [0.2, y - 0.002, 0.8, y + 0.002]}} for i, y in enumerate(rows)]
+    img = np.full((h, w), 235, dtype=np.uint8)
+    for y in rows:
+        yy = int(round((y + 0.011) * h))
+        cv2.line(img, (int(0.05 * w), yy), (int(0.95 * w), yy), 40, 2)
+    ox, oy = estimate_offset(img, {"questions": qs}, search_px_ratio=0.02, steps=21, steps_y=41)
+    assert abs(oy - 0.011) <= 0.003 and abs(ox) <= 0.02
@@ -0,0 +1,75 @@
+import numpy as np
+
+from app.services.analytics import ItemStats, item_analysis
+from app.services.scoring import compile_key
+
+
+def _reference(answers, key_codes):
+    correct = (answers == key_codes).astype(float)
+    total = correct.sum(axis=1)
+    disc = []
+    for i in range(correct.shape[1]):
+        disc.append(np.corrcoef(correct[:, i], total - correct[:, i])[0, 1])
+    k = correct.shape[1]
+    kr20 = k / (k - 1) * (1 - (correct.mean(0) * (1 - correct.mean(0))).sum() / total.var())
+    return correct.mean(0), np.array(disc), kr20
+
+
+def test_item_analysis_matches_direct_computation():
+    rng = np.random.default_rng(0)
+    key_map = {q: "abcd"[q % 4] for q in range(1, 21)}  # all in the first subject
+    key = compile_key(key_map)
+    # students of varying ability, so items correlate with the total
+    ability = rng.random(300)
+    right = rng.random((300, 20)) < ability[:, None]
+    answers = np.where(right, key.codes[0], rng.integers(0, 5, (300, 20))).astype(np.uint8)
+
+    stats = ItemStats(key.num_questions, len(key.subjects))
+    for part in np.array_split(answers, 3):  # incremental == all at once
+        part_stats = ItemStats(key.num_questions, len(key.subjects))
+        part_stats.add(part, key)
+        stats += part_stats
+    result = item_analysis(stats, key)
+
+    p, disc, kr20 = _reference(answers, key.codes[0])
+    assert result["count"] == 300 and len(result["questions"]) == 20
+    assert np.allclose([q["difficulty"] for q in result["questions"]], p)
+    assert np.allclose([q["discrimination"] for q in result["questions"]], disc)
+    assert np.isclose(result["reliability"]["Python"], kr20)
+    assert np.isclose(result["reliability"]["_total"], kr20)
+    q1 = result["questions"][0]
+    assert q1["key"] == "b" and sum(q1["options"].values()) == 300
+    assert q1["options"]["blank"] == int((answers[:, 0] == 0).sum())
+
+
+def test_cache_picks_up_late_commits_and_legacy_rows():
+    from app.db.models import Evaluation, SessionLocal
+    from app.services.analytics import ItemStatsCache
+
+    key = compile_key({1: "a", 2: "b"})
+    cache = ItemStatsCache()
+    db = SessionLocal()
+    try:
+        rows = [Evaluation(student_code=f"late-{i}", sheet_version="LATE", per_subject={}, total=0,
+                           details={}, answers_packed=bytes([1, 2])) for i in range(3)]
+        db.add_all(rows)
+        db.commit()
+        gap = rows[1].id
+        db.delete(rows[1])
+        db.commit()
+        assert cache.analyse(db, "LATE", key)["count"] == 2
+        # a lower id that becomes visible after the cursor moved past it
+        db.add(Evaluation(id=gap, student_code="late-x", sheet_version="LATE", per_subject={}, total=0,
+                          details={}, answers_packed=bytes([2, 2])))
+        # not yet packed (before migrate-answers), and one with no answers at all
+        db.add(Evaluation(student_code="late-json", sheet_version="LATE", per_subject={}, total=0,
+                          details={"answers": ["a", ""]}))
+        db.add(Evaluation(student_code="late-none", sheet_version="LATE", per_subject={}, total=0, details={}))
+        db.commit()
+        result = cache.analyse(db, "LATE", key)
+        assert result["count"] == 4 and result["skipped"] == 1
+        q1, q2 = result["questions"]
+        assert q1["options"]["a"] == 3 and q1["options"]["b"] == 1 and q2["options"]["blank"] == 1
+        assert cache.analyse(db, "LATE", key)["count"] == 4  # nothing counted twice
+    finally:
+        db.close()
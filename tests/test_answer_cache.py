@@ -0,0 +1,38 @@
+import cv2
+
+from app.services.answer_cache import AnswerCache
+from app.services.batch import PipelineConfig, evaluate_sheet
+from app.services.grid import estimate_grid_rois
+from app.services.template import compile_template
+from sheets import synthetic_sheet
+
+CONFIG = PipelineConfig(orient=False, rectify=False)
+
+
+def test_cached_answers_are_rescored_with_a_new_key(tmp_path):
+    questions = estimate_grid_rois(620, 877)
+    tpl = compile_template(questions)
+    data = cv2.imencode(".png", synthetic_sheet(questions, seed=1, channels=1))[1].tobytes()
+    cache = AnswerCache(str(tmp_path / "cache.sqlite"))
+
+    first = evaluate_sheet(data, tpl, {1: "a"}, CONFIG, cache)
+    again = evaluate_sheet(data, tpl, {q: "b" for q in range(1, 101)}, CONFIG, cache)
+    assert not first["cached"] and again["cached"]
+    assert again["answers"] == first["answers"]
+    assert again["total"] == sum(a == "b" for a in first["answers"])
+
+    # Different geometry or options miss
+    assert not evaluate_sheet(data, tpl, None, PipelineConfig(orient=False, rectify=False, offset_x=0.01), cache)["cached"]
+    moved = compile_template([{**q, "options": {k: [v[0] + 0.001, *v[1:]] for k, v in q["options"].items()}}
+                              for q in questions])
+    assert moved.digest != tpl.digest and compile_template(questions).digest == tpl.digest
+    assert not evaluate_sheet(data, moved, None, CONFIG, cache)["cached"]
+
+
+def test_lru_eviction(tmp_path):
+    cache = AnswerCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for k in ("a", "b", "c"):
+        cache.put(k, [k], {})
+    assert cache.get("a") is not None  # "b" is now least recently used
+    assert cache.trim() == 1 and len(cache) == 2
+    assert cache.get("b") is None and cache.get("a") == (["a"], {})
@@ -6,3 +6,166 @@ def test_health():
     resp = client.get("/health")
     assert resp.status_code == 200
     assert resp.json() == {"status": "ok"}
+
+
+def test_evaluate_runs_off_loop_and_reports_metrics():
+    import cv2
+    import numpy as np
+
+    img = np.full((200, 140), 200, dtype=np.uint8)
+    png = cv2.imencode(".png", img)[1].tobytes()
+    with TestClient(app) as client:
+        resp = client.post("/api/evaluate", data={"sheet_version": "A"},
+                           files={"file": ("s.png", png, "image/png")})
+        assert resp.status_code == 200
+        assert resp.json()["sheet_version"] == "A"
+        bad = client.post("/api/evaluate", data={"sheet_version": "A"},
+                          files={"file": ("s.png", b"garbage", "image/png")})
+        assert bad.status_code == 400
+        metrics = client.get("/api/evaluate/metrics").json()
+        assert metrics["admitted"] >= 2 and metrics["failed"] >= 1
+        assert metrics["queued"] == 0 and metrics["wait_ms_p50"] is not None
+
+
+def test_batch_streams_ndjson_for_files_and_zip(monkeypatch):
+    import io
+    import json
+    import zipfile
+    import cv2
+    from openpyxl import Workbook
+    from app.core.config import settings
+    from app.services.grid import estimate_grid_rois
+    from sheets import synthetic_sheet
+
+    monkeypatch.setattr(settings, "batch_workers", 1)
+    questions = estimate_grid_rois(620, 877)
+    pngs = [cv2.imencode(".png", synthetic_sheet(questions, seed=i))[1].tobytes() for i in range(3)]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("scans/b.png", pngs[1])
+        zf.writestr("scans/c.png", pngs[2])
+        zf.writestr("scans/notes.txt", "skipped")
+    wb = Workbook()
+    wb.active.title = "A"
+    wb.active.append(["Python"])
+    wb.active.append(["1 - a"])
+    key = io.BytesIO()
+    wb.save(key)
+
+    client = TestClient(app)
+    resp = client.post("/api/evaluate/batch", data={"sheet_version": "A", "rectify": "false"}, files=[
+        ("files", ("a.png", pngs[0], "image/png")),
+        ("files", ("broken.png", b"garbage", "image/png")),
+        ("archive", ("scans.zip", archive.getvalue(), "application/zip")),
+        ("template", ("t.json", json.dumps({"questions": questions}), "application/json")),
+        ("key", ("key.xlsx", key.getvalue(), "application/octet-stream")),
+    ])
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["name"] for r in lines[:-1]] == ["a.png", "broken.png", "scans/b.png", "scans/c.png"]
+    assert lines[1]["error"] and all(len(r["answers"]) == 100 for r in lines[:-1] if not r["error"])
+    assert all(r["total"] is not None for r in lines[:-1] if not r["error"])
+    assert lines[-1] == {"done": True, "count": 4, "errors": 1}
+
+
+def test_bulk_results_roundtrip():
+    client = TestClient(app)
+    payload = [{"student_code": f"bulk{i % 3}", "sheet_version": "A", "per_subject": {"Python": i},
+                "total": i, "details": {"answers": ["a", "", "c"]}} for i in range(5)]
+    resp = client.post("/api/results/bulk", json=payload)
+    assert resp.status_code == 200 and resp.json() == {"inserted": 5}
+    rows = client.get("/api/results/", params={"student_code": "bulk1", "include_details": True}).json()
+    assert len(rows) == 2 and rows[0]["details"]["answers"] == ["a", "", "c"]
+    assert "details" not in client.get("/api/results/", params={"limit": 1}).json()[0]
+
+
+def test_results_keyset_pagination():
+    client = TestClient(app)
+    client.post("/api/results/bulk", json=[{"student_code": f"page{i}", "sheet_version": "paged",
+                                            "per_subject": {}, "total": i} for i in range(7)])
+    seen, cursor = [], None
+    while True:
+        params = {"sheet_version": "paged", "limit": 3, **({"cursor": cursor} if cursor else {})}
+        resp = client.get("/api/results/", params=params)
+        seen += [r["id"] for r in resp.json()]
+        cursor = resp.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert seen == sorted(seen, reverse=True) and len(seen) == len(set(seen)) >= 7
+
+
+def test_results_summary_endpoint():
+    client = TestClient(app)
+    client.post("/api/results/bulk", json=[{"student_code": "sum1", "sheet_version": "C",
+                                            "per_subject": {"Python": 10}, "total": 10}])
+    body = client.get("/api/results/summary", params={"sheet_version": "C"}).json()
+    assert body["count"] >= 1 and body["subjects"]["Python"]["count"] >= 1
+
+
+def test_item_analysis_endpoint_updates_incrementally():
+    client = TestClient(app)
+    assert client.get("/api/results/item-analysis", params={"sheet_version": "IA"}).status_code == 404
+    assert client.put("/api/results/keys/IA", json={"1": "a", "2": "b", "3": "c"}).json()["questions"] == 3
+    rows = [{"student_code": f"ia-{i}", "sheet_version": "IA", "per_subject": {}, "total": 0,
+             "details": {"answers": answers}}
+            for i, answers in enumerate([["a", "b", "c"], ["a", "b", "d"], ["b", "", "d"]])]
+    client.post("/api/results/bulk", json=rows[:2])
+    first = client.get("/api/results/item-analysis", params={"sheet_version": "IA"}).json()
+    assert first["count"] == 2 and first["questions"][2]["difficulty"] == 0.5
+    client.post("/api/results/bulk", json=rows[2:])
+    body = client.get("/api/results/item-analysis", params={"sheet_version": "IA"}).json()
+    assert body["count"] == 3
+    q1, q2, q3 = body["questions"]
+    assert q1["options"]["a"] == 2 and q1["options"]["b"] == 1 and q2["options"]["blank"] == 1
+    assert q3["difficulty"] == 1 / 3 and q1["discrimination"] > 0
+    assert body["reliability"]["Python"] is not None
+    until = client.get("/api/results/item-analysis",
+                       params={"sheet_version": "IA", "until": "2000-01-01"}).json()
+    assert until["count"] == 0
+
+
+def test_concurrent_batch_is_rejected_while_one_runs(monkeypatch):
+    import threading
+    from app.routers import evaluate as evaluate_router
+
+    monkeypatch.setattr(evaluate_router, "batch_slots", threading.BoundedSemaphore(1))
+    client = TestClient(app)
+    data = {"sheet_version": "A"}
+    files = [("files", ("broken.png", b"garbage", "image/png"))]
+    evaluate_router.batch_slots.acquire()  # a batch in progress
+    busy = client.post("/api/evaluate/batch", data=data, files=files)
+    assert busy.status_code == 503 and busy.headers["Retry-After"]
+    evaluate_router.batch_slots.release()
+    done = client.post("/api/evaluate/batch", data=data, files=files)
+    assert done.status_code == 200 and done.text.splitlines()[-1].startswith('{"done": true')
+    # the finished batch gave its slot back
+    assert evaluate_router.batch_slots.acquire(blocking=False)
+
+
+def test_batch_slot_is_released_when_stream_is_never_read(monkeypatch):
+    import gc
+    import threading
+    from app.routers import evaluate as evaluate_router
+
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(evaluate_router, "batch_slots", slots)
+    client = TestClient(app)
+    data = {"sheet_version": "A"}
+    files = [("files", ("broken.png", b"garbage", "image/png"))]
+    with client.stream("POST", "/api/evaluate/batch", data=data, files=files) as resp:
+        assert resp.status_code == 200  # closed without reading the body
+    gc.collect()
+    assert client.post("/api/evaluate/batch", data=data, files=files).status_code == 200
+
+    # a stream dropped before its first chunk frees the slot; close + GC release only once
+    slots.acquire()
+    stream = evaluate_router.SlotStream((line for line in [b"x"]), slots)
+    del stream
+    gc.collect()
+    assert slots.acquire(blocking=False)
+    stream = evaluate_router.SlotStream(iter([b"x"]), slots)
+    stream.close()
+    del stream
+    gc.collect()
+    assert slots.acquire(blocking=False) and not slots.acquire(blocking=False)
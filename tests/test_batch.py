@@ -0,0 +1,46 @@
+import cv2
+
+from app.services.batch import PipelineConfig, run_batch
+from app.services.detect import evaluate_by_questions
+from app.services.grid import estimate_grid_rois
+from sheets import synthetic_sheet
+
+CONFIG = PipelineConfig(orient=False, rectify=False)
+
+
+def _sheets(n, questions):
+    imgs = [synthetic_sheet(questions, seed=i, channels=1) for i in range(n)]
+    return imgs, [(f"s{i}.png", cv2.imencode(".png", img)[1].tobytes()) for i, img in enumerate(imgs)]
+
+
+def test_inline_batch_isolates_bad_sheets():
+    questions = estimate_grid_rois(620, 877)
+    imgs, sources = _sheets(3, questions)
+    sources.insert(1, ("broken.jpg", b"not an image"))
+    results = list(run_batch(sources, questions, {1: "a"}, CONFIG, workers=1))
+    assert [r.name for r in results] == ["s0.png", "broken.jpg", "s1.png", "s2.png"]
+    assert not results[1].ok and results[1].answers == []
+    assert [r.answers for r in results if r.ok] == [evaluate_by_questions(img, questions) for img in imgs]
+    assert all(r.total is not None for r in results if r.ok)
+
+
+def test_pool_yields_every_sheet_with_bounded_submission():
+    questions = estimate_grid_rois(620, 877)
+    imgs, sources = _sheets(6, questions)
+    consumed = []
+
+    def lazy():
+        for src in sources:
+            consumed.append(src[0])
+            yield src
+
+    seen = 0
+    results = []
+    for res in run_batch(lazy(), questions, None, CONFIG, workers=2, max_in_flight=2):
+        # Never more than max_in_flight sheets pulled ahead of what has been yielded
+        assert len(consumed) <= seen + 2
+        seen += 1
+        results.append(res)
+    assert sorted(r.index for r in results) == list(range(6))
+    by_index = {r.index: r.answers for r in results}
+    assert [by_index[i] for i in range(6)] == [evaluate_by_questions(img, questions) for img in imgs]
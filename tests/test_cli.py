@@ -0,0 +1,194 @@
+import csv
+
+import cv2
+import pandas as pd
+import pytest
+
+from app.cli import main
+from app.db.crud import list_evaluations
+from app.db.models import SessionLocal
+from app.services.export import answer_strings, load_answer_table
+from app.services.grid import estimate_grid_rois
+from app.services.shards import read_results
+from sheets import synthetic_sheet
+
+ARGS = ["--workers", "1", "--no-orient", "--no-rectify", "--progress", "0"]
+
+
+def _write_scans(folder, seeds):
+    folder.mkdir(exist_ok=True)
+    for seed in seeds:
+        img = synthetic_sheet(estimate_grid_rois(620, 877), seed=seed)
+        cv2.imwrite(str(folder / f"s{seed}.png"), img)
+
+
+def _rows(path):
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def test_evaluate_writes_incrementally_and_resumes(tmp_path):
+    scans = tmp_path / "scans"
+    _write_scans(scans, [0, 1])
+    (scans / "broken.jpg").write_bytes(b"not an image")
+    out = tmp_path / "results.csv"
+
+    assert main(["evaluate", str(scans), "--out", str(out), "--db", *ARGS]) == 0
+    rows = _rows(out)
+    assert sorted(r["filename"] for r in rows) == ["broken.jpg", "s0.png", "s1.png"]
+    assert all(len(r["sha256"]) == 64 for r in rows)
+    assert [r["error"] != "" for r in sorted(rows, key=lambda r: r["filename"])] == [True, False, False]
+    assert len((tmp_path / "results.csv.checkpoint").read_text().split()) == 3
+
+    # Interrupted/repeated runs only grade what is new
+    _write_scans(scans, [2])
+    assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+    assert [r["filename"] for r in _rows(out)[3:]] == ["s2.png"]
+
+    db = SessionLocal()
+    try:
+        shas = {e.details.get("sha256") for e in list_evaluations(db, limit=1000)}
+    finally:
+        db.close()
+    assert {r["sha256"] for r in rows if not r["error"]} <= shas
+
+
+def test_evaluate_parquet_output(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    scans = tmp_path / "scans"
+    _write_scans(scans, [3, 4])
+    out = tmp_path / "results.parquet"
+    assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+    table = pq.read_table(out)
+    assert table.num_rows == 2 and "answers" not in table.column_names
+    assert str(table.schema.field("q001").type) == "uint8" and "q100" in table.column_names
+
+    codes, meta = load_answer_table([str(out)])
+    assert codes.shape == (2, 100) and list(meta["sheet_version"]) == ["A", "A"]
+    # rows come back the same as from the CSV answer string
+    assert answer_strings(codes) == list(read_results(str(out))["answers"])
+
+
+
+def test_parquet_writer_warns_when_answers_exceed_schema(tmp_path, caplog):
+    pytest.importorskip("pyarrow")
+    from app.services.export import open_result_writer
+
+    out = tmp_path / "wide.parquet"
+    with open_result_writer(str(out), num_questions=3) as writer:
+        writer.write({"filename": "ok.png", "answers": "ab-"})
+        writer.write({"filename": "wide.png", "sha256": "f00", "answers": "abcd"})
+    warnings = [r.getMessage() for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1 and "wide.png" in warnings[0] and "f00" in warnings[0]
+    codes, _ = load_answer_table([str(out)], columns=())
+    assert answer_strings(codes) == ["ab-", "abc"]
+
+def test_shards_partition_and_merge(tmp_path):
+    scans = tmp_path / "scans"
+    _write_scans(scans, [5, 6, 7, 8])
+    out = tmp_path / "results.csv"
+    for i in range(2):
+        assert main(["evaluate", str(scans), "--out", str(out), "--shard", f"{i}/2", *ARGS]) == 0
+    shards = [tmp_path / f"results.shard{i}of2.csv" for i in range(2)]
+    names = [{r["filename"] for r in _rows(p)} for p in shards]
+    assert not names[0] & names[1] and names[0] | names[1] == {"s5.png", "s6.png", "s7.png", "s8.png"}
+
+    summary = tmp_path / "summary.xlsx"
+    assert main(["merge", str(tmp_path / "results.shard*.csv"), "--out", str(summary),
+                 "--input", str(scans), "--strict"]) == 0
+    assert len(pd.read_excel(summary, sheet_name="Results")) == 4
+
+    # A shard that never finished is reported; the same shard twice is rejected
+    lost = shards[1].with_suffix(".csv.manifest.json")
+    lost.unlink()
+    assert main(["merge", str(shards[0]), "--out", str(summary), "--input", str(scans), "--strict"]) == 1
+    assert "Missing" in pd.ExcelFile(summary).sheet_names
+    assert main(["merge", str(shards[0]), str(tmp_path / "copy.csv"), "--out", str(tmp_path / "x.xlsx")]) == 2
+    (tmp_path / "copy.csv").write_text(shards[0].read_text())
+    assert main(["merge", str(shards[0]), str(tmp_path / "copy.csv"), "--out", str(tmp_path / "x.xlsx")]) == 1
+    assert not (tmp_path / "x.xlsx").exists()
+
+
+def test_rescore_matches_per_sheet_scoring(tmp_path):
+    from openpyxl import Workbook
+    from app.services.omr import compute_scores_from_answers
+
+    scans = tmp_path / "scans"
+    _write_scans(scans, [9, 10])
+    out = tmp_path / "results.csv"
+    assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+    wb = Workbook()
+    wb.active.title = "A"
+    wb.active.append(["Python", "EDA"])
+    for q in range(1, 21):
+        wb.active.append([f"{q} - b", f"{q + 20} - c"])
+    wb.save(tmp_path / "key.xlsx")
+
+    rescored = tmp_path / "rescored.csv"
+    assert main(["rescore", str(out), "--key", str(tmp_path / "key.xlsx"), "--out", str(rescored)]) == 0
+    key_map = {**{q: "b" for q in range(1, 21)}, **{q: "c" for q in range(21, 41)}}
+    for row in _rows(rescored):
+        answers = ["" if a == "-" else a for a in row["answers"]]
+        per_subject, total = compute_scores_from_answers(answers, key_map)
+        assert int(row["total"]) == total and int(row["Python"]) == per_subject["Python"]
+
+
+def test_rescore_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    from openpyxl import Workbook
+
+    scans = tmp_path / "scans"
+    _write_scans(scans, [11, 12])
+    out = tmp_path / "results.parquet"
+    assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+    wb = Workbook()
+    wb.active.title = "A"
+    wb.active.append(["Python"])
+    for q in range(1, 21):
+        wb.active.append([f"{q} - a"])
+    wb.save(tmp_path / "key.xlsx")
+
+    rescored = tmp_path / "rescored.parquet"
+    assert main(["rescore", str(out), "--key", str(tmp_path / "key.xlsx"), "--out", str(rescored)]) == 0
+    codes, _ = load_answer_table([str(rescored)])
+    df = read_results(str(rescored))
+    assert codes.shape == (2, 100)
+    assert list(df["Python"]) == [int((codes[i, :20] == 1).sum()) for i in range(2)]
+
+
+def test_evaluate_resumes_into_existing_parquet_and_xlsx(tmp_path):
+    pytest.importorskip("pyarrow")
+    scans = tmp_path / "scans"
+    _write_scans(scans, [13, 14])
+    for name in ("results.parquet", "results.xlsx"):
+        out = tmp_path / name
+        assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+        # the second run reads hashes from the checkpoint, not the binary output
+        assert main(["evaluate", str(scans), "--out", str(out), *ARGS]) == 0
+    assert not list(tmp_path.glob("results.part*.parquet"))  # nothing left to write
+    (tmp_path / "results.parquet.checkpoint").unlink()
+    _write_scans(scans, [15])
+    assert main(["evaluate", str(scans), "--out", str(tmp_path / "results.parquet"), *ARGS]) == 0
+    # without a checkpoint the hashes come from the Parquet file; only the new scan is graded
+    codes, _ = load_answer_table([str(tmp_path / "results.part1.parquet")])
+    assert len(codes) == 1
+
+
+def test_rescore_takes_question_count_from_answers(tmp_path):
+    pytest.importorskip("pyarrow")
+    from openpyxl import Workbook
+
+    results = tmp_path / "short.csv"
+    pd.DataFrame([{"sha256": "s1", "filename": "a.png", "student_code": "a", "sheet_version": "A",
+                   "answers": "b" * 40, "total": 0, "error": ""}]).to_csv(results, index=False)
+    wb = Workbook()
+    wb.active.title = "A"
+    wb.active.append(["Python"])
+    for q in range(1, 21):
+        wb.active.append([f"{q} - b"])
+    wb.save(tmp_path / "key.xlsx")
+    out = tmp_path / "rescored.parquet"
+    assert main(["rescore", str(results), "--key", str(tmp_path / "key.xlsx"), "--out", str(out)]) == 0
+    codes, _ = load_answer_table([str(out)])
+    assert codes.shape == (1, 40)  # the sheet's width, not settings.total_max
+    assert int(read_results(str(out))["total"][0]) == 20
@@ -0,0 +1,32 @@
+import threading
+
+from app.services.context import SheetContext, get_clahe, sheet_context
+from app.services.detect import evaluate_by_questions
+from app.services.grid import estimate_grid_rois
+from app.services.omr_template import evaluate_with_template
+from sheets import synthetic_sheet
+
+
+def test_derived_images_are_memoized_and_shared_across_services():
+    questions = estimate_grid_rois(620, 877)
+    img = synthetic_sheet(questions, seed=2)
+    ctx = SheetContext(img)
+    assert sheet_context(ctx) is ctx
+    assert ctx.clahe is ctx.clahe
+    assert ctx.edges_integral("xy") is ctx.edges_integral("xy")
+    assert ctx.downscaled(2000) is ctx
+    assert ctx.downscaled(300).shape == (300, 212)
+
+    assert evaluate_by_questions(ctx, questions) == evaluate_by_questions(img, questions)
+    for mode in ("patch", "global"):
+        assert evaluate_with_template(ctx, questions, fill_mode=mode) == evaluate_with_template(img, questions, fill_mode=mode)
+    assert {"clahe", "clahe_integral", ("binary_integral", 31, 5)} <= set(ctx._memo)
+
+
+def test_clahe_objects_are_per_thread():
+    seen = []
+    t = threading.Thread(target=lambda: seen.append(get_clahe()))
+    t.start()
+    t.join()
+    assert get_clahe() is get_clahe()
+    assert seen[0] is not get_clahe()
@@ -0,0 +1,135 @@
+from datetime import date
+
+import numpy as np
+
+from app.db.crud import (answers_matrix, backfill_packed_answers, bulk_create_evaluations, bulk_upsert_students,
+                         create_evaluation, evaluation_to_dict, pack_answers, unpack_answers, upsert_student)
+from app.db.models import Evaluation, SessionLocal, Student
+
+
+def test_answers_are_packed_and_legacy_rows_backfilled():
+    answers = ["a", "", "d", "B"] * 25
+    assert len(pack_answers(answers)) == 100
+    assert unpack_answers(pack_answers(answers)) == [a.lower() for a in answers]
+
+    db = SessionLocal()
+    try:
+        ev = create_evaluation(db, "s1", "A", {"Python": 1}, 1, {"answers": answers, "file": "s1.png"})
+        assert ev.answers_packed is not None and "answers" not in ev.details
+        assert evaluation_to_dict(ev)["details"]["answers"][:4] == ["a", "", "d", "b"]
+
+        legacy = Evaluation(student_code="s2", sheet_version="A", per_subject={}, total=0,
+                            details={"answers": ["c"] * 100, "file": "s2.png"})
+        odd = Evaluation(student_code="s3", sheet_version="A", per_subject={}, total=0,
+                         details={"answers": ["ab"]})  # not representable: stays JSON
+        db.add_all([legacy, odd])
+        db.commit()
+        assert backfill_packed_answers(db, batch_size=1) >= 1
+        db.refresh(legacy)
+        db.refresh(odd)
+        assert legacy.details == {"file": "s2.png"} and odd.answers_packed is None
+        m = answers_matrix([ev.answers_packed, legacy.answers_packed, None], 100)
+        assert m.shape == (3, 100) and np.all(m[1] == 3) and not m[2].any()
+        assert backfill_packed_answers(db) == 0
+    finally:
+        db.close()
+
+
+def test_bulk_inserts_upsert_students_in_chunks():
+    db = SessionLocal()
+    try:
+        upsert_student(db, "bk-0")
+        rows = [{"student_code": f"bk-{i % 4}", "sheet_version": "B", "per_subject": {"SQL": 1}, "total": 1,
+                 "details": {"answers": ["b"] * 10, "sha256": str(i)}} for i in range(7)]
+        assert bulk_create_evaluations(db, rows, chunk_size=3) == 7
+        bulk_upsert_students(db, ["bk-1", "bk-9", "bk-9"])
+        codes = [c for (c,) in db.query(Student.student_code).filter(Student.student_code.like("bk-%"))]
+        assert sorted(codes) == ["bk-0", "bk-1", "bk-2", "bk-3", "bk-9"]
+        stored = db.query(Evaluation).filter(Evaluation.sheet_version == "B").all()
+        assert len(stored) == 7 and all(unpack_answers(e.answers_packed) == ["b"] * 10 for e in stored)
+        assert all(e.created_at is not None and "answers" not in e.details for e in stored)
+    finally:
+        db.close()
+
+
+def test_subject_rollup_tracks_inserts_and_rebuilds():
+    from app.db.crud import rebuild_subject_rollup, subject_summary, summary_by_subject
+
+    db = SessionLocal()
+    try:
+        create_evaluation(db, "r1", "D", {"SQL": 4, "EDA": 2}, 6)
+        bulk_create_evaluations(db, [{"student_code": "r2", "sheet_version": "D",
+                                      "per_subject": {"SQL": 8}, "total": 8}])
+        summary = subject_summary(db, sheet_version="D")
+        assert summary["count"] == 2 and summary["total"]["mean"] == 7
+        assert summary["subjects"]["SQL"] == {"count": 2, "mean": 6.0, "std": 2.0}
+        assert summary["subjects"]["EDA"]["count"] == 1
+        assert subject_summary(db, sheet_version="D", until=date(2000, 1, 1))["count"] == 0
+
+        rebuild_subject_rollup(db, batch_size=2)
+        assert subject_summary(db, sheet_version="D") == summary
+        assert summary_by_subject(db)["SQL"] == subject_summary(db)["subjects"]["SQL"]["mean"]
+    finally:
+        db.close()
+
+
+def test_sqlite_engine_is_tuned_and_schema_is_explicit(tmp_path):
+    from sqlalchemy import inspect, text
+    from app.core.config import settings
+    from app.db.engine import make_engine
+    from app.db.models import init_db
+
+    engine = make_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == settings.sqlite_busy_timeout_ms
+    assert not inspect(engine).get_table_names()  # nothing created on import/connect
+    init_db(engine)
+    init_db(engine)
+    assert {"evaluations", "subject_rollups", "jobs"} <= set(inspect(engine).get_table_names())
+
+
+def test_bulk_reload_of_same_scans_is_idempotent():
+    from app.db.crud import subject_summary
+
+    db = SessionLocal()
+    try:
+        rows = [{"student_code": f"idem-{i}", "sheet_version": "IDEM", "per_subject": {"SQL": 2}, "total": 2,
+                 "details": {"answers": ["a"], "sha256": f"idem-sha-{i}"}} for i in range(3)]
+        assert bulk_create_evaluations(db, rows[:2]) == 2
+        # a crash after the commit but before the checkpoint: the chunk is loaded again
+        assert bulk_create_evaluations(db, rows) == 1
+        assert db.query(Evaluation).filter(Evaluation.sheet_version == "IDEM").count() == 3
+        assert subject_summary(db, sheet_version="IDEM")["count"] == 3
+        assert create_evaluation(db, "idem-0", "IDEM", {}, 0, {"sha256": "idem-sha-0"}).sha256 == "idem-sha-0"
+        assert db.query(Evaluation).filter(Evaluation.sheet_version == "IDEM").count() == 3
+    finally:
+        db.close()
+
+
+def test_date_filtered_pages_walk_the_created_at_index():
+    from datetime import datetime, timedelta
+    from sqlalchemy import text
+    from app.db.crud import page_evaluations
+
+    db = SessionLocal()
+    try:
+        start = datetime.utcnow() - timedelta(seconds=1)
+        bulk_create_evaluations(db, [{"student_code": f"win-{i}", "sheet_version": "WIN", "per_subject": {},
+                                      "total": i} for i in range(5)])  # one created_at for the chunk
+        create_evaluation(db, "win-5", "WIN", {}, 5)
+        seen, cursor = [], None
+        while True:
+            rows, cursor = page_evaluations(db, limit=2, cursor=cursor, sheet_version="WIN", since=start)
+            seen += [r["id"] for r in rows]
+            if cursor is None:
+                break
+        ids = [e.id for e in db.query(Evaluation).filter(Evaluation.sheet_version == "WIN")]
+        assert seen == sorted(ids, reverse=True)
+        plan = " ".join(str(r[-1]) for r in db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM evaluations WHERE created_at >= :s "
+            "ORDER BY created_at DESC, id DESC LIMIT 3"), {"s": start}))
+        assert "ix_evaluations_created_id" in plan and "TEMP B-TREE" not in plan
+    finally:
+        db.close()
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+from app.services.detect import evaluate_by_questions
+from app.services.grid import estimate_grid_rois
+from sheets import synthetic_sheet
+
+
+def _legacy_evaluate(img, questions, scale_x=1.0, scale_y=1.0, offset_x=0.0, offset_y=0.0):
+    """Reference per-ROI loop the vectorized engine must reproduce exactly."""
+    gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY))
+    h, w = gray.shape
+
+    def roi(n):
+        x0, y0, x1, y1 = n[0] * scale_x + offset_x, n[1] * scale_y + offset_y, n[2] * scale_x + offset_x, n[3] * scale_y + offset_y
+        return (int(max(0, min(w - 1, x0 * w))), int(max(0, min(h - 1, y0 * h))),
+                int(max(0, min(w, x1 * w))), int(max(0, min(h, y1 * h))))
+
+    def gap(vals, looseness, min_jump, default_thr):
+        if not vals:
+            return default_thr
+        vs = sorted(vals)
+        ls = max(1, (looseness + 1) // 2)
+        max_jump, thr = min_jump, default_thr
+        for i in range(ls, len(vs) - ls):
+            jump = vs[i + ls] - vs[i - ls]
+            if jump > max_jump:
+                max_jump, thr = jump, vs[i - ls] + jump / 2.0
+        return float(thr)
+
+    per_q, all_vals = [], []
+    for q in sorted(questions, key=lambda qq: qq.get("index", 0)):
+        vals = {}
+        for opt, n in q.get("options", {}).items():
+            x0, y0, x1, y1 = roi(n)
+            patch = gray[y0:y1, x0:x1]
+            vals[opt] = float(np.mean(patch)) if patch.size else 255.0
+            all_vals.append(vals[opt])
+        per_q.append(vals)
+    global_thr = gap(all_vals, 3, 6.0, 160.0)
+    answers = []
+    for vals in per_q:
+        thr = gap(list(vals.values()), 1, 4.0, global_thr)
+        below = {k: v for k, v in vals.items() if v <= thr}
+        if not below:
+            answers.append("")
+            continue
+        best, best_val = min(below.items(), key=lambda kv: kv[1])
+        others = [v for k, v in below.items() if k != best]
+        answers.append("" if others and min(others) - best_val < 6.0 else best)
+    return answers
+
+
+def test_vectorized_engine_matches_legacy_loop():
+    questions = estimate_grid_rois(620, 877)
+    for seed in range(4):
+        img = synthetic_sheet(questions, seed=seed)
+        for adj in [(1.0, 1.0, 0.0, 0.0), (1.02, 0.97, -0.01, 0.015), (1.1, 1.1, 0.05, 0.05)]:
+            assert evaluate_by_questions(img, questions, *adj) == _legacy_evaluate(img, questions, *adj)
+
+
+def test_ragged_and_empty_questions():
+    questions = estimate_grid_rois(400, 560)[:6]
+    questions[2] = {"index": 3, "options": {"a": questions[2]["options"]["a"]}}
+    questions[4] = {"index": 5, "options": {}}
+    img = synthetic_sheet(questions, w=400, h=560, seed=7)
+    assert evaluate_by_questions(img, questions) == _legacy_evaluate(img, questions)
+    assert evaluate_by_questions(img, []) == []
@@ -0,0 +1,36 @@
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.grid import estimate_grid_rois
+from app.services.imageio import decode_image, reduction_factor
+from sheets import synthetic_sheet
+
+
+def _encode(img, ext):
+    _, buf = cv2.imencode(ext, img)
+    return buf.tobytes()
+
+
+def test_jpeg_decodes_reduced_grayscale_above_max_side():
+    img = synthetic_sheet(estimate_grid_rois(800, 1100), w=800, h=1100)
+    data = _encode(img, ".jpg")
+    assert reduction_factor(800, 1100, 500) == 2
+    out = decode_image(data, max_side=500)
+    assert out.shape == (550, 400) and out.dtype == np.uint8
+    assert decode_image(data).shape == (1100, 800)
+    assert decode_image(data, max_side=500, gray=False).shape == (550, 400, 3)
+
+
+def test_png_full_size_and_pil_fallback():
+    img = synthetic_sheet(estimate_grid_rois(300, 400), w=300, h=400, channels=1)
+    assert np.array_equal(decode_image(_encode(img, ".png"), max_side=100), img)
+    # GIF isn't an OpenCV codec; it goes through PIL
+    buf = BytesIO()
+    Image.fromarray(img).save(buf, format="GIF")
+    assert decode_image(buf.getvalue()).shape == (400, 300)
+    with pytest.raises(ValueError):
+        decode_image(b"not an image")
@@ -0,0 +1,86 @@
+import io
+import os
+
+import cv2
+from openpyxl import load_workbook
+from fastapi.testclient import TestClient
+
+from app.db.models import SessionLocal
+from app.main import app
+from app.services.batch import SheetResult
+from app.services.grid import estimate_grid_rois
+from app.services.jobs import claim_items, complete_item, create_job, job_dir, purge_finished_uploads, run_worker
+from sheets import synthetic_sheet
+
+
+def _png(seed):
+    return cv2.imencode(".png", synthetic_sheet(estimate_grid_rois(620, 877), seed=seed))[1].tobytes()
+
+
+def test_job_is_queued_then_drained_by_worker():
+    client = TestClient(app)
+    resp = client.post("/api/jobs/", data={"sheet_version": "B", "rectify": "false"}, files=[
+        ("files", ("a.png", _png(0), "image/png")),
+        ("files", ("b.png", b"garbage", "image/png")),
+        ("files", ("c.png", _png(1), "image/png")),
+    ])
+    assert resp.status_code == 202
+    job = resp.json()
+    assert job["status"] == "queued" and job["total"] == 3
+
+    assert os.path.isdir(job_dir(job["id"]))
+    assert run_worker(owner="test", once=True) >= 3
+    status = client.get(f"/api/jobs/{job['id']}").json()
+    assert (status["status"], status["processed"], status["failed"]) == ("done", 3, 1)
+    assert not os.path.exists(job_dir(job["id"]))  # uploads go once the job is done
+    assert status["items"] == {"done": 2, "error": 1} and status["eta_seconds"] == 0.0
+    results = client.get(f"/api/jobs/{job['id']}/results", params={"after": 0}).json()
+    assert [r["name"] for r in results] == ["b.png", "c.png"]
+    assert results[0]["status"] == "error" and len(results[1]["answers"]) == 100
+    assert client.get("/api/jobs/999999").status_code == 404
+
+    xlsx = client.get(f"/api/jobs/{job['id']}/export", params={"answer_grids": True})
+    assert xlsx.status_code == 200
+    wb = load_workbook(io.BytesIO(xlsx.content), read_only=True)
+    assert wb.sheetnames == ["Summary", "Answers_a.png", "Answers_c.png"]
+    assert [r[0] for r in wb["Summary"].iter_rows(min_row=2, values_only=True)] == ["a.png", "b.png", "c.png"]
+    csv_rows = client.get(f"/api/jobs/{job['id']}/export", params={"format": "csv"}).text.splitlines()
+    assert len(csv_rows) == 4 and csv_rows[0].startswith("sha256,filename")
+
+
+def test_expired_lease_is_reclaimed_and_stale_owner_loses_it():
+    db = SessionLocal()
+    try:
+        job = create_job(db, "A", [("x.png", _png(2))])
+        (item,) = [i for i in claim_items(db, "dead-worker", 100, lease_seconds=-1) if i.job_id == job.id]
+        (again,) = [i for i in claim_items(db, "live-worker", 100) if i.job_id == job.id]
+        assert again.id == item.id and again.attempts == 2
+        assert not complete_item(db, item, "dead-worker", SheetResult(0, "x.png"))
+        assert complete_item(db, again, "live-worker", SheetResult(0, "x.png"))
+    finally:
+        db.close()
+
+
+def test_purge_removes_uploads_of_finished_jobs_and_old_orphans():
+    import time
+
+    db = SessionLocal()
+    try:
+        job = create_job(db, "A", [("x.png", _png(3))])
+        fresh, old = job_dir(987654), job_dir(987655)
+        os.makedirs(fresh)  # e.g. a create_job that hasn't committed yet
+        os.makedirs(old)
+        past = time.time() - 2 * 86_400
+        os.utime(old, (past, past))
+        purge_finished_uploads(db)
+        assert not os.path.exists(old)
+        assert os.path.isdir(fresh) and os.path.isdir(job_dir(job.id))  # queued job keeps its files
+    finally:
+        db.close()
+
+
+def test_corrupt_zip_job_is_rejected():
+    client = TestClient(app)
+    resp = client.post("/api/jobs/", data={"sheet_version": "A"},
+                       files=[("archive", ("scans.zip", b"PK not really a zip", "application/zip"))])
+    assert resp.status_code == 400 and "ZIP" in resp.json()["detail"]
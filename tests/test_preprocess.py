@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+from app.services.grid import estimate_grid_rois
+from app.services.preprocess import detect_orientation, rectify_perspective, rotate_image
+from sheets import synthetic_sheet
+
+
+def test_orientation_decides_axis_and_skips_copy_at_zero():
+    img = synthetic_sheet(estimate_grid_rois(620, 877), seed=3)
+    out, deg = detect_orientation(img)
+    turned = rotate_image(img, 90)
+    out_turned, deg_turned = detect_orientation(turned)
+    # A quarter turn flips the decision and both inputs land on the same axis
+    assert (deg, deg_turned) == (90, 0)
+    assert out.shape == out_turned.shape
+    assert out_turned is turned
+
+
+def test_rectify_refines_proxy_corners_and_warps_to_working_size():
+    sheet = synthetic_sheet(estimate_grid_rois(620, 877), seed=1)
+    src = np.float32([[0, 0], [619, 0], [619, 876], [0, 876]])
+    dst = np.float32([[130, 105], [1380, 150], [1410, 1900], [90, 1850]])
+    m = cv2.getPerspectiveTransform(src, dst)
+    inside = cv2.warpPerspective(np.full((877, 620), 255, np.uint8), m, (1500, 2000)) > 0
+    img = np.where(inside[..., None], cv2.warpPerspective(sheet, m, (1500, 2000)), np.uint8(40))
+
+    out = rectify_perspective(img, out_size=(620, 877), max_side=500)
+    assert out.shape == sheet.shape
+    # Proxy corners alone are off by several full-resolution pixels; refined ones line up
+    assert np.mean(np.abs(out.astype(np.int16) - sheet)) < 12
+    assert rectify_perspective(img, max_side=500).shape[:2] != (877, 620)
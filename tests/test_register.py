@@ -0,0 +1,46 @@
+import numpy as np
+import cv2
+
+from app.services.register import register_template, Registration
+from app.services.template import compile_template
+from sheets import bubble_sheet
+
+
+def _questions():
+    qs = []
+    for q in range(1, 61):
+        col, row = divmod(q - 1, 30)
+        y0 = 0.06 + row * 0.029
+        qs.append({"index": q, "options": {o: [0.08 + col * 0.46 + i * 0.1, y0, 0.16 + col * 0.46 + i * 0.1, y0 + 0.018]
+                                            for i, o in enumerate("abcd")}})
+    return qs
+
+
+def test_recovers_scale_and_offset_on_periodic_layout():
+    tpl = compile_template(_questions())
+    img = bubble_sheet(_questions(), w=1240, h=1754, scale_x=1.04, scale_y=0.97, offset_x=0.02, offset_y=-0.015)
+    reg = register_template(img, tpl)
+    assert abs(reg.scale_x - 1.04) < 0.004 and abs(reg.scale_y - 0.97) < 0.004
+    assert abs(reg.offset_x - 0.02) < 0.003 and abs(reg.offset_y + 0.015) < 0.003
+    assert set(reg.params()) == {"scale_x", "scale_y", "offset_x", "offset_y"}
+
+
+def test_runtime_bounded_by_working_size():
+    # A huge scan is capped to max_side first; the estimate is unchanged in normalized units
+    small = bubble_sheet(_questions(), w=1240, h=1754, offset_x=0.01)
+    big = cv2.resize(small, (3720, 5262), interpolation=cv2.INTER_LINEAR)
+    a = register_template(small, _questions())
+    b = register_template(big, _questions(), max_side=1754)
+    assert abs(a.offset_x - b.offset_x) < 0.002 and abs(a.scale_x - b.scale_x) < 0.002
+
+
+def test_warp_applies_inverse_mapping():
+    reg = Registration(offset_x=0.1)
+    img = np.zeros((100, 200), dtype=np.uint8)
+    img[:, 120] = 255  # content sits 0.1 to the right of where the template expects it
+    assert np.argmax(reg.warp(img)[50]) == 100
+
+
+def test_fit_axis_without_levels_keeps_identity():
+    from app.services.register import _fit_axis
+    assert _fit_axis([], np.array([[0.1, 0.2]]), 0.1, 0.1) == (1.0, 0.0)
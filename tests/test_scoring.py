@@ -0,0 +1,34 @@
+import numpy as np
+
+from app.services.omr import compute_scores_from_answers
+from app.services.scoring import (compile_keys, decode_answers, encode_answer_strings, encode_answers,
+                                  score_batch, subject_scores)
+
+
+def test_batch_scores_match_per_sheet_scoring_across_sets():
+    rng = np.random.default_rng(0)
+    keys = {v: {q: "abcd"[rng.integers(4)] for q in range(1, 101) if q % 7} for v in "ABCD"}
+    key = compile_keys(keys)
+    answers = rng.integers(0, 5, size=(40, 100)).astype(np.uint8)
+    sets = ["ABCD"[i] for i in rng.integers(0, 4, size=40)]
+
+    per_subject, total = score_batch(answers, key, sets)
+    for i in range(40):
+        expected, expected_total = compute_scores_from_answers(decode_answers(answers[i]), keys[sets[i]])
+        assert subject_scores(per_subject[i], key) == expected and total[i] == expected_total
+    assert np.array_equal(score_batch(answers, key, key.set_indices(sets))[1], total)
+
+
+def test_answer_encodings():
+    assert encode_answers(["a", "", None, "D", "x?"]).tolist() == [1, 0, 0, 4, 0]
+    assert encode_answer_strings(["ab-D", "c"], 4).tolist() == [[1, 2, 0, 4], [3, 0, 0, 0]]
+    # Answers shorter than the key count as blank
+    per_subject, total = score_batch(encode_answer_strings(["a"], 1), compile_keys({"A": {1: "A", 2: "b"}}))
+    assert total.tolist() == [1]
+
+
+def test_subject_onehot_is_public_and_read_only():
+    key = compile_keys({"A": {1: "a", 21: "b"}})
+    onehot = key.subject_onehot
+    assert onehot.shape == (key.num_questions, len(key.subjects)) and not onehot.flags.writeable
+    assert np.array_equal(onehot.argmax(axis=1), key.subject_ids)
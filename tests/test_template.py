@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from app.services.grid import estimate_grid_rois
+from app.services.omr_template import evaluate_with_template, draw_overlay
+from app.services.template import CompiledTemplate, compile_template
+from sheets import synthetic_sheet
+
+TEMPLATE_PATH = Path(__file__).resolve().parents[1] / "templates" / "example_template.json"
+
+
+def test_compile_example_template():
+    tpl = CompiledTemplate.from_json(TEMPLATE_PATH.read_text())
+    raw = json.loads(TEMPLATE_PATH.read_text())
+    assert tpl.num_questions == len(raw["questions"])
+    assert tpl.num_options == 4 * tpl.num_questions
+    assert tpl.boxes.flags["C_CONTIGUOUS"] and not tpl.boxes.flags.writeable
+    assert list(tpl.option_labels[:4]) == ["a", "b", "c", "d"]
+    assert tpl.subjects[tpl.subject_ids[0]] == "Python"
+    assert compile_template(tpl) is tpl
+
+
+def test_pixel_boxes_are_cached_per_geometry():
+    tpl = compile_template(estimate_grid_rois(0, 0))
+    a = tpl.pixel_boxes(620, 877, 1.0, 1.0, 0.01, 0.0)
+    assert tpl.pixel_boxes(620, 877, 1.0, 1.0, 0.01, 0.0) is a
+    assert tpl.pixel_boxes(620, 877, 1.0, 1.0, 0.02, 0.0) is not a
+    # clamped like the per-ROI code: starts inside the image, ends at most at the edge
+    far = tpl.pixel_boxes(620, 877, 1.1, 1.1, 0.05, 0.05)
+    assert far[:, 0].max() <= 619 and far[:, 2].max() <= 620 and far[:, 3].max() <= 877
+
+
+def test_template_services_accept_compiled_and_dict():
+    questions = estimate_grid_rois(0, 0)
+    img = synthetic_sheet(questions, seed=3)
+    tpl = compile_template(questions)
+    answers = evaluate_with_template(img, tpl)
+    assert answers == evaluate_with_template(img, {"questions": questions})
+    assert len(answers) == 100
+    vis = draw_overlay(img[..., 0], tpl, answers)
+    assert vis.shape == img.shape and not np.array_equal(vis, img)
+
+
+def test_global_fill_mode_reads_marks_on_small_patches():
+    # 48x12 px options: smaller than the 31 px threshold window
+    w, h = 600, 800
+    questions, truth = [], []
+    img = np.full((h, w), 235, dtype=np.uint8)
+    for q in range(1, 41):
+        y0 = 0.05 + (q - 1) * 0.022
+        opts = {o: [0.1 + i * 0.12, y0, 0.18 + i * 0.12, y0 + 0.015] for i, o in enumerate("abcd")}
+        questions.append({"index": q, "options": opts})
+        pick = "abcd"[q % 4] if q % 5 else ""
+        truth.append(pick)
+        if pick:
+            x0, y0_, x1, y1 = opts[pick]
+            img[int(y0_ * h):int(y1 * h), int(x0 * w):int(x1 * w)] = 40
+    assert evaluate_with_template(img, {"questions": questions}, fill_mode="global") == truth
+
+
+def test_pixel_boxes_cache_is_thread_safe_and_picklable():
+    import pickle
+    from concurrent.futures import ThreadPoolExecutor
+
+    tpl = compile_template(estimate_grid_rois(0, 0))
+    tpl._cache_size = 4
+    geometries = [(620, 877, 1.0, 1.0, i / 1000, 0.0) for i in range(40)]
+    with ThreadPoolExecutor(8) as pool:
+        boxes = list(pool.map(lambda g: tpl.pixel_boxes(*g), geometries * 5))
+    assert len(tpl._pixel_cache) <= 4 and all(b.shape == (400, 4) for b in boxes)
+    clone = pickle.loads(pickle.dumps(tpl))
+    assert np.array_equal(clone.pixel_boxes(*geometries[0]), boxes[0])
@@ -0,0 +1,27 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.workpool import Overloaded, WorkPool
+
+
+def test_admission_control_rejects_when_full():
+    pool = WorkPool(workers=1, max_queue=1)
+    gate = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(gate.wait, 5))
+        second = asyncio.ensure_future(pool.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        assert pool.stats()["running"] == 1 and pool.stats()["queued"] == 1
+        with pytest.raises(Overloaded) as exc:
+            await pool.run(lambda: "rejected")
+        assert exc.value.retry_after >= 1
+        gate.set()
+        return await first, await second
+
+    assert asyncio.run(scenario()) == (True, "queued")
+    stats = pool.stats()
+    assert (stats["admitted"], stats["rejected"], stats["queued"]) == (2, 1, 0)
+    pool.shutdown()